@@ -0,0 +1,163 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from io import StringIO
+from multiprocessing import get_start_method
+from os import cpu_count
+from os.path import join, isfile, abspath
+from time import perf_counter
+from traceback import print_exc
+from pilgrim import add_port_arguments, port
+from tools.colors import RED_TEXT, GREEN_TEXT, YELLOW_TEXT, BLUE_TEXT, CLEAR_TEXT, BOLD_TEXT
+
+# pilgrim batch ports many projects in one go. Where worker processes are forked (the default on Linux before Python 3.14),
+# the vanilla ROMs and the symbol index are loaded once, before the workers start, and every worker shares them copy-on-write.
+# With spawn or forkserver (Windows, macOS, Linux from 3.14), sharing would mean pickling every ROM into every worker,
+# which costs about as much as loading them, so each worker loads what it needs itself instead.
+
+SHARED_ROM_KEYS = ["Vanilla EU", "Vanilla NA"]
+batch_shared_roms = None  # Absolute path: LoadedRom, in each worker process
+
+
+class BatchResult:
+    def __init__(self, project_dir: str, success: bool, output: str, duration: float, files: dict | None = None):
+        self.project_dir = project_dir
+        self.success = success
+        self.output = output  # Everything the project printed
+        self.duration = duration
+        self.files = files  # What port() returned
+
+
+def batch_main(batch_argv: list[str]):
+    parser = ArgumentParser(
+        prog="pmdsky-pilgrim batch",
+        description="Port many Pilgrim projects at once, sharing the vanilla ROMs between them.",
+        usage="pmdsky-pilgrim batch [project_dirs ...] [options]",
+        add_help=False,
+    )
+    parser.add_argument("-h", "--help", action="help", help="Show this help message and exit")
+    parser.add_argument(
+        "project_dirs", type=str, nargs="+", help="Required. Paths to existing Pilgrim project directories."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count() or 1,
+        help="How many projects to port at the same time. Defaults to the number of CPUs.",
+    )
+    add_port_arguments(parser)
+    args = parser.parse_args(batch_argv)
+    if args.jobs < 1:
+        print(f"{RED_TEXT}--jobs must be at least 1!{CLEAR_TEXT}")
+        exit(1)
+
+    results = []
+    to_port = []
+    seen = set()
+    for project_dir in args.project_dirs:
+        # The same project ported twice at once would write the same output.
+        if abspath(project_dir) in seen:
+            continue
+        seen.add(abspath(project_dir))
+        # Unlike a single port, batch never creates projects.
+        if isfile(join(project_dir, "config.yml")):
+            to_port.append(project_dir)
+        else:
+            result = BatchResult(project_dir, False, "config.yml was missing. This isn't a Pilgrim project.\n", 0.0)
+            results.append(result)
+            print_batch_result(result)
+
+    shared_roms = {}
+    if get_start_method() == "fork":
+        print(f"{YELLOW_TEXT}Loading shared vanilla ROMs...{CLEAR_TEXT}")
+        shared_roms = load_shared_roms(to_port, args.rehash)
+        for loaded in shared_roms.values():
+            print(f"  {loaded.path}: {loaded}")
+        from tools.find_offset import load_symbol_index
+
+        load_symbol_index()  # Loaded here so every worker inherits it
+
+    workers = max(min(args.jobs, len(to_port)), 1)
+    print(f"{BLUE_TEXT}{BOLD_TEXT}Porting {len(to_port)} project(s) with {workers} worker(s)...{CLEAR_TEXT}")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=(shared_roms,)) as executor:
+        futures = {executor.submit(port_batch_project, project_dir, args): project_dir for project_dir in to_port}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # The worker itself died
+                result = BatchResult(futures[future], False, f"{type(e).__name__}: {e}\n", 0.0)
+            results.append(result)
+            print_batch_result(result)
+
+    print_batch_summary(results)
+    if not all(result.success for result in results):
+        exit(1)
+
+
+def load_shared_roms(project_dirs: list[str], rehash: bool) -> dict:
+    """Loads every vanilla ROM any of the projects use, once per file. Returns {absolute path: LoadedRom}. Projects whose config can't be read are left to fail when they're ported."""
+    from tools.project_loader import load_project
+    from tools.rom_loader import LoadedRom, ingest_rom
+    from tools.hash_validation import load_hash_cache
+
+    shared_roms = {}
+    for project_dir in project_dirs:
+        try:
+            with redirect_stdout(StringIO()):
+                config = load_project(project_dir)
+        except (SystemExit, Exception):
+            continue
+        for key in SHARED_ROM_KEYS:
+            if key not in config.get("Roms", {}):
+                continue
+            rom_path = abspath(join(config["Root"], config["Roms"][key]))
+            if rom_path in shared_roms or not isfile(rom_path):
+                continue
+            shared_roms[rom_path] = ingest_rom(LoadedRom(key, rom_path), load_hash_cache(config), rehash)
+    return shared_roms
+
+
+def init_batch_worker(shared_roms: dict):
+    global batch_shared_roms
+    batch_shared_roms = shared_roms
+
+
+def port_batch_project(project_dir: str, args: Namespace) -> BatchResult:
+    """Ports one project in a worker process, capturing what it prints. Exits and exceptions only fail this project."""
+    output = StringIO()
+    start = perf_counter()
+    project_args = Namespace(**vars(args), project_dir=project_dir)
+    files = None
+    with redirect_stdout(output):
+        try:
+            files = port(project_args, batch_shared_roms)
+            success = True
+        except SystemExit as e:
+            success = e.code is None or e.code == 0
+        except Exception:
+            print_exc(file=output)
+            success = False
+    return BatchResult(project_dir, success, output.getvalue(), perf_counter() - start, files)
+
+
+def print_batch_result(result: BatchResult):
+    status = f"{GREEN_TEXT}done" if result.success else f"{RED_TEXT}failed"
+    print(f"{BOLD_TEXT}=== {result.project_dir}: {status}{CLEAR_TEXT} ({result.duration:.2f}s)")
+    print(result.output, end="")
+
+
+def print_batch_summary(results: list[BatchResult]):
+    succeeded = [result for result in results if result.success]
+    print(f"{BOLD_TEXT}Batch summary: {len(succeeded)}/{len(results)} project(s) ported{CLEAR_TEXT}")
+    for result in results:
+        if result.success:
+            print(f"  {GREEN_TEXT}OK{CLEAR_TEXT}     {result.project_dir} ({result.duration:.2f}s)")
+        else:
+            print(f"  {RED_TEXT}FAILED{CLEAR_TEXT} {result.project_dir}")
@@ -6,19 +6,28 @@
 
 from sys import argv
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
-from tools.project_loader import load_project, get_rom_if_exists
-from tools.hash_validation import verify_vanilla_eu, verify_vanilla_na
-from tools.asm_patch import get_applied_list, apply_patches
-from tools.bg_list import create_na_bg_list
-from tools.special_process_converter import SPConverter
 from tools.colors import RED_TEXT, GREEN_TEXT, YELLOW_TEXT, BLUE_TEXT, CLEAR_TEXT, BOLD_TEXT
+from tools.profiler import profiler, span, run_profiled
+
+# The tool modules pull in skytemple_files, capstone, ndspy and pmdsky_debug_py, which take a while to import.
+# They're imported inside the stage that first needs them, so --help and config errors don't pay for any of that.
 
 
 def main() -> None:
+    if len(argv) > 1 and argv[1] == "batch":
+        from batch import batch_main
+
+        batch_main(argv[2:])
+        return
+    if len(argv) > 1 and argv[1] == "serve":
+        from server import serve_main
+
+        serve_main(argv[2:])
+        return
     parser = ArgumentParser(
         prog="pmdsky-pilgrim",
         description="Tool to port EU ROMhacks of PMD:EoS to the NA release",
-        usage="pmdsky-pilgrim [project_dir] [options]",
+        usage="pmdsky-pilgrim [project_dir] [options]\n       pmdsky-pilgrim batch [project_dirs ...] [options]\n       pmdsky-pilgrim serve [options]",
         formatter_class=RawDescriptionHelpFormatter,
         add_help=False,
     )
@@ -30,12 +39,22 @@ def main() -> None:
         type=str,
         help="""Required. Path to Pilgrim project directory. If the project does not exist, one will be created at the provided path.""",
     )
+    add_port_arguments(parser)
     parser.add_argument(
-        "-c",
-        "--check",
+        "-w",
+        "--watch",
         action="store_true",
         default=False,
-        help="Show a list of which converters Pilgrim will need to run for the provided ROMs.",
+        help="Keep running, and port the project again whenever its config, skypatches or input ROMs change.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        metavar="TRACE_FILE",
+        help="Show how much time and memory each stage took. If a file is given, also save a trace of every stage, patch and SP to it, which chrome://tracing or Perfetto can open.",
     )
 
     if len(argv) == 1:
@@ -43,6 +62,57 @@ def main() -> None:
         parser.exit()
 
     args = parser.parse_args()
+    if args.watch:
+        from watch import watch
+
+        watch(args)
+    else:
+        port_and_profile(args)
+
+
+def add_port_arguments(parser: ArgumentParser):
+    """Adds the options that apply to every project being ported."""
+    parser.add_argument(
+        "-c",
+        "--check",
+        action="store_true",
+        default=False,
+        help="Show a list of which converters Pilgrim will need to run for the provided ROMs.",
+    )
+    parser.add_argument(
+        "--rehash",
+        action="store_true",
+        default=False,
+        help="Hash vanilla ROMs again even if they haven't changed since they were last verified.",
+    )
+    parser.add_argument(
+        "--bps",
+        action="store_true",
+        default=False,
+        help="Also create a BPS patch from vanilla NA to the output ROM, next to the output ROM.",
+    )
+
+
+def port_and_profile(args, shared_roms: dict | None = None):
+    """Runs port(), profiling it if --profile was given."""
+    if args.profile is None:
+        return port(args, shared_roms)
+    profiler.start()
+    try:
+        return port(args, shared_roms)
+    finally:
+        profiler.stop()
+        print(f"{BOLD_TEXT}Profile:{CLEAR_TEXT}")
+        profiler.print_summary()
+        if args.profile != "":
+            profiler.write_trace(args.profile)
+            print(f"Trace saved to {args.profile}")
+
+
+def port(args, shared_roms: dict | None = None) -> dict[str, str | None] | None:
+    """Ports the project at args.project_dir. shared_roms holds vanilla ROMs that are already loaded, see ingest_roms.
+    Returns the paths of the files written, see write_output, or None with --check."""
+    from tools.project_loader import load_project
 
     print(f"{BLUE_TEXT}Loading project...{CLEAR_TEXT}")
     config = load_project(args.project_dir)
@@ -50,40 +120,235 @@ def main() -> None:
     if "Roms" not in config:
         print(f"{RED_TEXT}Roms not present in config!{CLEAR_TEXT}")
         exit(1)
+    with span("load_roms"):
+        roms = load_roms(config, args.rehash, shared_roms)
+
+    from tools.asm_patch import PatchSession
+    from tools.rom_changes import RomSnapshot
+    from tools.stage_graph import StageGraph, rom_file_digest, rom_folder_digest
+
+    # Every stage below is skipped (and its changes to the ROMs replayed) if its inputs haven't changed since the last run.
+    graph = StageGraph(config, roms)
+    na_snapshot = RomSnapshot(roms["Vanilla NA"].rom)  # Lets the output only write what the stages changed
+    session = PatchSession(config)  # Shared by every ASM stage, so skypatches are only loaded once
+    skypatch_hashes = [skypatch.sha256 for skypatch in session.skypatches]
+    applied_ready = graph.run(
+        "asm_detect",
+        [roms["Mod EU"].sha256, skypatch_hashes, config["Patches"]],
+        lambda: check_asm_patches(roms["Mod EU"], config, session),
+    )
+    if args.check:
+        print_needed_converters(roms, applied_ready, config)
+        return
+    graph.run(
+        "asm_apply",
+        [
+            roms["Vanilla NA"].sha256,
+            roms["Vanilla EU"].sha256,
+            skypatch_hashes,
+            applied_ready,
+            config["Patches"]["Include"],
+        ],
+        lambda: apply_asm(roms, applied_ready, config, session),
+        modifies=["Vanilla NA", "Vanilla EU"],
+    )
+    check_bg_contents = bg_config(config)["Check contents"]
+    graph.run(
+        "bg_list",
+        [
+            rom_file_digest(roms["Mod EU"].rom, "MAP_BG/bg_list.dat"),
+            check_bg_contents,
+            # With contents checked, edits to any background file matter.
+            rom_folder_digest(roms["Mod EU"].rom, "MAP_BG") if check_bg_contents else None,
+        ],
+        lambda: port_bg_list(roms, check_bg_contents),
+        depends_on=["asm_apply"],
+        modifies=["Vanilla NA"],
+    )
+    # SPs only read process.bin, which bg_list doesn't touch, so changing bg_list doesn't reconvert them.
+    graph.run(
+        "sp",
+        [
+            rom_file_digest(roms["Mod EU"].rom, "BALANCE/process.bin"),
+            "ExtractSPCode" in applied_ready,
+            config.get("OffsetMaps"),
+        ],
+        lambda: convert_sps(roms, applied_ready, config),
+        depends_on=["asm_apply"],
+        modifies=["Vanilla NA"],
+    )
+    # TODO: idfk everything??? make the list of what requires conversion
+    with span("write_output"):
+        return write_output(roms, na_snapshot, config, args.bps)
+
+
+def load_roms(config, rehash: bool, shared_roms: dict | None = None):
+    """Loads all input ROMs, and verifies the vanilla ones unless config says not to."""
+    from tools.rom_loader import ingest_roms
+    from tools.hash_validation import VANILLA_EU_SHA256, VANILLA_NA_SHA256
+
+    print(f"{YELLOW_TEXT}Loading ROMs...{CLEAR_TEXT}")
+    roms = ingest_roms(config, rehash, shared_roms)
+    for loaded in roms.values():
+        print(f"  {loaded}")
     if not config["Roms"]["Ignore hashes"]:
         print(f"{YELLOW_TEXT}Verifying ROMs...{CLEAR_TEXT}")
-        if not verify_vanilla_eu(config):
+        if roms["Vanilla EU"].sha256 != VANILLA_EU_SHA256:
             print(f"{RED_TEXT}Vanilla EU did not match expected hash. This ROM isn't vanilla.{CLEAR_TEXT}")
             exit(1)
-        if not verify_vanilla_na(config):
+        if roms["Vanilla NA"].sha256 != VANILLA_NA_SHA256:
             print(f"{RED_TEXT}Vanilla NA did not match expected hash. This ROM isn't vanilla.{CLEAR_TEXT}")
             exit(1)
         print(f"{GREEN_TEXT}ROMs OK!{CLEAR_TEXT}")
-    vanilla_eu = get_rom_if_exists(config, "Vanilla EU")
-    na = get_rom_if_exists(config, "Vanilla NA")
-    mod_eu = get_rom_if_exists(config, "Mod EU")
+    return roms
+
+
+def check_asm_patches(mod_eu, config, session) -> list[str]:
+    """Returns the list of ASM patches to apply, or exits if there are any issues with them. Takes the loaded mod EU ROM, so detection can be skipped if it hasn't changed."""
+    from tools.asm_patch import get_applied_list
 
     print(f"{YELLOW_TEXT}Checking ASM patches...{CLEAR_TEXT}")
-    applied_ready, issues = get_applied_list(mod_eu, config)
+    applied_ready, issues = get_applied_list(mod_eu.rom, config, session, mod_eu.sha256)
     if len(issues) > 0:
         print(f"{RED_TEXT}{len(issues)} issue(s) were encountered preparing to apply ASM patches.{CLEAR_TEXT}")
         for i in range(len(issues)):
             print(f"{RED_TEXT}Issue {i + 1}: {issues[i]}{CLEAR_TEXT}")
         exit(1)
-    if len(applied_ready) > 0:
-        print(f"{GREEN_TEXT}ASM patches OK!{CLEAR_TEXT}\n{BLUE_TEXT}{BOLD_TEXT}Applying ASM to NA...{CLEAR_TEXT}")
-        apply_patches(na, applied_ready, config)
-        print(
-            f"{BLUE_TEXT}{BOLD_TEXT}Applying ASM to vanilla EU...{CLEAR_TEXT} (this is only to improve difference detection!)"
-        )
-        apply_patches(vanilla_eu, applied_ready, config)
-    else:
+    return applied_ready
+
+
+def apply_asm(roms, applied_ready: list[str], config, session):
+    """Applies ASM patches to vanilla NA and vanilla EU at the same time, each in its own process. Exits if either fails."""
+    if len(applied_ready) == 0:
         print(f"No ASM to apply!{CLEAR_TEXT}")
-    create_na_bg_list(vanilla_eu, mod_eu, na)  # Port bg_list.dat if needed
+        return
+    print(
+        f"{GREEN_TEXT}ASM patches OK!{CLEAR_TEXT}\n{BLUE_TEXT}{BOLD_TEXT}Applying ASM to NA and vanilla EU...{CLEAR_TEXT} (vanilla EU is only patched to improve difference detection!)"
+    )
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from skytemple_files.patch.errors import PatchPackageError
+    from tools.asm_patch import apply_patches_to_file, PatchApplyError
+
+    targets = ["Vanilla NA", "Vanilla EU"]
+    failed = False
+    with ProcessPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {
+            key: executor.submit(
+                run_profiled,
+                profiler.enabled,
+                apply_patches_to_file,
+                roms[key].path,
+                roms[key].identity,
+                applied_ready,
+                config,
+                roms[key].sha256,
+                session,
+            )
+            for key in targets
+        }
+        for key, future in futures.items():
+            try:
+                changes, spans = future.result()
+            except (PatchApplyError, PatchPackageError) as e:
+                print(f"{RED_TEXT}Applying ASM to {key} failed: {e}{CLEAR_TEXT}")
+                failed = True
+                continue
+            except BrokenProcessPool:
+                print(f"{RED_TEXT}Applying ASM to {key} failed: the process applying it crashed.{CLEAR_TEXT}")
+                failed = True
+                continue
+            changes.apply_to(roms[key].rom)
+            profiler.add_spans(spans)
+            print(f"{GREEN_TEXT}Applied ASM to {key}!{CLEAR_TEXT} Changed {changes}")
+    if failed:
+        print(f"{RED_TEXT}Aborting :({CLEAR_TEXT}")
+        exit(1)
+
+
+def bg_config(config) -> dict:
+    """Returns the Backgrounds section of config, with defaults for anything missing (projects made before it existed don't have it)."""
+    backgrounds = {"Check contents": False}
+    if config.get("Backgrounds") is not None:
+        backgrounds.update(config["Backgrounds"])
+    return backgrounds
+
+
+def port_bg_list(roms, check_contents: bool):
+    from tools.bg_list import create_na_bg_list
+
+    create_na_bg_list(
+        roms["Vanilla EU"].rom,
+        roms["Mod EU"].rom,
+        roms["Vanilla NA"].rom,
+        roms["Vanilla EU"].sha256,
+        roms["Vanilla NA"].sha256,
+        check_contents,
+    )  # Port bg_list.dat if needed
+
+
+def convert_sps(roms, applied_ready: list[str], config):
+    if "ExtractSPCode" not in applied_ready:
+        return
+    from tools.special_process_converter import SPConverter
+
+    print(f"{BLUE_TEXT}{BOLD_TEXT}Converting custom SPs...{CLEAR_TEXT}")
+    spc = SPConverter(roms["Mod EU"].rom, config)
+    spc.prepare_all()
+    spc.create_map()
+    spc.convert_all(roms["Vanilla NA"].rom)
+
+
+def write_output(roms, na_snapshot, config, bps: bool) -> dict[str, str | None]:
+    """Saves the ported ROM to Mod NA, writing only what changed since vanilla NA was loaded. Optionally creates a BPS patch as well.
+    Returns {"rom": path of the ROM, "patch": path of the patch or None}."""
+    from os.path import splitext
+    from tools.rom_loader import get_rom_path
+    from tools.rom_writer import write_rom
+
+    output_path = get_rom_path(config, "Mod NA")
+    print(f"{YELLOW_TEXT}Writing {output_path}...{CLEAR_TEXT}")
+    writer = write_rom(roms["Vanilla NA"].rom, na_snapshot, roms["Vanilla NA"].path, output_path)
+    print(f"{GREEN_TEXT}Saved Mod NA!{CLEAR_TEXT} Changed {writer.changes}")
+    patch_path = None
+    if bps:
+        from tools.bps import create_bps_patch
+
+        patch_path = f"{splitext(output_path)[0]}.bps"
+        print(f"{YELLOW_TEXT}Creating {patch_path}...{CLEAR_TEXT}")
+        # Only the ranges the writer touched can differ from vanilla NA.
+        with span("bps"):
+            patch_size = create_bps_patch(
+                roms["Vanilla NA"].path, output_path, writer.written_ranges, writer.old_ranges, patch_path
+            )
+        print(f"{GREEN_TEXT}Created BPS patch!{CLEAR_TEXT} ({patch_size} bytes)")
+    return {"rom": output_path, "patch": patch_path}
+
+
+def print_needed_converters(roms, applied_ready: list[str], config):
+    """Prints how the mod's files differ from vanilla and which converters a full run would need, for --check."""
+    from tools.bg_list import find_bgs_to_copy
+    from tools.compare import create_lists, cached_file_index
+
+    with span("compare"):
+        # Vanilla ROMs never change, so their indexes are reused across runs.
+        added, identical, different, missing = create_lists(
+            roms["Vanilla EU"].rom,
+            roms["Mod EU"].rom,
+            roms["Vanilla NA"].rom,
+            cached_file_index(config, roms["Vanilla EU"].rom, roms["Vanilla EU"].sha256),
+            cached_file_index(config, roms["Vanilla NA"].rom, roms["Vanilla NA"].sha256),
+        )
+    print(
+        f"{BOLD_TEXT}Files:{CLEAR_TEXT} {len(added)} added, {len(identical)} modified and identical in NA, {len(different)} modified and different in NA, {len(missing)} modified and missing from NA"
+    )
+    bgs_to_copy = find_bgs_to_copy(roms["Vanilla EU"].rom, roms["Mod EU"].rom, roms["Vanilla EU"].sha256)
+    print(f"{BOLD_TEXT}Converters needed:{CLEAR_TEXT}")
+    if len(applied_ready) > 0:
+        print(f"{BLUE_TEXT}ASM patches ({len(applied_ready)}):{CLEAR_TEXT} {', '.join(applied_ready)}")
+    if len(bgs_to_copy) > 0:
+        print(f"{BLUE_TEXT}bg_list.dat:{CLEAR_TEXT} {len(bgs_to_copy)} modified or added entries")
     if "ExtractSPCode" in applied_ready:
-        print(f"{BLUE_TEXT}{BOLD_TEXT}Converting custom SPs...{CLEAR_TEXT}")
-        spc = SPConverter(mod_eu, config)
-        spc.prepare_all()
-        spc.create_map()
-        spc.convert_all(na)
-    # TODO: idfk everything??? make the list of what requires conversion
+        print(f"{BLUE_TEXT}Custom SPs{CLEAR_TEXT}")
+    if len(applied_ready) == 0 and len(bgs_to_copy) == 0:
+        print(f"{GREEN_TEXT}None!{CLEAR_TEXT}")
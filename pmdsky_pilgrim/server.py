@@ -0,0 +1,454 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from argparse import ArgumentParser, Namespace
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import dumps, loads, JSONDecodeError
+from multiprocessing import Queue
+from os import cpu_count
+from os.path import join, isfile, isdir, abspath, dirname, getsize
+from queue import Empty
+from shutil import copytree, copyfileobj, rmtree
+from threading import Lock
+from time import perf_counter, monotonic
+from urllib.parse import urlsplit, parse_qs
+from uuid import uuid4
+from batch import BatchResult, init_batch_worker, port_batch_project
+from tools.colors import RED_TEXT, GREEN_TEXT, YELLOW_TEXT, BLUE_TEXT, CLEAR_TEXT, BOLD_TEXT
+
+# pilgrim serve keeps everything a port needs warm in one long-lived process: the heavy imports, the symbol index and the
+# vanilla ROMs. Jobs run in worker processes forked from it (see batch.py), so they start with all of that already loaded.
+#
+# API (JSON unless noted):
+#   POST /jobs                  {"project_dir": "...", "bps": false}: ports an existing project
+#   POST /jobs/upload?bps=1     body is a mod EU ROM: ports it with a copy of the template project
+#   GET  /jobs/<id>             the job's status, output and, once it's done, the paths of the files it wrote
+#   GET  /jobs/<id>/rom         downloads the ported ROM (binary)
+#   GET  /jobs/<id>/patch       downloads the BPS patch (binary)
+#   GET  /status                the server's vanilla ROMs, and how many jobs are queued or running
+#
+# Jobs for the same project run one at a time, in the order they were submitted.
+# Finished jobs are forgotten after --job-ttl seconds, and the projects created for uploaded ROMs are deleted with them.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8787
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_JOB_TTL = 3600  # Seconds
+MAX_UPLOAD_SIZE = 0x10000000  # 256 MB, far above any DS ROM
+MAX_JSON_SIZE = 0x10000
+DOWNLOAD_CHUNK_SIZE = 0x100000
+UPLOAD_CHUNK_SIZE = 0x100000
+# Modules every port imports, imported once before any worker starts
+WARM_MODULES = [
+    "tools.asm_patch",
+    "tools.bg_list",
+    "tools.special_process_converter",
+    "tools.stage_graph",
+    "tools.rom_writer",
+    "tools.bps",
+]
+
+
+class Job:
+    def __init__(self, project_dir: str, bps: bool, uploaded: bool):
+        self.id = uuid4().hex
+        self.project_dir = project_dir
+        self.bps = bps
+        self.uploaded = uploaded  # Was the project created for an uploaded ROM?
+        self.started = False  # Set once a worker reports that it started the job, see run_server_job
+        self.future = None
+        self.result: BatchResult | None = None
+        self.submit_time = perf_counter()
+        self.finish_time = None  # monotonic(), for expiry
+
+    @property
+    def status(self) -> str:
+        if self.result is not None:
+            return "done" if self.result.success else "failed"
+        if self.started:
+            return "running"
+        return "queued"
+
+    def to_json(self) -> dict:
+        job = {"id": self.id, "project_dir": self.project_dir, "bps": self.bps, "status": self.status}
+        if self.result is not None:
+            job["output"] = self.result.output
+            job["duration"] = self.result.duration
+            job["files"] = self.result.files
+        return job
+
+
+class PilgrimServer:
+    """Accepts port jobs and runs them on a bounded pool of warm worker processes."""
+
+    def __init__(
+        self,
+        shared_roms: dict,
+        vanilla_paths: dict[str, str],
+        template_dir: str,
+        jobs: int,
+        queue_size: int,
+        job_ttl: float = DEFAULT_JOB_TTL,
+    ):
+        from tools.cache import user_cache_dir
+
+        self.shared_roms = shared_roms
+        self.vanilla_paths = vanilla_paths  # ROM key: absolute path, for uploaded ROMs
+        self.template_dir = template_dir
+        # Every server gets its own folder, which is deleted when it stops.
+        self.upload_dir = user_cache_dir("server", "uploads", uuid4().hex)
+        self.job_ttl = job_ttl
+        self.workers = jobs
+        self.max_pending = jobs + queue_size  # Jobs running plus jobs waiting
+        self.jobs = {}  # id: Job
+        self.pending = 0
+        # project_dir: jobs waiting for the job running on the same project, since two ports of one project at once
+        # would overwrite each other's output and caches.
+        self.waiting = {}
+        self.ready = deque()  # Jobs whose project became free, to be started by update_jobs
+        self.started_jobs = Queue()  # IDs of the jobs workers have started
+        self.lock = Lock()
+        self.executor = ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_server_worker, initargs=(shared_roms, self.started_jobs)
+        )
+        # Start every worker now, before the server has any threads that could be holding locks when it forks.
+        for future in [self.executor.submit(int) for _ in range(jobs)]:
+            future.result()
+
+    def reserve(self) -> bool:
+        """Takes a place in the queue for a job that's about to be submitted. Returns False if the queue is full."""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        """Gives back a place taken with reserve, for a job that won't be submitted after all."""
+        with self.lock:
+            self.pending -= 1
+
+    def submit(self, job: Job):
+        """Queues a job. A place in the queue must have been reserved for it."""
+        with self.lock:
+            self.jobs[job.id] = job
+            if job.project_dir in self.waiting:
+                self.waiting[job.project_dir].append(job)
+                return
+            self.waiting[job.project_dir] = deque()
+        self.start(job)
+
+    def start(self, job: Job):
+        args = Namespace(check=False, rehash=False, bps=job.bps)
+        job.future = self.executor.submit(run_server_job, job.id, job.project_dir, args)
+        job.future.add_done_callback(lambda future: self.finish(job, future))
+
+    def finish(self, job: Job, future):
+        try:
+            job.result = future.result()
+        except Exception as e:  # The worker itself died
+            job.result = BatchResult(job.project_dir, False, f"{type(e).__name__}: {e}\n", 0.0)
+        with self.lock:
+            self.pending -= 1
+            job.finish_time = monotonic()
+            waiting = self.waiting.get(job.project_dir)
+            if waiting:
+                # This runs in an executor callback, so the next job is left to update_jobs to submit.
+                self.ready.append(waiting.popleft())
+            else:
+                self.waiting.pop(job.project_dir, None)
+        status = f"{GREEN_TEXT}done" if job.result.success else f"{RED_TEXT}failed"
+        print(f"Job {job.id} ({job.project_dir}): {status}{CLEAR_TEXT} ({perf_counter() - job.submit_time:.2f}s)")
+
+    def get_job(self, id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(id)
+
+    def update_jobs(self):
+        """Starts the jobs whose project became free, and marks the jobs that workers have started as running. Called regularly by the server's own thread."""
+        with self.lock:
+            ready = list(self.ready)
+            self.ready.clear()
+        for job in ready:
+            self.start(job)
+        while True:
+            try:
+                job_id = self.started_jobs.get_nowait()
+            except Empty:
+                break
+            job = self.get_job(job_id)
+            if job is not None:
+                job.started = True
+
+    def expire_jobs(self):
+        """Forgets jobs that finished more than job_ttl seconds ago, deleting the projects of uploaded ROMs."""
+        now = monotonic()
+        with self.lock:
+            expired = [
+                job
+                for job in self.jobs.values()
+                if job.finish_time is not None and now - job.finish_time > self.job_ttl
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            if job.uploaded:
+                rmtree(job.project_dir, ignore_errors=True)
+
+    def close(self):
+        with self.lock:
+            self.waiting.clear()
+            self.ready.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        rmtree(self.upload_dir, ignore_errors=True)
+
+    def create_upload_project(self, mod_rom, length: int) -> str | None:
+        """Creates a project for an uploaded mod EU ROM from the template project, using the server's vanilla ROMs.
+        The ROM is streamed from the file-like mod_rom straight to disk. Returns None if it ended before length bytes."""
+        from yaml import safe_load, safe_dump
+
+        project_dir = join(self.upload_dir, uuid4().hex)
+        copytree(self.template_dir, project_dir)
+        config_path = join(project_dir, "config.yml")
+        with open(config_path) as f:
+            config = safe_load(f)
+        config["Roms"].update(self.vanilla_paths)
+        config["Roms"].update({"Mod EU": "mod-eu.nds", "Mod NA": "mod-na.nds"})
+        with open(config_path, "w") as f:
+            safe_dump(config, f, sort_keys=False)
+        with open(join(project_dir, "mod-eu.nds"), "wb") as f:
+            remaining = length
+            while remaining > 0:
+                chunk = mod_rom.read(min(remaining, UPLOAD_CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        if remaining > 0:
+            rmtree(project_dir, ignore_errors=True)
+            return None
+        return project_dir
+
+    def status(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        statuses = [job.status for job in jobs]
+        return {
+            "workers": self.workers,
+            "vanilla_roms": {key: rom_path for key, rom_path in self.vanilla_paths.items()},
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+        }
+
+
+class PilgrimRequestHandler(BaseHTTPRequestHandler):
+    server_version = "Pilgrim"
+
+    @property
+    def pilgrim(self) -> PilgrimServer:
+        return self.server.pilgrim
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts == ["status"]:
+            self.send_json(200, self.pilgrim.status())
+            return
+        job = self.pilgrim.get_job(parts[1]) if len(parts) >= 2 and parts[0] == "jobs" else None
+        if job is None:
+            self.send_json(404, {"error": "Not found."})
+            return
+        if len(parts) == 2:
+            self.send_json(200, job.to_json())
+        elif len(parts) == 3 and parts[2] in ("rom", "patch"):
+            if job.result is None or job.result.files is None or job.result.files.get(parts[2]) is None:
+                self.send_json(404, {"error": f"Job {job.id} didn't create a {parts[2]}."})
+                return
+            self.send_file(job.result.files[parts[2]])
+        else:
+            self.send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in ("/jobs", "/jobs/upload"):
+            self.send_json(404, {"error": "Not found."})
+            return
+        if url.path == "/jobs/upload" and len(self.pilgrim.vanilla_paths) < 2:
+            self.send_json(400, {"error": "Uploads need the server to be started with --vanilla-eu and --vanilla-na."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > (MAX_UPLOAD_SIZE if url.path == "/jobs/upload" else MAX_JSON_SIZE):
+            self.send_json(400, {"error": "Invalid Content-Length."})
+            return
+        # The queue is checked before the body is read, so a full server doesn't take in uploads it can't run.
+        if not self.pilgrim.reserve():
+            self.send_json(503, {"error": "Too many jobs are queued. Try again later."})
+            return
+        try:
+            job = self.upload_job(url, length) if url.path == "/jobs/upload" else self.project_job(length)
+        except BaseException:
+            self.pilgrim.release()
+            raise
+        if job is None:
+            self.pilgrim.release()
+            return
+        self.pilgrim.submit(job)
+        self.send_json(202, job.to_json())
+
+    def project_job(self, length: int) -> Job | None:
+        """Creates the job for a POST /jobs request, or sends an error and returns None."""
+        try:
+            request = loads(self.rfile.read(length))
+        except (JSONDecodeError, UnicodeDecodeError):
+            self.send_json(400, {"error": "The body must be JSON."})
+            return None
+        if type(request) is not dict or type(request.get("project_dir")) is not str:
+            self.send_json(400, {"error": "project_dir is required."})
+            return None
+        project_dir = abspath(request["project_dir"])
+        if not isfile(join(project_dir, "config.yml")):
+            self.send_json(400, {"error": f"{project_dir} isn't a Pilgrim project."})
+            return None
+        return Job(project_dir, bool(request.get("bps", False)), False)
+
+    def upload_job(self, url, length: int) -> Job | None:
+        """Creates the job for a POST /jobs/upload request, or sends an error and returns None."""
+        query = parse_qs(url.query)
+        bps = query.get("bps", ["0"])[0].lower() in ("1", "true", "yes")
+        project_dir = self.pilgrim.create_upload_project(self.rfile, length)
+        if project_dir is None:
+            self.send_json(400, {"error": "The upload ended early."})
+            return None
+        return Job(project_dir, bps, True)
+
+    def send_json(self, code: int, data: dict):
+        body = dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, file_path: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(getsize(file_path)))
+        self.end_headers()
+        with open(file_path, "rb") as f:
+            copyfileobj(f, self.wfile, DOWNLOAD_CHUNK_SIZE)
+
+    def log_message(self, format, *args):
+        pass  # Jobs are logged when they finish instead
+
+
+class PilgrimHTTPServer(ThreadingHTTPServer):
+    def service_actions(self):
+        # Called by serve_forever about twice a second
+        self.pilgrim.update_jobs()
+        self.pilgrim.expire_jobs()
+
+
+server_started_jobs = None  # Where a worker reports the jobs it starts, see init_server_worker
+
+
+def init_server_worker(shared_roms: dict, started_jobs: Queue):
+    global server_started_jobs
+    init_batch_worker(shared_roms)
+    server_started_jobs = started_jobs
+
+
+def run_server_job(job_id: str, project_dir: str, args: Namespace) -> BatchResult:
+    """Runs a job in a worker process. Executor futures count as running as soon as they're handed to a worker's queue, so the worker reports when it actually starts."""
+    server_started_jobs.put(job_id)
+    return port_batch_project(project_dir, args)
+
+
+def serve_main(serve_argv: list[str]):
+    parser = ArgumentParser(
+        prog="pmdsky-pilgrim serve",
+        description="Run Pilgrim as a local server that keeps vanilla ROMs and dependencies loaded between ports.",
+        usage="pmdsky-pilgrim serve [options]",
+        add_help=False,
+    )
+    parser.add_argument("-h", "--help", action="help", help="Show this help message and exit")
+    parser.add_argument(
+        "--host", type=str, default=DEFAULT_HOST, help=f"Address to listen on. Defaults to {DEFAULT_HOST}."
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on. Defaults to {DEFAULT_PORT}."
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=cpu_count() or 1, help="How many ports can run at the same time."
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f"How many more jobs can wait for a worker before new ones are rejected. Defaults to {DEFAULT_QUEUE_SIZE}.",
+    )
+    parser.add_argument(
+        "--job-ttl",
+        type=float,
+        default=DEFAULT_JOB_TTL,
+        help=f"Seconds to keep a finished job (and the files of an uploaded ROM) around for. Defaults to {DEFAULT_JOB_TTL}.",
+    )
+    parser.add_argument("--vanilla-eu", type=str, help="Vanilla EU ROM to keep loaded. Required for uploads.")
+    parser.add_argument("--vanilla-na", type=str, help="Vanilla NA ROM to keep loaded. Required for uploads.")
+    parser.add_argument(
+        "--template",
+        type=str,
+        default=join(dirname(abspath(__file__)), "template_project"),
+        help="Project that uploaded ROMs are ported with. Defaults to the project template.",
+    )
+    args = parser.parse_args(serve_argv)
+    if args.jobs < 1 or args.queue_size < 0 or args.job_ttl < 0:
+        print(f"{RED_TEXT}--jobs must be at least 1, and --queue-size and --job-ttl can't be negative!{CLEAR_TEXT}")
+        exit(1)
+    if not isdir(args.template) or not isfile(join(args.template, "config.yml")):
+        print(f"{RED_TEXT}{args.template} isn't a Pilgrim project!{CLEAR_TEXT}")
+        exit(1)
+
+    print(f"{YELLOW_TEXT}Warming up...{CLEAR_TEXT}")
+    from importlib import import_module
+    from tools.find_offset import load_symbol_index
+    from tools.rom_loader import LoadedRom, ingest_rom
+
+    for module in WARM_MODULES:
+        import_module(module)
+    load_symbol_index()
+    shared_roms = {}
+    vanilla_paths = {}
+    for key, rom_path in (("Vanilla EU", args.vanilla_eu), ("Vanilla NA", args.vanilla_na)):
+        if rom_path is None:
+            continue
+        rom_path = abspath(rom_path)
+        if not isfile(rom_path):
+            print(f"{RED_TEXT}{key} ROM {rom_path} not found.{CLEAR_TEXT}")
+            exit(1)
+        loaded = ingest_rom(LoadedRom(key, rom_path), {}, True)
+        print(f"  {loaded}")
+        shared_roms[rom_path] = loaded
+        vanilla_paths[key] = rom_path
+
+    pilgrim = PilgrimServer(
+        shared_roms, vanilla_paths, abspath(args.template), args.jobs, args.queue_size, args.job_ttl
+    )
+    http_server = PilgrimHTTPServer((args.host, args.port), PilgrimRequestHandler)
+    http_server.pilgrim = pilgrim
+    print(f"{BLUE_TEXT}{BOLD_TEXT}Listening on http://{args.host}:{args.port}/{CLEAR_TEXT}")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        pilgrim.close()
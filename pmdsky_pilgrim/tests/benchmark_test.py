@@ -0,0 +1,222 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import gc
+import os
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from hashlib import blake2b
+from io import StringIO
+from json import load, dump
+from random import Random
+from time import perf_counter
+
+from ndspy.rom import NintendoDSRom
+
+from synthetic_rom import generate_roms
+from pmdsky_pilgrim.tools.bg_list import create_na_bg_list
+from pmdsky_pilgrim.tools.compare import create_lists
+from pmdsky_pilgrim.tools.find_offset import OffsetMapper, UnmappableOffsetException, load_symbol_index
+from pmdsky_pilgrim.tools.find_offset import ARM9_EU_START, ARM9_EU_END, OV10_EU_START, OV11_EU_END
+from pmdsky_pilgrim.tools.rom_loader import copy_rom
+from pmdsky_pilgrim.tools.sp_assembler import armips_executable
+from pmdsky_pilgrim.tools.special_process_converter import SPConverter
+
+# Times the slowest parts of a port on synthetic ROMs (see synthetic_rom.py), and compares the times to the baselines in benchmark_baselines.json.
+# Run with --update to record new baselines, e.g. after an intentional change or on a new machine.
+# Times are scaled by a calibration workload timed alongside them, so baselines recorded on a faster or slower machine still roughly apply.
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines.json")
+BASELINES_VERSION = 2
+FIXTURE = {"seed": 0, "file_count": 4000, "bg_count": 250, "sp_count": 100}
+# A small mod whose last few SPs can't be relocated directly, so SPConverter falls back to armips for them.
+ARMIPS_FIXTURE = {"seed": 1, "file_count": 100, "bg_count": 10, "sp_count": 20, "unrelocatable_sp_count": 4}
+REPEATS = 10
+DEFAULT_TOLERANCE = 0.5  # How much slower than its baseline a benchmark may be before it fails
+OFFSET_COUNT = 20000
+
+
+class Benchmark:
+    def __init__(self, name: str, run, setup=None, skip_reason: str | None = None):
+        self.name = name
+        self.run = run  # Timed. Called with whatever setup returned.
+        self.setup = setup  # Not timed. Called before every run, returns a tuple of arguments for run.
+        self.skip_reason = skip_reason  # Why the benchmark can't run on this machine, if it can't
+
+    def measure(self, repeats: int) -> float:
+        """Returns the fastest of repeats runs, in seconds, after one untimed warm-up run. Like timeit, the garbage collector is paused while timing. Everything the benchmark prints is discarded."""
+        times = []
+        for i in range(repeats + 1):
+            args = () if self.setup is None else self.setup()
+            gc.collect()
+            gc.disable()
+            try:
+                with redirect_stdout(StringIO()):
+                    start = perf_counter()
+                    self.run(*args)
+                    duration = perf_counter() - start
+            finally:
+                gc.enable()
+            if i > 0:
+                times.append(duration)
+        return min(times)
+
+
+def calibrate() -> float:
+    """Times a fixed workload of hashing, dict and list operations, the same kind of work Pilgrim does. Used to scale baselines between machines."""
+    data = Random(0).randbytes(0x400000)
+
+    def workload():
+        index = {}
+        for i in range(0, len(data), 0x40):
+            index.update({i: blake2b(data[i : i + 0x40], digest_size=16).hexdigest()})
+        sorted(index.values())
+
+    return Benchmark("calibration", workload).measure(REPEATS)
+
+
+def create_benchmarks(work_dir: str) -> list[Benchmark]:
+    vanilla_eu, vanilla_na, mod_eu = generate_roms(**FIXTURE)
+    rng = Random(FIXTURE["seed"])
+    # Offsets across arm9 and the ground mode overlays: most can be mapped, some can't.
+    eu_offsets = [rng.randrange(ARM9_EU_START, ARM9_EU_END, 4) for _ in range(OFFSET_COUNT // 2)]
+    eu_offsets += [rng.randrange(OV10_EU_START, OV11_EU_END, 4) for _ in range(OFFSET_COUNT // 2)]
+    load_symbol_index()  # Only loaded once per process, so this isn't part of any benchmark
+    project_count = [0]
+
+    def new_config() -> dict:
+        # A project of its own, so the SP cache starts empty
+        project_count[0] += 1
+        root = os.path.join(work_dir, f"project{project_count[0]}")
+        os.makedirs(root)
+        return {"Root": root, "OffsetMaps": {}}
+
+    def find_na_offset(offsets: list[int]):
+        offset_mapper = OffsetMapper()
+        for eu_offset in offsets:
+            try:
+                offset_mapper.find_na_offset(eu_offset)
+            except UnmappableOffsetException:
+                pass
+
+    def convert_sps(config: dict, na: NintendoDSRom, mod: NintendoDSRom = mod_eu):
+        sp_converter = SPConverter(mod, config)
+        sp_converter.prepare_all(workers=1)  # Worker processes would make the time depend on the number of CPUs
+        sp_converter.create_map()
+        sp_converter.convert_all(na)
+
+    def cached_sp_setup() -> tuple:
+        config = new_config()
+        with redirect_stdout(StringIO()):
+            convert_sps(config, copy_rom(vanilla_na))
+        return {"Root": config["Root"], "OffsetMaps": {}}, copy_rom(vanilla_na)
+
+    armips_skip_reason = None
+    if shutil.which(armips_executable()) is None:
+        armips_skip_reason = "armips isn't installed"
+        armips_vanilla_na = armips_mod_eu = None
+    else:
+        _, armips_vanilla_na, armips_mod_eu = generate_roms(**ARMIPS_FIXTURE)
+
+    return [
+        Benchmark("compare.create_lists", lambda: create_lists(vanilla_eu, mod_eu, vanilla_na)),
+        Benchmark(
+            "bg_list.create_na_bg_list",
+            lambda na: create_na_bg_list(vanilla_eu, mod_eu, na, check_contents=True),
+            lambda: (copy_rom(vanilla_na),),
+        ),
+        Benchmark("OffsetMapper.find_na_offset", lambda: find_na_offset(eu_offsets)),
+        Benchmark("OffsetMapper.find_na_offsets", lambda: OffsetMapper().find_na_offsets(eu_offsets)),
+        Benchmark("SPConverter", convert_sps, lambda: (new_config(), copy_rom(vanilla_na))),
+        Benchmark("SPConverter (cached)", convert_sps, cached_sp_setup),
+        Benchmark(
+            "SPConverter (armips fallback)",
+            convert_sps,
+            lambda: (new_config(), copy_rom(armips_vanilla_na), armips_mod_eu),
+            armips_skip_reason,
+        ),
+    ]
+
+
+def load_baselines() -> dict | None:
+    try:
+        with open(BASELINES_PATH) as f:
+            baselines = load(f)
+    except FileNotFoundError:
+        return None
+    if (
+        baselines.get("version") != BASELINES_VERSION
+        or baselines.get("fixture") != FIXTURE
+        or baselines.get("armips_fixture") != ARMIPS_FIXTURE
+    ):
+        return None
+    return baselines
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark Pilgrim on synthetic ROMs and compare the results to the baselines.")
+    parser.add_argument("--update", action="store_true", help="Record the results as the new baselines.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"How much slower than its baseline a benchmark may be, as a fraction. Defaults to {DEFAULT_TOLERANCE}.",
+    )
+    args = parser.parse_args()
+
+    baselines = None if args.update else load_baselines()
+    if baselines is None and not args.update:
+        print(f"No baselines for this fixture in {BASELINES_PATH}. Run with --update to record them.")
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = create_benchmarks(work_dir)
+        # Calibrated before and after the benchmarks, so a slow moment during either doesn't skew every result.
+        calibration = calibrate()
+        for benchmark in benchmarks:
+            if benchmark.skip_reason is None:
+                results.update({benchmark.name: benchmark.measure(REPEATS)})
+        calibration = min(calibration, calibrate())
+    # How much slower this machine is than the one that recorded the baselines
+    scale = 1.0 if baselines is None else calibration / baselines["calibration"]
+    print(f"Calibration: {calibration:.4f}s (x{scale:.2f} the baselines' machine)")
+    ok = True
+    for benchmark in benchmarks:
+        if benchmark.skip_reason is not None:
+            print(f"SKIP: {benchmark.name} ({benchmark.skip_reason})")
+    for name, duration in results.items():
+        baseline = None if baselines is None else baselines["benchmarks"].get(name)
+        if baseline is None:
+            print(f"NEW: {name} took {duration:.4f}s")
+            continue
+        expected = baseline * scale
+        passed = duration <= expected * (1 + args.tolerance)
+        ok = ok and passed
+        print(
+            f"{'OK' if passed else 'FAIL'}: {name} took {duration:.4f}s (expected {expected:.4f}s, {(duration / expected - 1) * 100:+.0f}%)"
+        )
+    if args.update:
+        with open(BASELINES_PATH, "w") as f:
+            dump(
+                {
+                    "version": BASELINES_VERSION,
+                    "fixture": FIXTURE,
+                    "armips_fixture": ARMIPS_FIXTURE,
+                    "calibration": calibration,
+                    "benchmarks": results,
+                },
+                f,
+                indent=1,
+            )
+            f.write("\n")
+        print(f"Baselines written to {BASELINES_PATH}")
+    if not ok:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import os
+import sys
+import tempfile
+
+from pmdsky_pilgrim.tools.bps import create_bps_patch, apply_bps_patch
+
+
+def main(source_name: str, target_name: str):
+    # Without knowing what changed, the whole target has to be treated as changed.
+    target_size = os.path.getsize(target_name)
+    source_size = os.path.getsize(source_name)
+    with tempfile.TemporaryDirectory() as tmp:
+        patch_name = os.path.join(tmp, "test.bps")
+        patch_size = create_bps_patch(source_name, target_name, [(0, target_size)], [(0, source_size)], patch_name)
+        print(f"Created a {patch_size} byte patch.")
+        with open(source_name, "rb") as f:
+            source = f.read()
+        with open(patch_name, "rb") as f:
+            patch = f.read()
+    with open(target_name, "rb") as f:
+        target = f.read()
+    if apply_bps_patch(source, patch) == target:
+        print("Applying the patch to the source gives the target!")
+    else:
+        print("Applying the patch to the source did NOT give the target!")
+        exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(
+            "Please provide two files: a source (like a vanilla NA ROM) and a target (like its port).", file=sys.stderr
+        )
+        exit(1)
+    if not os.path.exists(sys.argv[1]):
+        print(f"Source {sys.argv[1]} not found.", file=sys.stderr)
+        exit(1)
+    if not os.path.exists(sys.argv[2]):
+        print(f"Target {sys.argv[2]} not found.", file=sys.stderr)
+        exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,59 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import os
+import subprocess
+import sys
+import tempfile
+
+PILGRIM_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pilgrim.py")
+# None of these should be imported by entry points that never touch a ROM.
+HEAVY_MODULES = ["skytemple_files", "capstone", "ndspy", "pmdsky_debug_py"]
+IMPORT_TIME_BUDGET_MS = 250
+
+
+def measure_imports(args: list[str]) -> dict[str, int]:
+    """Runs Pilgrim under `python -X importtime` and returns {top-level module: cumulative import time in us}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", PILGRIM_PATH, *args], capture_output=True, text=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # Header line
+        name = name[1:]  # Nested imports are indented past this first space
+        imports.update({name: cumulative})
+    return imports
+
+
+def check_entry_point(description: str, args: list[str]) -> bool:
+    imports = measure_imports(args)
+    total_ms = sum(cumulative for name, cumulative in imports.items() if not name.startswith(" ")) / 1000
+    heavy = sorted(set(name.strip().split(".")[0] for name in imports if name.strip().split(".")[0] in HEAVY_MODULES))
+    ok = len(heavy) == 0 and total_ms <= IMPORT_TIME_BUDGET_MS
+    print(f"{'OK' if ok else 'FAIL'}: {description} imported modules in {total_ms:.1f}ms", end="")
+    if len(heavy) > 0:
+        print(f", including heavy modules {heavy}", end="")
+    print()
+    return ok
+
+
+def main():
+    ok = check_entry_point("--help", ["--help"])
+    with tempfile.TemporaryDirectory() as project_dir:
+        # A project whose config is missing Roms fails before any ROM is loaded.
+        with open(os.path.join(project_dir, "config.yml"), "w") as config_file:
+            config_file.write("Patches:\n  Include:\n  Exclude:\n")
+        ok = check_entry_point("--check with a broken config", [project_dir, "--check"]) and ok
+    if not ok:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import os
+import sys
+from random import Random
+
+from ndspy.fnt import Folder
+from ndspy.rom import NintendoDSRom
+
+from pmdsky_pilgrim.tools.bg_list import BG_FOLDER, BG_LIST_DAT_FILE
+from pmdsky_pilgrim.tools.find_offset import OffsetMapper, load_symbol_index, overlay_of_offset, AddressOverlay
+from pmdsky_pilgrim.tools.special_process_converter import PROCESS_BIN_PATH, PROC_START_ADDRESS_EU, FIRST_CUSTOM_SP_ID
+
+# Builds synthetic stand-ins for a vanilla EU ROM, a vanilla NA ROM and a modified EU ROM, so Pilgrim can be tested and benchmarked without retail ROMs.
+# Every file is random bytes, except for MAP_BG/bg_list.dat and BALANCE/process.bin, which are laid out like the real ones.
+# Only the ROM layout is imitated: the ROMs don't run, and SkyTemple doesn't accept them as Explorers of Sky ROMs.
+
+# Top-level folders of the real filesystem, with how many files each gets out of every 100. SCRIPT is split into subfolders like the real one.
+FOLDER_WEIGHTS = {
+    "BACK": 2,
+    "BALANCE": 1,
+    "DUNGEON": 3,
+    "EFFECT": 4,
+    "FONT": 1,
+    "GROUND": 4,
+    "MESSAGE": 1,
+    "MONSTER": 6,
+    "SCRIPT": 70,
+    "SOUND": 4,
+    "SYSTEM": 1,
+    "TABLEDAT": 1,
+    "TOP": 2,
+}
+SCRIPT_FILES_PER_FOLDER = 12
+MAX_FILE_SIZE = 0x4000
+BG_LIST_NAME_SIZE = 8
+VANILLA_SP_SIZE = 0x40
+BX_LR = 0xE12FFF1E
+
+
+def generate_roms(
+    seed: int = 0, file_count: int = 4000, bg_count: int = 250, sp_count: int = 100, unrelocatable_sp_count: int = 0
+) -> tuple[NintendoDSRom, NintendoDSRom, NintendoDSRom]:
+    """Returns (vanilla EU, vanilla NA, modified EU) ROMs with about file_count files, bg_count backgrounds in bg_list.dat, and sp_count custom SPs in the modified ROM.
+    The last unrelocatable_sp_count of those SPs can't be relocated directly, so converting them needs armips. The same arguments always give the same ROMs."""
+    rng = Random(seed)
+    eu_files = generate_files(rng, file_count)
+    bg_entries = generate_bg_entries(bg_count)
+    eu_files.update(generate_bg_files(rng, bg_entries))
+    eu_files.update({BG_LIST_DAT_FILE: bg_list_dat(bg_entries)})
+    vanilla_sps = [rng.randbytes(VANILLA_SP_SIZE) for _ in range(FIRST_CUSTOM_SP_ID)]
+    eu_files.update({PROCESS_BIN_PATH: process_bin(vanilla_sps)})
+
+    na_files = localize_files(rng, eu_files)
+    # NA lists some backgrounds in a different order, so entries have to be found by their contents rather than their index.
+    na_entries = list(bg_entries)
+    for i in range(0, len(na_entries) - 1, 17):
+        na_entries[i], na_entries[i + 1] = na_entries[i + 1], na_entries[i]
+    na_files.update({BG_LIST_DAT_FILE: bg_list_dat(na_entries)})
+
+    mod_files = modify_files(rng, eu_files)
+    mod_entries = modify_bg_entries(rng, bg_entries, mod_files)
+    mod_files.update({BG_LIST_DAT_FILE: bg_list_dat(mod_entries)})
+    custom_sps = generate_sps(rng, sp_count, unrelocatable_sp_count)
+    mod_files.update({PROCESS_BIN_PATH: process_bin(vanilla_sps + custom_sps)})
+
+    return rom_from_files(eu_files), rom_from_files(na_files), rom_from_files(mod_files)
+
+
+def random_size(rng: Random) -> int:
+    # Mostly small files, with a long tail of bigger ones, like the real filesystem.
+    return min(int(rng.lognormvariate(7, 1.2)) + 0x10, MAX_FILE_SIZE)
+
+
+def generate_files(rng: Random, file_count: int) -> dict[str, bytes]:
+    """Returns {path: contents} for about file_count random files spread across the usual folders."""
+    files = {}
+    total_weight = sum(FOLDER_WEIGHTS.values())
+    for folder, weight in FOLDER_WEIGHTS.items():
+        count = max(file_count * weight // total_weight, 1)
+        if folder == "SCRIPT":
+            for i in range(count):
+                subfolder = f"S{i // SCRIPT_FILES_PER_FOLDER:03d}"
+                files.update(
+                    {f"SCRIPT/{subfolder}/file{i % SCRIPT_FILES_PER_FOLDER:02d}.ssb": rng.randbytes(random_size(rng))}
+                )
+        else:
+            for i in range(count):
+                files.update({f"{folder}/{folder.lower()}{i:04d}.bin": rng.randbytes(random_size(rng))})
+    return files
+
+
+def generate_bg_entries(bg_count: int) -> list[tuple]:
+    """Returns bg_list.dat entries as (bpl, bpc, bma, [8 bpas]) names. Some backgrounds share a palette, and most have fewer than 8 BPAs, like the real list."""
+    entries = []
+    for i in range(bg_count):
+        name = f"B{i:04d}"
+        bpas = [f"{name}P{k}" if k < i % 4 else None for k in range(8)]
+        entries.append((f"B{i - i % 3:04d}", name, name, bpas))
+    return entries
+
+
+def bg_file_names(entry: tuple) -> list[str]:
+    bpl, bpc, bma, bpas = entry
+    names = [f"{bpl.lower()}.bpl", f"{bpc.lower()}.bpc", f"{bma.lower()}.bma"]
+    names += [f"{bpa.lower()}.bpa" for bpa in bpas if bpa is not None]
+    return [f"{BG_FOLDER}/{name}" for name in names]
+
+
+def generate_bg_files(rng: Random, bg_entries: list[tuple]) -> dict[str, bytes]:
+    files = {}
+    for entry in bg_entries:
+        for path in bg_file_names(entry):
+            if path not in files:
+                files.update({path: rng.randbytes(random_size(rng))})
+    return files
+
+
+def bg_list_dat(entries: list[tuple]) -> bytes:
+    """Serializes entries the way bg_list.dat stores them: every name is padded to 8 bytes, and missing BPAs are left empty."""
+    data = bytearray()
+    for bpl, bpc, bma, bpas in entries:
+        for name in [bpl, bpc, bma, *bpas]:
+            data += (name or "").encode("ascii").ljust(BG_LIST_NAME_SIZE, b"\0")
+    return bytes(data)
+
+
+def process_bin(effect_codes: list[bytes]) -> bytes:
+    """Serializes SPs the way DataCD stores them, with one item effect per SP: the item table, a (start, length) pointer per SP, then the code."""
+    items_size = 4 + 2 * len(effect_codes)
+    items_size += items_size % 4  # Keep the pointers aligned
+    pointers_size = 8 * len(effect_codes)
+    data = bytearray(items_size.to_bytes(4, "little"))
+    for id in range(len(effect_codes)):
+        data += id.to_bytes(2, "little")
+    data = data.ljust(items_size, b"\0")
+    code_start = items_size + pointers_size
+    for code in effect_codes:
+        data += code_start.to_bytes(4, "little") + len(code).to_bytes(4, "little")
+        code_start += len(code)
+    for code in effect_codes:
+        data += code
+    return bytes(data)
+
+
+def localize_files(rng: Random, eu_files: dict[str, bytes]) -> dict[str, bytes]:
+    """Returns the NA version of the EU files: text is different, and a few files only exist in one of the regions."""
+    na_files = {}
+    for path, data in eu_files.items():
+        if path == PROCESS_BIN_PATH:
+            na_files.update({path: data})
+        elif path.startswith("MESSAGE/") or rng.random() < 0.02:
+            na_files.update({path: rng.randbytes(len(data))})
+        elif rng.random() < 0.005 and not path.startswith(BG_FOLDER):
+            continue  # EU only
+        else:
+            na_files.update({path: data})
+    for i in range(FOLDER_WEIGHTS["MESSAGE"] * 4):
+        na_files.update({f"MESSAGE/na{i:02d}.str": rng.randbytes(random_size(rng))})
+    return na_files
+
+
+def modify_files(rng: Random, eu_files: dict[str, bytes]) -> dict[str, bytes]:
+    """Returns the files of a mod: about 5% of them are edited (half of those keep their size), and a new SCRIPT folder is added."""
+    mod_files = {}
+    for path, data in eu_files.items():
+        if rng.random() < 0.05 and path != BG_LIST_DAT_FILE and path != PROCESS_BIN_PATH:
+            size = len(data) if rng.random() < 0.5 else random_size(rng)
+            mod_files.update({path: rng.randbytes(size)})
+        else:
+            mod_files.update({path: data})
+    for i in range(len(eu_files) // 100):
+        mod_files.update({f"SCRIPT/MOD/file{i:02d}.ssb": rng.randbytes(random_size(rng))})
+    return mod_files
+
+
+def modify_bg_entries(rng: Random, bg_entries: list[tuple], mod_files: dict[str, bytes]) -> list[tuple]:
+    """Returns the mod's bg_list.dat entries: some entries point to new files, a few backgrounds are added, and the files of some unchanged entries are edited.
+    The new files are added to mod_files."""
+    mod_entries = []
+    for entry in bg_entries:
+        if rng.random() < 0.05:
+            bpl, bpc, bma, bpas = entry
+            entry = (bpl, f"{bpc}M", f"{bma}M", bpas)
+            for path in bg_file_names(entry):
+                mod_files.setdefault(path, rng.randbytes(random_size(rng)))
+        elif rng.random() < 0.05:
+            for path in bg_file_names(entry)[:3]:
+                mod_files.update({path: rng.randbytes(len(mod_files[path]))})
+        mod_entries.append(entry)
+    for i in range(len(bg_entries) // 20):
+        name = f"N{i:04d}"
+        entry = (name, name, name, [None] * 8)
+        for path in bg_file_names(entry):
+            mod_files.update({path: rng.randbytes(random_size(rng))})
+        mod_entries.append(entry)
+    return mod_entries
+
+
+def sp_targets() -> tuple[list[int], list[int]]:
+    """Returns the EU addresses SPs may reference: the word aligned symbols in arm9 and the ground mode overlays that can be mapped to NA.
+    The first list holds the ones whose NA address is word aligned too. The second holds the rest, which branches can't be re-encoded to reach, so SPs calling them have to be assembled with armips.
+    """
+    symbol_index = load_symbol_index()
+    targets = [
+        address
+        for address in symbol_index.eu_addresses
+        if address % 4 == 0
+        and overlay_of_offset(address) in (AddressOverlay.ARM9, AddressOverlay.OVERLAY_10, AddressOverlay.OVERLAY_11)
+    ]
+    na_offsets = OffsetMapper().find_na_offsets(targets)
+    mapped = {target: int(na_offset, 16) for target, na_offset in zip(targets, na_offsets) if na_offset is not None}
+    return (
+        sorted(target for target, na_offset in mapped.items() if na_offset % 4 == 0),
+        sorted(target for target, na_offset in mapped.items() if na_offset % 4 != 0),
+    )
+
+
+def generate_sps(rng: Random, sp_count: int, unrelocatable_sp_count: int = 0) -> list[bytes]:
+    """Generates SPs out of the kinds of code Pilgrim has to convert: calls to game functions, game addresses loaded from a literal pool, and branches within the SP.
+    The rest is arithmetic that stays as is. All but the last unrelocatable_sp_count SPs can be relocated directly, without armips. Those start with a call that can only be converted by assembling them.
+    """
+    targets, unrelocatable_targets = sp_targets()
+    sps = [generate_sp(rng, targets) for _ in range(sp_count - unrelocatable_sp_count)]
+    sps += [generate_sp(rng, targets, rng.choice(unrelocatable_targets)) for _ in range(unrelocatable_sp_count)]
+    return sps
+
+
+def generate_sp(rng: Random, targets: list[int], first_call: int | None = None) -> bytes:
+    instruction_count = rng.randint(16, 96)
+    pool = [rng.choice(targets) for _ in range(rng.randint(1, 8))]
+    pool_start = PROC_START_ADDRESS_EU + 4 * (instruction_count + 1)  # After the instructions and the final bx lr
+    code = []
+    for i in range(instruction_count):
+        address = PROC_START_ADDRESS_EU + 4 * i
+        register = rng.randrange(8)
+        kind = rng.random()
+        if i == 0 and first_call is not None:
+            code.append(0xEB000000 | branch_immediate(address, first_call))  # bl
+        elif kind < 0.15:
+            code.append(0xEB000000 | branch_immediate(address, rng.choice(targets)))  # bl
+        elif kind < 0.3:
+            pool_address = pool_start + 4 * rng.randrange(len(pool))
+            code.append(0xE59F0000 | (register << 12) | (pool_address - address - 8))  # ldr rX, [pc, #...]
+        elif kind < 0.4 and i + 1 < instruction_count:
+            target = PROC_START_ADDRESS_EU + 4 * rng.randint(i + 1, instruction_count)
+            code.append(0x1A000000 | branch_immediate(address, target))  # bne, forward within the SP
+        elif kind < 0.7:
+            code.append(0xE3A00000 | (register << 12) | rng.randrange(0x100))  # mov rX, #imm
+        elif kind < 0.85:
+            code.append(0xE2800000 | (register << 16) | (register << 12) | rng.randrange(0x100))  # add rX, rX, #imm
+        else:
+            code.append(0xE3500000 | (register << 16) | rng.randrange(0x100))  # cmp rX, #imm
+    code.append(BX_LR)
+    code += pool
+    return b"".join(word.to_bytes(4, "little") for word in code)
+
+
+def branch_immediate(address: int, target: int) -> int:
+    return ((target - address - 8) >> 2) & 0xFFFFFF
+
+
+def rom_from_files(files: dict[str, bytes]) -> NintendoDSRom:
+    """Builds a ROM holding the given files. Files in the same folder get consecutive IDs, like ndspy expects."""
+    tree = {"files": {}, "folders": {}}
+    for path, data in files.items():
+        *folders, file_name = path.split("/")
+        folder = tree
+        for folder_name in folders:
+            folder = folder["folders"].setdefault(folder_name, {"files": {}, "folders": {}})
+        folder["files"].update({file_name: data})
+    rom = NintendoDSRom()
+    rom.files = []
+    rom.filenames = build_folder(tree, rom.files)
+    return rom
+
+
+def build_folder(tree: dict, rom_files: list[bytes]) -> Folder:
+    folder = Folder(firstID=len(rom_files))
+    for file_name in sorted(tree["files"]):
+        folder.files.append(file_name)
+        rom_files.append(tree["files"][file_name])
+    for folder_name in sorted(tree["folders"]):
+        folder.folders.append((folder_name, build_folder(tree["folders"][folder_name], rom_files)))
+    return folder
+
+
+def main(output_dir: str):
+    os.makedirs(output_dir, exist_ok=True)
+    vanilla_eu, vanilla_na, mod_eu = generate_roms()
+    for file_name, rom in [("vanilla_eu.nds", vanilla_eu), ("vanilla_na.nds", vanilla_na), ("mod_eu.nds", mod_eu)]:
+        rom.saveToFile(os.path.join(output_dir, file_name))
+        print(f"Wrote {os.path.join(output_dir, file_name)} ({len(rom.files)} files)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please provide a folder to write the synthetic ROMs to.", file=sys.stderr)
+        exit(1)
+    main(sys.argv[1])
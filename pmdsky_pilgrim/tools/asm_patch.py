@@ -5,34 +5,306 @@
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
 from ndspy.rom import NintendoDSRom
-from skytemple_files.patch.patches import Patcher
+from skytemple_files.patch.patches import Patcher, PatchPackageConfigMerger
 from skytemple_files.common.util import get_ppmdu_config_for_rom
-from skytemple_files.patch.errors import PatchNotConfiguredError
-from os import listdir
-from os.path import isfile, join
-from .colors import BLUE_TEXT, RED_TEXT, CLEAR_TEXT
+from skytemple_files.patch.errors import PatchNotConfiguredError, PatchPackageError
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_start_method
+from importlib.util import spec_from_file_location, module_from_spec
+from os import listdir, replace, getpid, cpu_count
+from os.path import isfile, isdir, join
+from shutil import rmtree
+from zipfile import ZipFile
+from xml.etree.ElementTree import ParseError
+from json import dumps
+from .hash_validation import file_identity
+from .cache import project_cache_dir, read_json, write_json, read_pickle, write_pickle
+from .colors import BLUE_TEXT, CLEAR_TEXT
+from .vanilla_cache import VanillaCache, dependency_version
+from .rom_changes import RomSnapshot, RomChanges, RomDelta
+from .profiler import profiler, span, run_profiled
 
 SKYPATCH_FOLDER = "skypatches"
+SKYPATCH_CACHE_FOLDER = "skypatches"
+DETECTION_CACHE_FILE = "patch_detection.json"
+MIN_PATCHES_PER_DETECTION_WORKER = 8  # Fewer than this, and starting a worker takes longer than the checks it saves
+DELTA_CACHE_FOLDER = "patch_deltas"
+# Bump this if the format of cached deltas changes.
+DELTA_CACHE_VERSION = 1
 
 
-def apply_patches(rom: NintendoDSRom, patches_to_apply: list[str], config):
+class PatchApplyError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class Skypatch:
+    """A custom skypatch from the project. Extracted once into the project cache (keyed by the file's hash), and parsed once per run no matter how many Patchers use it."""
+
+    def __init__(self, file_name: str, sha256: str, extracted_dir: str):
+        self.file_name = file_name
+        self.sha256 = sha256
+        self.extracted_dir = extracted_dir
+        self.handler_class = None  # Loaded from patch.py on first use
+        self.patch_name = None
+        self.config_mergers = {}  # game edition: parsed config.xml
+
+    def __getstate__(self):
+        # The handler class comes from a module that only exists in this process, so a copy sent to another process loads it again.
+        state = dict(self.__dict__)
+        state.update({"handler_class": None, "config_mergers": {}})
+        return state
+
+    def add_to(self, patcher: Patcher):
+        """Adds this skypatch to a Patcher, like Patcher.add_pkg does, but without extracting or parsing anything again."""
+        game_edition = patcher._config.game_edition
+        if game_edition not in self.config_mergers:
+            try:
+                self.config_mergers[game_edition] = PatchPackageConfigMerger(
+                    join(self.extracted_dir, "config.xml"), game_edition
+                )
+            except FileNotFoundError as ex:
+                raise PatchPackageError(f"config.xml missing in {self.file_name}.") from ex
+            except ParseError as ex:
+                raise PatchPackageError(f"Syntax error in the config.xml of {self.file_name}.") from ex
+        self.config_mergers[game_edition].merge(patcher._config.asm_patches_constants)
+        try:
+            patcher.add_manually(self.load_handler_class()(), self.extracted_dir)
+        except ValueError as ex:
+            raise PatchPackageError(
+                f"{self.file_name} does not contain an entry for the handler's patch name in its config.xml."
+            ) from ex
+
+    def get_patch_name(self) -> str:
+        if self.patch_name is None:
+            self.patch_name = self.load_handler_class()().name
+        return self.patch_name
+
+    def load_handler_class(self):
+        if self.handler_class is None:
+            try:
+                spec = spec_from_file_location(
+                    f"skytemple_files.__patches.pilgrim_{self.sha256[:16]}", join(self.extracted_dir, "patch.py")
+                )
+                patch_module = module_from_spec(spec)
+                spec.loader.exec_module(patch_module)
+            except FileNotFoundError as ex:
+                raise PatchPackageError(f"patch.py missing in {self.file_name}.") from ex
+            except SyntaxError as ex:
+                raise PatchPackageError(f"The patch.py of {self.file_name} contains a syntax error.") from ex
+            if not hasattr(patch_module, "PatchHandler"):
+                raise PatchPackageError(f"The patch.py of {self.file_name} does not contain a 'PatchHandler'.")
+            self.handler_class = patch_module.PatchHandler
+        return self.handler_class
+
+
+class PatchSession:
+    """Loads every custom skypatch in the project once, and shares them between all Patchers made during a run."""
+
+    def __init__(self, config):
+        self.config = config
+        self.skypatches = []
+        skypatch_folder_abs = join(config["Root"], SKYPATCH_FOLDER)
+        for f in sorted(listdir(skypatch_folder_abs)):
+            path = join(skypatch_folder_abs, f)
+            if isfile(path) and f.endswith(".skypatch"):
+                print(f"Loading {f}...")
+                self.skypatches.append(self.extract_skypatch(f, path))
+
+    def extract_skypatch(self, file_name: str, path: str) -> Skypatch:
+        with open(path, "rb") as skypatch_file:
+            skypatch_hash = sha256(skypatch_file.read()).hexdigest()
+        extracted_dir = join(project_cache_dir(self.config, SKYPATCH_CACHE_FOLDER), skypatch_hash)
+        if not isdir(extracted_dir):
+            tmp_dir = f"{extracted_dir}.{getpid()}.tmp"
+            with ZipFile(path, "r") as skypatch_zip:
+                skypatch_zip.extractall(tmp_dir)
+            try:
+                replace(tmp_dir, extracted_dir)
+            except OSError:
+                rmtree(tmp_dir, ignore_errors=True)  # Someone else extracted it first
+        return Skypatch(file_name, skypatch_hash, extracted_dir)
+
+    def create_patcher(self, rom: NintendoDSRom, ppmdu_config=None) -> Patcher:
+        """Creates a Patcher for a ROM with every custom skypatch already loaded."""
+        if ppmdu_config is None:
+            ppmdu_config = get_ppmdu_config_for_rom(rom)
+        patcher = Patcher(rom, ppmdu_config)
+        self.add_all(patcher)
+        return patcher
+
+    def add_all(self, patcher: Patcher):
+        for skypatch in self.skypatches:
+            skypatch.add_to(patcher)
+
+    def detection_key(self, rom_sha256: str) -> str:
+        """Identifies everything patch detection depends on: the ROM, the custom skypatches, and the version of SkyTemple's bundled patches."""
+        skypatch_hashes = ",".join(sorted(skypatch.sha256 for skypatch in self.skypatches))
+        return f"{rom_sha256}:{dependency_version('skytemple-files')}:{sha256(skypatch_hashes.encode('ascii')).hexdigest()}"
+
+    def patch_source(self, patch: str) -> str:
+        """Identifies the code of a patch: the hash of the skypatch that provides it, or the version of SkyTemple for bundled patches."""
+        for skypatch in self.skypatches:
+            if skypatch.get_patch_name() == patch:
+                return skypatch.sha256
+        return f"skytemple-files-{dependency_version('skytemple-files')}"
+
+
+class PatchDeltaCache:
+    """Remembers what each patch changed when applied on top of a known ROM, so later runs can replay the change instead of running the patch (and armips) again.
+    Every patch is keyed by the key of the patch before it, so a delta is only replayed onto exactly the ROM state it was recorded from."""
+
+    def __init__(self, config, rom_sha256: str, session: PatchSession):
+        self.cache_dir = project_cache_dir(config, DELTA_CACHE_FOLDER)
+        self.session = session
+        self.previous_key = rom_sha256
+
+    def next_key(self, patch: str, patch_config) -> str:
+        """Returns the key of applying a patch with the given parameters after every patch so far."""
+        parameters = dumps(patch_config, sort_keys=True, default=str)
+        key_source = (
+            f"{DELTA_CACHE_VERSION}\n{self.previous_key}\n{patch}\n{self.session.patch_source(patch)}\n{parameters}"
+        )
+        self.previous_key = sha256(key_source.encode("utf-8")).hexdigest()
+        return self.previous_key
+
+    def load(self, key: str) -> RomDelta | None:
+        return read_pickle(join(self.cache_dir, f"{key}.pickle"))
+
+    def save(self, key: str, delta: RomDelta):
+        write_pickle(join(self.cache_dir, f"{key}.pickle"), delta)
+
+
+def detect_applied_patches(
+    patcher: Patcher, patches: list[str], config, rom_sha256: str | None = None, session: PatchSession | None = None
+) -> dict[str, bool | None]:
+    """Checks which of the given patches are applied to the patcher's ROM. Returns {patch: applied}, where applied is None if the patch can't tell.
+    If rom_sha256 is given, results are saved in the project cache and only patches that weren't checked before for the same ROM and skypatches are checked again."""
+    cache_path = None
+    detected = {}
+    if rom_sha256 is not None and session is not None:
+        cache_path = join(project_cache_dir(config), DETECTION_CACHE_FILE)
+        key = session.detection_key(rom_sha256)
+        cache = read_json(cache_path)
+        detected = cache.get(key, {})
+    to_detect = [patch for patch in patches if patch not in detected]
+    if len(to_detect) > 0:
+        detected.update(detect_in_workers(patcher, to_detect))
+        if cache_path is not None:
+            # Only the latest mod ROM is worth remembering.
+            write_json(cache_path, {key: detected})
+    return {patch: detected[patch] for patch in patches}
+
+
+detection_patcher = None  # The Patcher that forked detection workers check, see detect_in_workers
+
+
+def detect_in_workers(patcher: Patcher, patches: list[str]) -> dict[str, bool | None]:
+    """Checks which patches are applied, split between worker processes. The checks are pure Python, so threads wouldn't run them any faster.
+    Workers are forked, so they inherit the patcher (and its ROM) instead of having it pickled or loaded again. With spawn or forkserver, or too few patches, they're checked here instead.
+    """
+    global detection_patcher
+    workers = min(cpu_count() or 1, len(patches) // MIN_PATCHES_PER_DETECTION_WORKER)
+    if workers < 2 or get_start_method() != "fork":
+        return {patch: is_applied(patcher, patch) for patch in patches}
+    detection_patcher = patcher
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_profiled, profiler.enabled, detect_with_inherited_patcher, patches[i::workers])
+                for i in range(workers)
+            ]
+            detected = {}
+            for future in futures:
+                chunk, spans = future.result()
+                detected.update(chunk)
+                profiler.add_spans(spans)
+    finally:
+        detection_patcher = None
+    return {patch: detected[patch] for patch in patches}
+
+
+def detect_with_inherited_patcher(patches: list[str]) -> dict[str, bool | None]:
+    return {patch: is_applied(detection_patcher, patch) for patch in patches}
+
+
+def is_applied(patcher: Patcher, patch: str) -> bool | None:
+    with span(patch, "patch_detect"):
+        try:
+            return patcher.is_applied(patch)
+        except NotImplementedError:
+            return None
+
+
+def apply_patches(
+    rom: NintendoDSRom,
+    patches_to_apply: list[str],
+    config,
+    rom_sha256: str | None = None,
+    session: PatchSession | None = None,
+):
+    """Applies a list of patches to a ROM. If the ROM is still untouched, pass its SHA-256 to let a vanilla ROM reuse its cached ppmdu config. Pass the PatchSession used for get_applied_list to avoid loading custom patches again.
+    Raises PatchApplyError if any patch fails to apply."""
     # Initialize
-    ppmdu_config = get_ppmdu_config_for_rom(rom)
-    patcher = Patcher(rom, ppmdu_config)
+    if session is None:
+        session = PatchSession(config)
+    # Deltas can only be replayed if we know exactly which ROM we started from.
+    delta_cache = PatchDeltaCache(config, rom_sha256, session) if rom_sha256 is not None else None
+    patcher = None  # Only created once a patch actually has to be applied
     patch_configs = config["Patches"]["Include"]
-    load_all_custom_patches(patcher, config)
     for patch in patches_to_apply:
-        print(f"{BLUE_TEXT}Applying {patch}...{CLEAR_TEXT}")
         patch_config = None
         if patch in patch_configs:
             patch_config = patch_configs[patch]
+        if delta_cache is not None:
+            delta_key = delta_cache.next_key(patch, patch_config)
+            delta = delta_cache.load(delta_key)
+            if delta is not None:
+                print(f"{BLUE_TEXT}Replaying {patch}...{CLEAR_TEXT} (unchanged since last run)")
+                delta.apply_to(rom)
+                continue
+            snapshot = RomSnapshot(rom)
+        print(f"{BLUE_TEXT}Applying {patch}...{CLEAR_TEXT}")
+        if patcher is None:
+            try:
+                ppmdu_config = VanillaCache(rom_sha256).get("ppmdu_config", lambda: get_ppmdu_config_for_rom(rom))
+                patcher = session.create_patcher(rom, ppmdu_config)
+            except Exception as e:
+                raise PatchApplyError(f"Loading patches failed before applying {patch}. Error info: {e}") from e
         try:
-            patcher.apply(patch, patch_config)
+            with span(patch, "patch_apply"):
+                patcher.apply(patch, patch_config)
         except PatchNotConfiguredError as e:
-            print(
-                f"{RED_TEXT}Config error encountered for parameter {e.config_parameter} while applying {patch}. Error info: {e}\nAborting :({CLEAR_TEXT}"
-            )
-            exit(1)
+            raise PatchApplyError(
+                f"Config error encountered for parameter {e.config_parameter} while applying {patch}. Error info: {e}"
+            ) from e
+        except Exception as e:
+            raise PatchApplyError(f"{patch} failed to apply. Error info: {e}") from e
+        if delta_cache is not None:
+            delta_cache.save(delta_key, RomDelta(snapshot.changes(rom), snapshot))
+
+
+def apply_patches_to_file(
+    rom_path: str,
+    rom_identity: list,
+    patches_to_apply: list[str],
+    config,
+    rom_sha256: str | None = None,
+    session: PatchSession | None = None,
+) -> RomChanges:
+    """Same as apply_patches, but loads the ROM from rom_path and returns what the patches changed. Meant to be run in another process, so only the path has to be sent there instead of the whole ROM.
+    rom_identity is the file_identity of the file when the caller loaded it. Raises PatchApplyError if the file has changed since, since the changes wouldn't fit the caller's ROM."""
+    if file_identity(rom_path) != rom_identity:
+        raise PatchApplyError(f"{rom_path} changed since it was loaded.")
+    rom = NintendoDSRom.fromFile(rom_path)
+    snapshot = RomSnapshot(rom)
+    apply_patches(rom, patches_to_apply, config, rom_sha256, session)
+    return snapshot.changes(rom)
 
 
 def verify_patch_parameters(patcher: Patcher, patch: str, config) -> list[str]:
@@ -84,28 +356,27 @@ def sort_by_dependencies(patcher: Patcher, patches: list[str]) -> list[str]:
     return patches
 
 
-def get_applied_list(rom: NintendoDSRom, config):
-    """Creates a list of ASM patches that should be applied to the ROM, and verifies that any needed parameters are present in config. Returns a list of patches, and a list of any issues found with config."""
-    ppmdu_config = get_ppmdu_config_for_rom(rom)
-    patcher = Patcher(rom, ppmdu_config)
-    load_all_custom_patches(patcher, config)
+def get_applied_list(rom: NintendoDSRom, config, session: PatchSession | None = None, rom_sha256: str | None = None):
+    """Creates a list of ASM patches that should be applied to the ROM, and verifies that any needed parameters are present in config. Returns a list of patches, and a list of any issues found with config.
+    Pass the ROM's SHA-256 to reuse the detection results of a previous run if neither the ROM nor the skypatches have changed."""
+    if session is None:
+        session = PatchSession(config)
+    patcher = session.create_patcher(rom)
     applied_ready = []
     applied_not_ready = []
     issues = []
     exclude = config["Patches"]["Exclude"]
-    for patch in patcher._loaded_patches:
-        if exclude is None or patch not in exclude:  # Skip running checks for anything listed under Exclude
-            try:
-                patch_is_applied = patcher.is_applied(patch)
-            except NotImplementedError:
-                continue
-            if patch_is_applied:
-                verification = verify_patch_parameters(patcher, patch, config)
-                if verification[0] == "OK!":
-                    applied_ready.append(patch)
-                else:
-                    applied_not_ready.append(patch)
-                    issues += verification
+    # Skip running checks for anything listed under Exclude
+    to_check = [patch for patch in patcher._loaded_patches if exclude is None or patch not in exclude]
+    detected = detect_applied_patches(patcher, to_check, config, rom_sha256, session)
+    for patch in to_check:
+        if detected[patch]:
+            verification = verify_patch_parameters(patcher, patch, config)
+            if verification[0] == "OK!":
+                applied_ready.append(patch)
+            else:
+                applied_not_ready.append(patch)
+                issues += verification
     # force add any patches that are listed in config but weren't automatically found by Pilgrim
     for patch in config["Patches"]["Include"]:
         if patch not in applied_ready and patch not in applied_not_ready:
@@ -117,13 +388,3 @@ def get_applied_list(rom: NintendoDSRom, config):
                 issues += verification
     applied_ready = sort_by_dependencies(patcher, applied_ready)
     return applied_ready, issues
-
-
-def load_all_custom_patches(patcher: Patcher, config):
-    """Add all skypatches in the projects skypatches folder to the patcher's patch list."""
-    skypatch_folder_abs = join(config["Root"], SKYPATCH_FOLDER)
-    for f in listdir(skypatch_folder_abs):
-        path = join(skypatch_folder_abs, f)
-        if isfile(path) and f.endswith(".skypatch"):
-            print(f"Loading {f}...")
-            patcher.add_pkg(path)
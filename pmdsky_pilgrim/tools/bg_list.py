@@ -4,12 +4,16 @@
 #  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
+from hashlib import blake2b
 from ndspy.rom import NintendoDSRom
 from skytemple_files.graphics.bg_list_dat.handler import BgListDatHandler
 from skytemple_files.graphics.bg_list_dat._model import BgListEntry, BgList
 from .colors import BLUE_TEXT, YELLOW_TEXT, CLEAR_TEXT, GREEN_TEXT
+from .vanilla_cache import VanillaCache
 
-BG_LIST_DAT_FILE = "MAP_BG/bg_list.dat"
+BG_FOLDER = "MAP_BG"
+BG_LIST_DAT_FILE = f"{BG_FOLDER}/bg_list.dat"
+BG_FILE_EXTENSIONS = [".bpl", ".bpc", ".bma"]  # In the order of entry_key
 
 
 class BGToCopy:
@@ -25,21 +29,31 @@ class BGToCopy:
         return f"Index {self.eu_index}: {str(self.entry)}"
 
 
-def create_na_bg_list(vanilla_eu: NintendoDSRom, mod_eu: NintendoDSRom, vanilla_na: NintendoDSRom):
-    """Creates the MAP_BG/bg_list.dat file for mod_na."""
+def create_na_bg_list(
+    vanilla_eu: NintendoDSRom,
+    mod_eu: NintendoDSRom,
+    vanilla_na: NintendoDSRom,
+    vanilla_eu_sha256: str | None = None,
+    vanilla_na_sha256: str | None = None,
+    check_contents: bool = False,
+):
+    """Creates the MAP_BG/bg_list.dat file for mod_na. If the SHA-256s of the vanilla ROMs are given, their entry lists come from the vanilla cache.
+    If check_contents is set, backgrounds whose entry is unchanged but whose BPC, BPL or BMA files were edited are ported too (see find_bg_files_to_copy)."""
     print(f"{YELLOW_TEXT}Checking MAP_BG/bg_list.dat...{CLEAR_TEXT}")
     handler = BgListDatHandler()
-    bg_list_vanilla_eu = handler.deserialize(vanilla_eu.getFileByName(BG_LIST_DAT_FILE))
-    bg_list_mod_eu = handler.deserialize(mod_eu.getFileByName(BG_LIST_DAT_FILE))
-    bg_list_vanilla_na = handler.deserialize(vanilla_na.getFileByName(BG_LIST_DAT_FILE))
-
-    bgs_to_copy = compare_base_to_mod(bg_list_vanilla_eu, bg_list_mod_eu)
+    bg_list_vanilla_eu = bg_list_keys(vanilla_eu, vanilla_eu_sha256)
+    bgs_to_copy = find_bgs_to_copy(vanilla_eu, mod_eu, vanilla_eu_sha256)
+    if check_contents:
+        for path in find_bg_files_to_copy(vanilla_eu, mod_eu, vanilla_na, bg_list_vanilla_eu, bgs_to_copy):
+            print(f"{BLUE_TEXT}{path} was edited! Copying...{CLEAR_TEXT}")
+            vanilla_na.setFileByName(path, mod_eu.getFileByName(path))
     if len(bgs_to_copy) <= 0:
         print(f"{GREEN_TEXT}bg_list.dat is unmodified! Skipping...{CLEAR_TEXT}")
         return
     else:
         print(f"{BLUE_TEXT}bg_list.dat is modified! Porting...{CLEAR_TEXT}")
-    find_na_indexes(bgs_to_copy, bg_list_vanilla_eu, bg_list_vanilla_na)
+    find_na_indexes(bgs_to_copy, bg_list_vanilla_eu, bg_list_keys(vanilla_na, vanilla_na_sha256))
+    bg_list_vanilla_na = handler.deserialize(vanilla_na.getFileByName(BG_LIST_DAT_FILE))
     for bg_to_copy in bgs_to_copy:
         if bg_to_copy.added:
             bg_list_vanilla_na.add_level(bg_to_copy.entry)
@@ -48,41 +62,108 @@ def create_na_bg_list(vanilla_eu: NintendoDSRom, mod_eu: NintendoDSRom, vanilla_
     vanilla_na.setFileByName(BG_LIST_DAT_FILE, handler.serialize(bg_list_vanilla_na))
 
 
-def compare_base_to_mod(base: BgList, modified: BgList) -> list[BGToCopy]:
-    """Compile a list of entries in bg_list.dat that have been modified. Note that this does NOT check file contents, only the names of the files that make up a background."""
-    level_base = base.level
+def find_bgs_to_copy(
+    vanilla_eu: NintendoDSRom, mod_eu: NintendoDSRom, vanilla_eu_sha256: str | None = None
+) -> list[BGToCopy]:
+    """Returns the entries of mod_eu's bg_list.dat that differ from vanilla_eu's."""
+    bg_list_mod_eu = BgListDatHandler().deserialize(mod_eu.getFileByName(BG_LIST_DAT_FILE))
+    return compare_base_to_mod(bg_list_keys(vanilla_eu, vanilla_eu_sha256), bg_list_mod_eu)
+
+
+def entry_key(entry: BgListEntry) -> tuple:
+    """A hashable value that is equal for two entries exactly when they reference the same files."""
+    return (entry.bpl_name, entry.bpc_name, entry.bma_name, tuple(entry.bpa_names))
+
+
+def bg_list_keys(rom: NintendoDSRom, rom_sha256: str | None = None) -> list[tuple]:
+    """Returns the key (see entry_key) of every entry in a ROM's bg_list.dat. Cached per bg_list.dat contents for vanilla ROMs."""
+    bg_list_data = rom.getFileByName(BG_LIST_DAT_FILE)
+    return VanillaCache(rom_sha256).get(
+        f"bg_list_keys_{blake2b(bg_list_data, digest_size=16).hexdigest()}",
+        lambda: [entry_key(entry) for entry in BgListDatHandler().deserialize(bg_list_data).level],
+    )
+
+
+def compare_base_to_mod(base: list[tuple], modified: BgList) -> list[BGToCopy]:
+    """Compile a list of entries in bg_list.dat that have been modified. Note that this does NOT check file contents, only the names of the files that make up a background (see find_bg_files_to_copy for that). The base list is given as the keys of its entries (see bg_list_keys)."""
     level_modified = modified.level
     bgs_to_copy = []
-    if len(level_modified) < len(level_base):
+    if len(level_modified) < len(base):
         raise ValueError("Modified ROM has a shorter bg_list.dat than the base ROM. This shouldn't be possible?")
-    for i in range(len(level_base)):
-        base_entry = level_base[i]
+    for i in range(len(base)):
         modified_entry = level_modified[i]
-        if str(base_entry) != str(
-            modified_entry
-        ):  # There's probably a more efficient way to compare BgListEntries than this.
+        if base[i] != entry_key(modified_entry):
             print(f"Entry {i} does not match")
             bgs_to_copy.append(BGToCopy(modified_entry, i, False))
-    for i in range(len(level_base), len(level_modified)):
+    for i in range(len(base), len(level_modified)):
         modified_entry = level_modified[i]
         print(f"Entry {i} is newly added")
         bgs_to_copy.append(BGToCopy(modified_entry, i, True))
     return bgs_to_copy
 
 
-def find_na_indexes(bgs_to_copy: list[BGToCopy], eu: BgList, na: BgList):
-    """Fills in the na_index value for every entry in the bgs_to_copy list."""
-    eu_list = eu.level
-    na_list = na.level
-    na_str_list = [str(x) for x in na_list]
+def find_na_indexes(bgs_to_copy: list[BGToCopy], eu_key_list: list[tuple], na_key_list: list[tuple]):
+    """Fills in the na_index value for every entry in the bgs_to_copy list. Both lists are given as the keys of their entries (see bg_list_keys)."""
+    na_indexes = {}
+    for na_index, na_key in enumerate(na_key_list):
+        na_indexes.setdefault(na_key, na_index)  # Like list.index, the first matching entry wins.
     for bg_to_copy in bgs_to_copy:
         if not bg_to_copy.added:
-            try:
-                eu_str = str(
-                    eu_list[bg_to_copy.eu_index]
-                )  # Get the vanilla version of the entry at this index so we can search for it.
-                na_index = na_str_list.index(eu_str)  # Find the index of the matching entry in NA.
-                bg_to_copy.na_index = na_index  # Write that index to NA.
-            except ValueError:
-                print(f"EU entry [{str(eu_str)}], index {bg_to_copy.eu_index}, is not present in NA's list.")
+            eu_key = eu_key_list[
+                bg_to_copy.eu_index
+            ]  # Get the vanilla version of the entry at this index so we can search for it.
+            if eu_key in na_indexes:
+                bg_to_copy.na_index = na_indexes[eu_key]  # Find the index of the matching entry in NA.
+            else:
+                print(f"EU entry [{key_to_str(eu_key)}], index {bg_to_copy.eu_index}, is not present in NA's list.")
         print(f"EU index {bg_to_copy.eu_index} maps to NA index {bg_to_copy.na_index}")
+
+
+def key_to_str(key: tuple) -> str:
+    """Formats an entry key like BgListEntry.__str__ does."""
+    return f"BPL: {key[0]}, BPC: {key[1]}, BMA: {key[2]}, BPAs: {list(key[3])}"
+
+
+def find_bg_files_to_copy(
+    vanilla_eu: NintendoDSRom,
+    mod_eu: NintendoDSRom,
+    vanilla_na: NintendoDSRom,
+    base: list[tuple],
+    bgs_to_copy: list[BGToCopy],
+) -> list[str]:
+    """Finds the BPL, BPC and BMA files of backgrounds whose entry in bg_list.dat is unchanged, but whose files were edited in mod_eu. Returns the paths of the files to copy to NA.
+    A file is only safe to copy if it's the same in vanilla EU and vanilla NA. Edited files that aren't are reported instead, to be ported by hand."""
+    modified_indexes = set(bg_to_copy.eu_index for bg_to_copy in bgs_to_copy)
+    paths = []
+    seen = set()
+    for i in range(len(base)):
+        if i in modified_indexes:
+            # Modified and added entries only have their bg_list.dat entry ported (see create_na_bg_list). The files they reference aren't copied here or anywhere else.
+            continue
+        for name, extension in zip(base[i][:3], BG_FILE_EXTENSIONS):
+            if name is None:
+                continue
+            path = f"{BG_FOLDER}/{name.lower()}{extension}"
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    files_to_copy = []
+    for path in paths:
+        try:
+            mod_data = mod_eu.getFileByName(path)
+            vanilla_eu_data = vanilla_eu.getFileByName(path)
+        except ValueError:
+            continue  # Only edits to existing files are handled here.
+        if mod_data == vanilla_eu_data:
+            continue
+        try:
+            vanilla_na_data = vanilla_na.getFileByName(path)
+        except ValueError:
+            vanilla_na_data = None
+        if vanilla_na_data == vanilla_eu_data:
+            files_to_copy.append(path)
+        else:
+            print(
+                f"{YELLOW_TEXT}{path} was edited, but differs between vanilla EU and NA, so it can't be copied safely. Port it manually.{CLEAR_TEXT}"
+            )
+    return files_to_copy
@@ -0,0 +1,309 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import re
+from os.path import getsize
+from zlib import crc32
+
+# Creates BPS patches (https://github.com/blakesmith0/bps_spec) from a source file and a target file that only differ in known ranges.
+# Everything outside those ranges is copied from the source at the same offset, so only the ranges themselves are searched for matches.
+
+BPS_MAGIC = b"BPS1"
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+# Changed data is searched for copies of this many source bytes, indexed every this many bytes.
+# Any match at least twice this long is found.
+MATCH_BLOCK_SIZE = 32
+# Runs of one byte (like padding) at least this long are written as a copy of the previous byte.
+RUN_PATTERN = re.compile(rb"(.)\1{31,}", re.DOTALL)
+# XORing old and new data turns bytes that are the same into zeros, so where they're the same again can be searched for in C.
+SAME_PATTERN = re.compile(rb"\x00{%d}" % MATCH_BLOCK_SIZE)
+MAX_XOR_WINDOW_SIZE = 0x10000
+CHUNK_SIZE = 0x100000
+
+
+class BpsEncoder:
+    """Writes BPS actions, keeping track of the positions that relative copies are encoded against."""
+
+    def __init__(self, source_size: int, target_size: int):
+        self.patch = bytearray(BPS_MAGIC)
+        self.patch += encode_number(source_size)
+        self.patch += encode_number(target_size)
+        self.patch += encode_number(0)  # No metadata
+        self.output_offset = 0
+        self.source_relative_offset = 0
+        self.target_relative_offset = 0
+
+    def action(self, action: int, length: int):
+        self.patch += encode_number(((length - 1) << 2) | action)
+        self.output_offset += length
+
+    def source_read(self, length: int):
+        """Copies source bytes at the current output offset."""
+        if length > 0:
+            self.action(SOURCE_READ, length)
+
+    def target_read(self, data: bytes):
+        """Writes literal bytes, with long runs of one byte turned into copies."""
+        start = 0
+        for run in RUN_PATTERN.finditer(data):
+            self.literal(data[start : run.start() + 1])
+            self.target_copy(self.output_offset - 1, run.end() - run.start() - 1)
+            start = run.end()
+        self.literal(data[start:])
+
+    def literal(self, data: bytes):
+        if len(data) > 0:
+            self.action(TARGET_READ, len(data))
+            self.patch += data
+
+    def source_copy(self, source_offset: int, length: int):
+        self.action(SOURCE_COPY, length)
+        self.patch += encode_signed(source_offset - self.source_relative_offset)
+        self.source_relative_offset = source_offset + length
+
+    def target_copy(self, target_offset: int, length: int):
+        self.action(TARGET_COPY, length)
+        self.patch += encode_signed(target_offset - self.target_relative_offset)
+        self.target_relative_offset = target_offset + length
+
+    def finish(self, source_crc: int, target_crc: int) -> bytes:
+        self.patch += source_crc.to_bytes(4, "little")
+        self.patch += target_crc.to_bytes(4, "little")
+        self.patch += crc32(self.patch).to_bytes(4, "little")
+        return bytes(self.patch)
+
+
+class SourceIndex:
+    """Finds copies of changed data in the parts of the source that were replaced or moved."""
+
+    def __init__(self):
+        self.blocks = {}  # block of source bytes: (region data, offset in region, offset of region in source)
+
+    def add(self, data: bytes, source_offset: int):
+        for offset in range(0, len(data) - MATCH_BLOCK_SIZE + 1, MATCH_BLOCK_SIZE):
+            self.blocks.setdefault(data[offset : offset + MATCH_BLOCK_SIZE], (data, offset, source_offset))
+
+    def encode(self, encoder: BpsEncoder, data: bytes):
+        """Encodes data as copies of matching source bytes where there are any, and as literals everywhere else."""
+        literal_start = 0
+        i = 0
+        while i + MATCH_BLOCK_SIZE <= len(data):
+            match = self.blocks.get(data[i : i + MATCH_BLOCK_SIZE])
+            if match is None:
+                i += 1
+                continue
+            region, region_offset, source_offset = match
+            # The match may start in the bytes before the block that matched.
+            back = common_suffix_length(data, i, region, region_offset, min(i - literal_start, region_offset))
+            length = (
+                back
+                + MATCH_BLOCK_SIZE
+                + common_prefix_length(data, i + MATCH_BLOCK_SIZE, region, region_offset + MATCH_BLOCK_SIZE)
+            )
+            encoder.target_read(data[literal_start : i - back])
+            encoder.source_copy(source_offset + region_offset - back, length)
+            i += length - back
+            literal_start = i
+        encoder.target_read(data[literal_start:])
+
+
+def create_bps_patch(
+    source_path: str,
+    target_path: str,
+    changed_ranges: list[tuple[int, int]],
+    source_ranges: list[tuple[int, int]],
+    patch_path: str,
+) -> int:
+    """Writes a BPS patch from source_path to target_path. Anything outside changed_ranges [(offset, size)] must be the same in both files, except where the target is larger than the source.
+    source_ranges lists the parts of the source that changed data may have been copied from (like the old location of a moved file). Returns the size of the patch.
+    """
+    source_size = getsize(source_path)
+    target_size = getsize(target_path)
+    regions = merge_ranges(
+        [(offset, min(offset + size, target_size)) for offset, size in changed_ranges]
+        + [(min(source_size, target_size), target_size)]
+    )
+    encoder = BpsEncoder(source_size, target_size)
+    index = SourceIndex()
+    with open(source_path, "rb") as source, open(target_path, "rb") as target:
+        for start, end in merge_ranges([(offset, offset + size) for offset, size in source_ranges] + regions):
+            index.add(read_at(source, start, end - start), start)
+        for start, end in regions:
+            # Whatever is before this region didn't change.
+            encoder.source_read(start - encoder.output_offset)
+            new_data = read_at(target, start, end - start)
+            old_data = read_at(source, start, end - start)
+            # Changed regions are often only partly different, like a file that was rewritten in place.
+            position = 0
+            while position < len(new_data):
+                same = common_prefix_length(new_data, position, old_data, position)
+                encoder.source_read(same)
+                position += same
+                different = different_length(new_data, position, old_data)
+                index.encode(encoder, new_data[position : position + different])
+                position += different
+        encoder.source_read(target_size - encoder.output_offset)
+        patch = encoder.finish(file_crc32(source), file_crc32(target))
+    with open(patch_path, "wb") as f:
+        f.write(patch)
+    return len(patch)
+
+
+def apply_bps_patch(source: bytes, patch: bytes) -> bytes:
+    """Applies a BPS patch, checking every CRC. Raises ValueError if the patch is invalid or doesn't match source."""
+    if patch[:4] != BPS_MAGIC:
+        raise ValueError("Not a BPS patch.")
+    if crc32(patch[:-4]) != int.from_bytes(patch[-4:], "little"):
+        raise ValueError("The patch is corrupted.")
+    if crc32(source) != int.from_bytes(patch[-12:-8], "little"):
+        raise ValueError("The patch is not for this file.")
+    position = 4
+    source_size, position = decode_number(patch, position)
+    target_size, position = decode_number(patch, position)
+    metadata_size, position = decode_number(patch, position)
+    position += metadata_size
+    target = bytearray()
+    source_relative_offset = 0
+    target_relative_offset = 0
+    while position < len(patch) - 12:
+        data, position = decode_number(patch, position)
+        action, length = data & 3, (data >> 2) + 1
+        if action == SOURCE_READ:
+            target += source[len(target) : len(target) + length]
+        elif action == TARGET_READ:
+            target += patch[position : position + length]
+            position += length
+        else:
+            offset, position = decode_number(patch, position)
+            offset = -(offset >> 1) if offset & 1 else offset >> 1
+            if action == SOURCE_COPY:
+                source_relative_offset += offset
+                target += source[source_relative_offset : source_relative_offset + length]
+                source_relative_offset += length
+            else:
+                target_relative_offset += offset
+                # Copies can overlap the bytes they produce.
+                for _ in range(length):
+                    target.append(target[target_relative_offset])
+                    target_relative_offset += 1
+    if len(target) != target_size or crc32(target) != int.from_bytes(patch[-8:-4], "little"):
+        raise ValueError("The patch produced the wrong output.")
+    return bytes(target)
+
+
+def encode_number(number: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        low_bits = number & 0x7F
+        number >>= 7
+        if number == 0:
+            encoded.append(0x80 | low_bits)
+            return bytes(encoded)
+        encoded.append(low_bits)
+        number -= 1
+
+
+def encode_signed(number: int) -> bytes:
+    return encode_number((abs(number) << 1) | (number < 0))
+
+
+def decode_number(data: bytes, position: int) -> tuple[int, int]:
+    """Returns the number at position, and the position after it."""
+    number = 0
+    shift = 1
+    while True:
+        byte = data[position]
+        position += 1
+        number += (byte & 0x7F) * shift
+        if byte & 0x80:
+            return number, position
+        shift <<= 7
+        number += shift
+
+
+def common_prefix_length(a: bytes, a_start: int, b: bytes, b_start: int) -> int:
+    """Counts how many bytes match starting at a[a_start] and b[b_start]. Whole chunks are compared first, since that's done in C."""
+    length = 0
+    chunk = MATCH_BLOCK_SIZE
+    while a_start + length < len(a) and b_start + length < len(b):
+        if a[a_start + length : a_start + length + chunk] == b[b_start + length : b_start + length + chunk]:
+            length += chunk
+            chunk *= 2
+        elif chunk > 1:
+            chunk //= 2
+        else:
+            break
+    return max(0, min(length, len(a) - a_start, len(b) - b_start))
+
+
+def common_suffix_length(a: bytes, a_end: int, b: bytes, b_end: int, limit: int) -> int:
+    """Counts how many bytes match going backwards from a[a_end - 1] and b[b_end - 1], up to limit. Like common_prefix_length, whole chunks are compared first."""
+    length = 0
+    chunk = MATCH_BLOCK_SIZE
+    while length < limit:
+        size = min(chunk, limit - length)
+        if a[a_end - length - size : a_end - length] == b[b_end - length - size : b_end - length]:
+            length += size
+            chunk *= 2
+        elif chunk > 1:
+            chunk //= 2
+        else:
+            break
+    return length
+
+
+def different_length(new_data: bytes, start: int, old_data: bytes) -> int:
+    """Counts the bytes from start until new_data has at least MATCH_BLOCK_SIZE bytes in a row that are the same as old_data (or ends).
+    The data is compared a window at a time: XORed, then searched for MATCH_BLOCK_SIZE zeros in a row. Windows start small and grow, since most differences are short."""
+    end = min(len(new_data), len(old_data))
+    position = start
+    window_size = 4 * MATCH_BLOCK_SIZE
+    while position + MATCH_BLOCK_SIZE <= end:
+        window_end = min(position + window_size, end)
+        xored = int.from_bytes(new_data[position:window_end], "little") ^ int.from_bytes(
+            old_data[position:window_end], "little"
+        )
+        same = SAME_PATTERN.search(xored.to_bytes(window_end - position, "little"))
+        if same is not None:
+            return position + same.start() - start
+        if window_end == end:
+            break
+        # The same bytes may start near the end of this window and carry on into the next one.
+        position = window_end - MATCH_BLOCK_SIZE + 1
+        window_size = min(window_size * 2, MAX_XOR_WINDOW_SIZE)
+    if len(new_data) == len(old_data):
+        # Fewer than MATCH_BLOCK_SIZE bytes that stay the same until both end count too.
+        return end - start - common_suffix_length(new_data, end, old_data, end, end - start)
+    return len(new_data) - start
+
+
+def merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Sorts (start, end) ranges and merges the ones that overlap or touch. Empty ranges are dropped."""
+    merged = []
+    for start, end in sorted(ranges):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+def file_crc32(f) -> int:
+    f.seek(0)
+    crc = 0
+    while chunk := f.read(CHUNK_SIZE):
+        crc = crc32(chunk, crc)
+    return crc
@@ -0,0 +1,67 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from json import load, dump, JSONDecodeError
+from pickle import loads, dumps, HIGHEST_PROTOCOL, UnpicklingError
+from os import makedirs, replace, getpid, getenv
+from os.path import join, expanduser
+from threading import get_ident
+
+PROJECT_CACHE_FOLDER = ".pilgrim"
+USER_CACHE_FOLDER = "pmdsky-pilgrim"
+
+
+def project_cache_dir(config, *subfolders: str) -> str:
+    """Returns the path to the project's cache folder (or a subfolder of it), creating it if needed."""
+    cache_dir = join(config["Root"], PROJECT_CACHE_FOLDER, *subfolders)
+    makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def user_cache_dir(*subfolders: str) -> str:
+    """Returns the path to the per-user cache folder (or a subfolder of it), creating it if needed. Set PILGRIM_CACHE_DIR to override its location."""
+    cache_root = getenv("PILGRIM_CACHE_DIR")
+    if cache_root is None:
+        cache_root = join(getenv("XDG_CACHE_HOME", join(expanduser("~"), ".cache")), USER_CACHE_FOLDER)
+    cache_dir = join(cache_root, *subfolders)
+    makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def read_json(path: str) -> dict:
+    """Reads a JSON cache file. Missing or broken files are treated as an empty cache."""
+    try:
+        with open(path) as f:
+            data = load(f)
+    except (FileNotFoundError, JSONDecodeError):
+        return {}
+    if type(data) is not dict:
+        return {}
+    return data
+
+
+def write_json(path: str, data: dict):
+    """Writes a JSON cache file. The file is replaced atomically, so a crash mid-write can't corrupt the cache."""
+    tmp_path = f"{path}.{getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        dump(data, f, indent=1)
+    replace(tmp_path, path)
+
+
+def read_pickle(path: str):
+    """Reads a pickled cache file. Returns None if the file is missing or can't be unpickled."""
+    try:
+        with open(path, "rb") as f:
+            return loads(f.read())
+    except (FileNotFoundError, EOFError, UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def write_pickle(path: str, data):
+    tmp_path = f"{path}.{getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(dumps(data, protocol=HIGHEST_PROTOCOL))
+    replace(tmp_path, path)
@@ -4,8 +4,14 @@
 #  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
+from hashlib import blake2b
+from os.path import join
 from ndspy.rom import NintendoDSRom
-from skytemple_files.common.util import get_files_from_rom_with_extension
+from ndspy.fnt import Folder
+from .cache import project_cache_dir, read_json, write_json
+from .vanilla_cache import VanillaCache
+
+FILE_INDEX_CACHE_FOLDER = "file_indexes"
 
 
 # Creates FOUR lists based on ROM contents to determine porting process.
@@ -16,33 +22,77 @@ from skytemple_files.common.util import get_files_from_rom_with_extension
 # First input: base ROM that the modified ROM was built from.
 # Second input: modified ROM that you're trying to port.
 # Third input: the target ROM you're trying to port modifications to.
-def create_lists(base_rom: NintendoDSRom, mod_rom: NintendoDSRom, target_rom: NintendoDSRom):
-    base_files = get_files_from_rom_with_extension(base_rom, "")
-    target_files = get_files_from_rom_with_extension(target_rom, "")
-    modified_files = get_files_from_rom_with_extension(mod_rom, "")
-    added, _, mod_base_share = categorize_lists(modified_files, base_files)
-    _, modified = categorize_shared_files(mod_rom, base_rom, mod_base_share)
-    _, target_missing, base_target_share = categorize_lists(target_files, base_files)
-    base_target_identical, base_target_different = categorize_shared_files(target_rom, base_rom, base_target_share)
-    _, _, modified_base_target_identical = categorize_lists(modified, base_target_identical)
-    _, _, modified_base_target_different = categorize_lists(modified, base_target_different)
-    _, _, modified_target_missing = categorize_lists(modified, target_missing)
+# If indexes for the base or target ROM were already built (see cached_file_index), they can be passed in to skip reading those ROMs.
+def create_lists(
+    base_rom: NintendoDSRom,
+    mod_rom: NintendoDSRom,
+    target_rom: NintendoDSRom,
+    base_index: dict[str, tuple[int, str]] | None = None,
+    target_index: dict[str, tuple[int, str]] | None = None,
+):
+    if base_index is None:
+        base_index = build_file_index(base_rom)
+    if target_index is None:
+        target_index = build_file_index(target_rom)
+    mod_index = build_file_index(mod_rom)
+    added = []
+    modified = []
+    for path, fingerprint in mod_index.items():
+        base_fingerprint = base_index.get(path)
+        if base_fingerprint is None:
+            added.append(path)
+        elif base_fingerprint != fingerprint:
+            modified.append(path)
+    modified_base_target_identical = []
+    modified_base_target_different = []
+    modified_target_missing = []
+    for path in modified:
+        target_fingerprint = target_index.get(path)
+        if target_fingerprint is None:
+            modified_target_missing.append(path)
+        elif target_fingerprint == base_index[path]:
+            modified_base_target_identical.append(path)
+        else:
+            modified_base_target_different.append(path)
     return added, modified_base_target_identical, modified_base_target_different, modified_target_missing
 
 
+def build_file_index(rom: NintendoDSRom) -> dict[str, tuple[int, str]]:
+    """Builds a dict of path: (size, digest) for every file in a ROM, in a single pass over the filename table."""
+    index = {}
+    index_folder(rom, rom.filenames, "", index)
+    return index
+
+
+def index_folder(rom: NintendoDSRom, folder: Folder, path: str, index: dict[str, tuple[int, str]]):
+    for i in range(len(folder.files)):
+        data = rom.files[folder.firstID + i]
+        index.update({path + folder.files[i]: (len(data), blake2b(data, digest_size=16).hexdigest())})
+    for subfolder_name, subfolder in folder.folders:
+        index_folder(rom, subfolder, path + subfolder_name + "/", index)
+
+
+def cached_file_index(config, rom: NintendoDSRom, sha256: str) -> dict[str, tuple[int, str]]:
+    """Returns the file index of a ROM, reusing a saved one if this exact ROM was indexed before. Only useful for ROMs that never change (read: vanilla ROMs). Indexes of the known vanilla ROMs are shared between all projects."""
+    vanilla_cache = VanillaCache(sha256)
+    if vanilla_cache.enabled:
+        return vanilla_cache.get("file_index", lambda: build_file_index(rom))
+    cache_path = join(project_cache_dir(config, FILE_INDEX_CACHE_FOLDER), f"{sha256}.json")
+    saved_index = read_json(cache_path)
+    if len(saved_index) > 0:
+        return {path: tuple(fingerprint) for path, fingerprint in saved_index.items()}
+    index = build_file_index(rom)
+    write_json(cache_path, index)
+    return index
+
+
 def categorize_lists(list1: list[any], list2: list[any]):
     """Categorizes the contents of lists into 3 categories: members that are present in only the first list, members that are present in only the second list, and members that are present in both lists."""
-    list1_exclusive = []
-    list2_exclusive = []
-    shared = []
-    for member in list1:
-        if member in list2:
-            shared.append(member)
-        else:
-            list1_exclusive.append(member)
-    for member in list2:
-        if member not in shared:
-            list2_exclusive.append(member)
+    list1_set = set(list1)
+    list2_set = set(list2)
+    list1_exclusive = [member for member in list1 if member not in list2_set]
+    list2_exclusive = [member for member in list2 if member not in list1_set]
+    shared = [member for member in list1 if member in list2_set]
     return list1_exclusive, list2_exclusive, shared
 
 
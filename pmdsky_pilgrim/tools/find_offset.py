@@ -5,24 +5,24 @@
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
 from enum import Enum
-from pmdsky_debug_py.protocol import Symbol
-from pmdsky_debug_py.eu import EuArm9Section, EuOverlay10Section, EuOverlay11Section
-from pmdsky_debug_py.na import NaArm9Section, NaOverlay10Section, NaOverlay11Section
+from array import array
+from bisect import bisect_right
+from .symbol_table import load_symbol_table, write_symbol_table, symbol_table_path
 
 AddressOverlay = Enum(
     "AddressOverlay", ["UNKNOWN", "ARM9", "OVERLAY_10", "OVERLAY_11", "SPECIAL_PROCESS", "OVERLAY_36"]
 )
 
-# These are pretty much just constants and the calculations *should* be pretty fast, so I just load them off the bat.
-ARM9_EU_START = EuArm9Section.loadaddress
-ARM9_EU_END = ARM9_EU_START + EuArm9Section.length
-ARM9_NA_START = NaArm9Section.loadaddress
-OV10_EU_START = EuOverlay10Section.loadaddress
-OV10_EU_END = OV10_EU_START + EuOverlay10Section.length
-OV10_NA_START = NaOverlay10Section.loadaddress
-OV11_EU_START = EuOverlay11Section.loadaddress
-OV11_EU_END = OV11_EU_START + EuOverlay11Section.length
-OV11_NA_START = NaOverlay11Section.loadaddress
+# Section bounds from pmdsky-debug. These are properties of the ROMs and never change, so they're hardcoded rather than imported from pmdsky_debug_py, which is slow to import.
+ARM9_EU_START = 0x2000000
+ARM9_EU_END = ARM9_EU_START + 0xB7D38
+ARM9_NA_START = 0x2000000
+OV10_EU_START = 0x22BD3C0
+OV10_EU_END = OV10_EU_START + 0x1F7A0
+OV10_NA_START = 0x22BCA80
+OV11_EU_START = 0x22DCB80
+OV11_EU_END = OV11_EU_START + 0x48E40
+OV11_NA_START = 0x22DC240
 SP_EU_START = 0x22E7B88
 SP_EU_END = SP_EU_START + 0x810
 SP_NA_START = 0x22E7248
@@ -30,76 +30,157 @@ OV36_START = 0x23A7080
 OV36_END = OV36_START + 0x38F80
 
 
+# Sections are searched in this order. Where sections overlap, an address belongs to the first listed section containing it.
+# SPs run in ground mode, so the overlays loaded there come first. itcm and libs are parts of arm9 that pmdsky-debug lists separately, so they go before arm9 itself.
+# Every other section follows in the order pmdsky-debug lists it, except ram, which only covers whatever is left.
+SECTION_ORDER = ["itcm", "libs", "arm9", "overlay10", "overlay11"]
+LAST_SECTION = "ram"
+
+
 class OffsetMapper:
     def __init__(self):
         # Initialize to none, load as needed.
-        self.arm9_eu_table = None
-        self.arm9_na_table = None
-        self.ov10_eu_table = None
-        self.ov10_na_table = None
-        self.ov11_eu_table = None
-        self.ov11_na_table = None
+        self.symbol_index = None
+
+    def get_symbol_index(self):
+        if self.symbol_index is None:
+            self.symbol_index = load_symbol_index()
+        return self.symbol_index
 
     def find_na_offset(self, eu_offset: int) -> str:
+        return hex(self.map_offset(eu_offset))
+
+    def find_na_offsets(self, eu_offsets) -> list[str | None]:
+        """Batch version of find_na_offset. Unmappable offsets come back as None instead of raising.
+        The offsets are mapped in sorted order in one pass over the segment and symbol arrays, so each search starts where the last one ended, and repeated offsets are only mapped once."""
+        eu_offsets = list(eu_offsets)
+        na_offsets = [None] * len(eu_offsets)
+        symbol_index = self.get_symbol_index()
+        segment_starts = symbol_index.segment_starts
+        segment_sections = symbol_index.segment_sections
+        eu_addresses = symbol_index.eu_addresses
+        # Per section, the index of the first symbol after the last offset mapped in it
+        cursors = [section_start for section_start, section_end in symbol_index.section_bounds]
+        segment = -1
+        last_eu_offset = None
+        last_na_offset = None
+        for i in sorted(range(len(eu_offsets)), key=eu_offsets.__getitem__):
+            eu_offset = eu_offsets[i]
+            if eu_offset != last_eu_offset:
+                last_eu_offset = eu_offset
+                na_offset = None
+                match overlay_of_offset(eu_offset):
+                    case AddressOverlay.SPECIAL_PROCESS:
+                        na_offset = eu_offset + SP_NA_START - SP_EU_START
+                    case AddressOverlay.OVERLAY_36:
+                        na_offset = eu_offset
+                    case _:
+                        while segment + 1 < len(segment_starts) and segment_starts[segment + 1] <= eu_offset:
+                            segment += 1
+                        section = -1 if segment < 0 else segment_sections[segment]
+                        if section >= 0:
+                            greater = bisect_right(
+                                eu_addresses, eu_offset, cursors[section], symbol_index.section_bounds[section][1]
+                            )
+                            cursors[section] = greater
+                            na_offset = symbol_index.map_near(eu_offset, section, greater)
+                last_na_offset = None if na_offset is None else hex(na_offset)
+            na_offsets[i] = last_na_offset
+        return na_offsets
+
+    def map_offset(self, eu_offset: int) -> int:
         match overlay_of_offset(eu_offset):
-            case AddressOverlay.ARM9:
-                if (
-                    self.arm9_eu_table is None
-                ):  # we can assume that if the EU table isn't initialized, the NA one isn't either
-                    self.arm9_eu_table = init_generic_eu_table(EuArm9Section, ARM9_EU_START)
-                    self.arm9_na_table = init_generic_na_table(NaArm9Section, ARM9_NA_START)
-                eu_table = self.arm9_eu_table
-                na_table = self.arm9_na_table
-            case AddressOverlay.OVERLAY_10:
-                if (
-                    self.ov10_eu_table is None
-                ):  # we can assume that if the EU table isn't initialized, the NA one isn't either
-                    self.ov10_eu_table = init_generic_eu_table(EuOverlay10Section, OV10_EU_START)
-                    self.ov10_na_table = init_generic_na_table(NaOverlay10Section, OV10_NA_START)
-                eu_table = self.ov10_eu_table
-                na_table = self.ov10_na_table
-            case AddressOverlay.OVERLAY_11:
-                if (
-                    self.ov11_eu_table is None
-                ):  # we can assume that if the EU table isn't initialized, the NA one isn't either
-                    self.ov11_eu_table = init_generic_eu_table(EuOverlay11Section, OV11_EU_START)
-                    self.ov11_na_table = init_generic_na_table(NaOverlay11Section, OV11_NA_START)
-                eu_table = self.ov11_eu_table
-                na_table = self.ov11_na_table
             case AddressOverlay.SPECIAL_PROCESS:
-                return hex(eu_offset + SP_NA_START - SP_EU_START)
+                return eu_offset + SP_NA_START - SP_EU_START
             case AddressOverlay.OVERLAY_36:
-                return hex(eu_offset)
-            case _:
-                raise UnmappableOffsetException(
-                    f"Offset {hex(eu_offset)} isn't within arm9, ov10, ov11, ov36, or an SP"
-                )
-        lesser_eu_table_offset = 0
-        for eu_table_offset in eu_table:  # REQUIRES DICT TO BE SORTED BY OFFSET TO WORK
-            if eu_offset > eu_table_offset:
-                lesser_eu_table_offset = eu_table_offset
-            elif eu_offset < eu_table_offset:
-                # This is our greater offset
-                greater_eu_table_offset = eu_table_offset
-                break
-            else:
-                # If our offset falls exactly on a symbol, skip doing any math and just get the exact symbol NA offset.
-                return hex(na_table[eu_table[eu_table_offset]])
-        nearest_eu_symbols_distance = (
-            greater_eu_table_offset - lesser_eu_table_offset
-        )  # How far apart are the nearest two symbols?
-        # Get NA offsets of nearest symbols
-        lesser_na_table_offset = na_table[eu_table[lesser_eu_table_offset]]
-        greater_na_table_offset = na_table[eu_table[greater_eu_table_offset]]
-        nearest_na_symbols_distance = (
-            greater_na_table_offset - lesser_na_table_offset
-        )  # How far apart are the NA equivalents of the nearest two symbols?
-        if nearest_eu_symbols_distance != nearest_na_symbols_distance:
+                return eu_offset
+        symbol_index = self.get_symbol_index()
+        section = symbol_index.section_of(eu_offset)
+        if section < 0:
             raise UnmappableOffsetException(
-                f"Offset {hex(eu_offset)} is not mappable, distance between nearest symbols ({eu_table[lesser_eu_table_offset]} and {eu_table[greater_eu_table_offset]}) differs between EU ({hex(nearest_eu_symbols_distance)}) and NA ({hex(nearest_na_symbols_distance)})"
+                f"Offset {hex(eu_offset)} isn't within ov36, an SP, or any section known to pmdsky-debug"
+            )
+        return symbol_index.map_in_section(eu_offset, section)
+
+
+class SymbolIndex:
+    """EU and NA addresses of every symbol pmdsky-debug knows, as sorted arrays that can be binary searched. See build_symbol_index for the layout."""
+
+    def __init__(self, index: dict):
+        self.section_names = index["section_names"]
+        self.section_bounds = index["section_bounds"]
+        self.segment_starts = index["segment_starts"]
+        self.segment_sections = index["segment_sections"]
+        self.eu_addresses = index["eu_addresses"]
+        self.na_addresses = index["na_addresses"]
+        self.symbol_names = index["symbol_names"]
+
+    def section_of(self, eu_offset: int) -> int:
+        """Returns the number of the section an address belongs to, or -1 if it isn't in any."""
+        segment = bisect_right(self.segment_starts, eu_offset) - 1
+        if segment < 0:
+            return -1
+        return self.segment_sections[segment]
+
+    def map_in_section(self, eu_offset: int, section: int) -> int:
+        section_start, section_end = self.section_bounds[section]
+        # Index of the nearest symbol after our offset
+        greater = bisect_right(self.eu_addresses, eu_offset, section_start, section_end)
+        na_offset = self.map_near(eu_offset, section, greater)
+        if na_offset is None:
+            raise UnmappableOffsetException(self.unmappable_reason(eu_offset, section, greater))
+        return na_offset
+
+    def map_near(self, eu_offset: int, section: int, greater: int) -> int | None:
+        """Maps an address from the symbols around it, greater being the index of the nearest symbol after it. Returns None if it can't be mapped."""
+        section_start, section_end = self.section_bounds[section]
+        lesser = greater - 1
+        if lesser < section_start:
+            return None
+        lesser_eu_table_offset = self.eu_addresses[lesser]
+        lesser_na_table_offset = self.na_addresses[lesser]
+        if lesser_eu_table_offset == eu_offset:
+            # If our offset falls exactly on a symbol, skip doing any math and just get the exact symbol NA offset.
+            return lesser_na_table_offset
+        if greater >= section_end:
+            return None
+        # Only mappable if the nearest two symbols are the same distance apart in EU and NA
+        if self.eu_addresses[greater] - lesser_eu_table_offset != self.na_addresses[greater] - lesser_na_table_offset:
+            return None
+        return eu_offset - lesser_eu_table_offset + lesser_na_table_offset
+
+    def unmappable_reason(self, eu_offset: int, section: int, greater: int) -> str:
+        """Explains why map_near couldn't map an address."""
+        section_start, section_end = self.section_bounds[section]
+        lesser = greater - 1
+        if lesser < section_start:
+            return f"Offset {hex(eu_offset)} is not mappable, there is no symbol before it in {self.section_names[section]}"
+        if greater >= section_end:
+            return (
+                f"Offset {hex(eu_offset)} is not mappable, there is no symbol after it in {self.section_names[section]}"
             )
-        # Symbols are the same distance apart in NA and EU
-        return hex(eu_offset - lesser_eu_table_offset + lesser_na_table_offset)
+        nearest_eu_symbols_distance = self.eu_addresses[greater] - self.eu_addresses[lesser]
+        nearest_na_symbols_distance = self.na_addresses[greater] - self.na_addresses[lesser]
+        return f"Offset {hex(eu_offset)} is not mappable, distance between nearest symbols ({self.symbol_names[lesser]} and {self.symbol_names[greater]}) differs between EU ({hex(nearest_eu_symbols_distance)}) and NA ({hex(nearest_na_symbols_distance)})"
+
+
+loaded_symbol_index = None  # Shared by every OffsetMapper in this process, since the index never changes
+
+
+def load_symbol_index() -> SymbolIndex:
+    """Returns the symbol index, loading it the first time it's needed in this process."""
+    global loaded_symbol_index
+    if loaded_symbol_index is None:
+        # Use the compiled symbol table if there is one for this version of pmdsky-debug-py. Otherwise, build the index from pmdsky_debug_py and compile it for next time.
+        index = load_symbol_table(symbol_table_path())
+        if index is None:
+            index = build_symbol_index()
+            try:
+                write_symbol_table(index, symbol_table_path())
+            except OSError:
+                pass  # Not being able to write the table only makes the next run slower.
+        loaded_symbol_index = SymbolIndex(index)
+    return loaded_symbol_index
 
 
 class UnmappableOffsetException(Exception):
@@ -125,8 +206,63 @@ def overlay_of_offset(offset: int) -> AddressOverlay:
     return AddressOverlay.UNKNOWN
 
 
+def build_symbol_index() -> dict:
+    """Builds the data for a SymbolIndex. Symbols of every section are paired up by name between EU and NA, and stored in sorted address arrays, one slice per section.
+    Overlapping sections are flattened into segments (see SECTION_ORDER), so the section of an address can be binary searched as well."""
+    from pmdsky_debug_py.eu import EuSections
+    from pmdsky_debug_py.na import NaSections
+
+    listed_sections = [name for name in vars(EuSections) if not name.startswith("_") and hasattr(NaSections, name)]
+    section_names = [name for name in SECTION_ORDER if name in listed_sections]
+    section_names += [name for name in listed_sections if name not in section_names and name != LAST_SECTION]
+    if LAST_SECTION in listed_sections:
+        section_names.append(LAST_SECTION)
+    section_bounds = []
+    section_ranges = []
+    eu_addresses = array("I")
+    na_addresses = array("I")
+    symbol_names = []
+    for section_name in section_names:
+        eu_section = getattr(EuSections, section_name)
+        na_section = getattr(NaSections, section_name)
+        eu_table = init_generic_eu_table(eu_section, eu_section.loadaddress)
+        na_table = init_generic_na_table(na_section, na_section.loadaddress)
+        section_start = len(eu_addresses)
+        for eu_table_offset in eu_table:
+            symbol_name = eu_table[eu_table_offset]
+            if symbol_name in na_table:  # Symbols that are unknown in NA can't be used for mapping
+                eu_addresses.append(eu_table_offset)
+                na_addresses.append(na_table[symbol_name])
+                symbol_names.append(symbol_name)
+        section_bounds.append((section_start, len(eu_addresses)))
+        section_ranges.append((eu_section.loadaddress, eu_section.loadaddress + eu_section.length + 1))
+    boundaries = sorted(set(boundary for section_range in section_ranges for boundary in section_range))
+    segment_starts = array("I")
+    segment_sections = array("i")
+    for boundary in boundaries:
+        owner = -1
+        for section in range(len(section_ranges)):
+            if section_ranges[section][0] <= boundary < section_ranges[section][1]:
+                owner = section
+                break
+        if len(segment_sections) == 0 or segment_sections[-1] != owner:
+            segment_starts.append(boundary)
+            segment_sections.append(owner)
+    return {
+        "section_names": section_names,
+        "section_bounds": section_bounds,
+        "segment_starts": segment_starts,
+        "segment_sections": segment_sections,
+        "eu_addresses": eu_addresses,
+        "na_addresses": na_addresses,
+        "symbol_names": symbol_names,
+    }
+
+
 def init_generic_eu_table(section, section_start) -> dict[int, str]:
     """Compile a sorted dictionary of offset:symbolname for a section (overlay)."""
+    from pmdsky_debug_py.protocol import Symbol
+
     symbol_dict = dict(section.functions.__dict__)
     symbol_dict.update(section.data.__dict__)
     symbol_table = {section_start: "SECTION_START"}
@@ -142,6 +278,8 @@ def init_generic_eu_table(section, section_start) -> dict[int, str]:
 
 def init_generic_na_table(section, section_start) -> dict[str, int]:
     """Compile a dictionary of symbolname:offset for a section (overlay)."""
+    from pmdsky_debug_py.protocol import Symbol
+
     symbol_dict = dict(section.functions.__dict__)
     symbol_dict.update(section.data.__dict__)
     symbol_table = {"SECTION_START": section_start}
@@ -4,27 +4,36 @@
 #  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
-from hashlib import file_digest
-from os.path import join
+from os import stat
+from os.path import join, abspath
+from .cache import project_cache_dir, read_json, write_json
 
+VANILLA_EU_SHA256 = "1fa39d35873b58e02f3623438414c334ad93b840651a8a9ac13ee3c789f170c1"
+VANILLA_NA_SHA256 = "91161cb227c44a3e79fa2a622060385815f565647357062d7887f13f49d591e2"
+HASH_CACHE_FILE = "hashes.json"
 
-def sha256_file(file_path: str) -> str:
-    with open(file_path, "rb") as f:
-        digest = file_digest(f, "sha256")
-    return digest.hexdigest()
 
+def file_identity(file_path: str) -> list:
+    """Returns [size, mtime, inode] for a file. If any of these change, the file has to be hashed again."""
+    file_stat = stat(file_path)
+    return [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino]
 
-def verify_vanilla_eu(config) -> bool:
-    """Checks if a given file is a vanilla NA EoS ROM."""
-    return (
-        sha256_file(join(config["Root"], config["Roms"]["Vanilla EU"]))
-        == "1fa39d35873b58e02f3623438414c334ad93b840651a8a9ac13ee3c789f170c1"
-    )
 
+def load_hash_cache(config) -> dict:
+    return read_json(join(project_cache_dir(config), HASH_CACHE_FILE))
 
-def verify_vanilla_na(config) -> bool:
-    """Checks if a given file is a vanilla EU EoS ROM."""
-    return (
-        sha256_file(join(config["Root"], config["Roms"]["Vanilla NA"]))
-        == "91161cb227c44a3e79fa2a622060385815f565647357062d7887f13f49d591e2"
-    )
+
+def save_hash_cache(config, hash_cache: dict):
+    write_json(join(project_cache_dir(config), HASH_CACHE_FILE), hash_cache)
+
+
+def get_cached_sha256(hash_cache: dict, file_path: str, identity: list) -> str | None:
+    """Returns the cached digest of a file, or None if it was never hashed or has changed since."""
+    entry = hash_cache.get(abspath(file_path))
+    if entry is not None and entry["identity"] == identity:
+        return entry["sha256"]
+    return None
+
+
+def set_cached_sha256(hash_cache: dict, file_path: str, identity: list, digest: str):
+    hash_cache.update({abspath(file_path): {"identity": identity, "sha256": digest}})
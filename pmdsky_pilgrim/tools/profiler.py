@@ -0,0 +1,170 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import tracemalloc
+from contextlib import contextmanager
+from json import dump
+from os import getpid
+from threading import local, get_ident, main_thread
+from time import perf_counter_ns, process_time_ns, thread_time_ns
+
+# Records spans (a stage, a patch being applied, an SP being converted...) for --profile. Disabled by default, in which case span() does nothing.
+# Only imports the standard library, so it can be used anywhere without slowing down startup.
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "start", "wall", "cpu", "thread_cpu", "peak_memory", "pid", "tid", "depth")
+
+    def __init__(self, name: str, category: str, args: dict, depth: int):
+        self.name = name
+        self.category = category  # "stage" for whole stages, or what kind of sub-item this is, like "patch" or "sp"
+        self.args = args  # Extra details for the trace
+        self.start = perf_counter_ns()
+        self.wall = 0  # ns
+        self.cpu = 0  # ns of CPU time. On a main thread, used by the whole process, including other threads.
+        self.thread_cpu = False  # Whether cpu only counts this span's own thread, because it ran off the main thread
+        self.peak_memory = None  # Peak bytes allocated by Python while the span ran. Only tracked on the main thread.
+        self.pid = getpid()
+        self.tid = get_ident()
+        self.depth = depth
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.spans = []  # Finished spans
+        self.stacks = local()  # Open spans of the current thread
+
+    def start(self):
+        self.enabled = True
+        self.spans = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stack(self) -> list:
+        if not hasattr(self.stacks, "spans"):
+            self.stacks.spans = []
+        return self.stacks.spans
+
+    @contextmanager
+    def span(self, name: str, category: str = "stage", **args):
+        if not self.enabled:
+            yield
+            return
+        stack = self.stack()
+        current = Span(name, category, args, len(stack))
+        track_memory = get_ident() == main_thread().ident and tracemalloc.is_tracing()
+        if track_memory:
+            # tracemalloc only has one peak, so the open span's peak so far is saved before resetting it for this one.
+            if len(stack) > 0:
+                parent = stack[-1]
+                parent.peak_memory = max(parent.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            current.peak_memory = 0
+        stack.append(current)
+        # process_time_ns would count every thread, so spans running side by side on other threads only count their own.
+        current.thread_cpu = get_ident() != main_thread().ident
+        cpu_time = thread_time_ns if current.thread_cpu else process_time_ns
+        cpu_start = cpu_time()
+        try:
+            yield
+        finally:
+            current.cpu = cpu_time() - cpu_start
+            current.wall = perf_counter_ns() - current.start
+            stack.pop()
+            if track_memory:
+                current.peak_memory = max(current.peak_memory, tracemalloc.get_traced_memory()[1])
+                if len(stack) > 0:
+                    stack[-1].peak_memory = max(stack[-1].peak_memory or 0, current.peak_memory)
+            self.spans.append(current)
+
+    def take_spans(self) -> list[Span]:
+        spans = self.spans
+        self.spans = []
+        return spans
+
+    def add_spans(self, spans: list[Span]):
+        """Adds spans recorded in another process, see run_profiled."""
+        self.spans += spans
+
+    def print_summary(self):
+        """Prints every stage, then every kind of sub-item in total, with its slowest item.
+        A kind's CPU time isn't totalled if a main thread's span could have counted the CPU time of other threads' spans in the same process again."""
+        print(f"{'Span':<40} {'Count':>6} {'Wall (s)':>10} {'CPU (s)':>10} {'Peak mem (MB)':>14}  Slowest")
+        for span in sorted(self.spans, key=lambda span: span.start):
+            if span.category == "stage":
+                print(
+                    f"{'  ' * span.depth + span.name:<40} {1:>6} {span.wall / 1e9:>10.3f} {span.cpu / 1e9:>10.3f} {format_memory(span.peak_memory):>14}"
+                )
+        groups = {}
+        for span in self.spans:
+            if span.category != "stage":
+                groups.setdefault(span.category, []).append(span)
+        for category, spans in groups.items():
+            slowest = max(spans, key=lambda span: span.wall)
+            peak = max((span.peak_memory for span in spans if span.peak_memory is not None), default=None)
+            # Each process only counts its own CPU time, so only threads within the same process can overlap.
+            threads = {}
+            for span in spans:
+                threads.setdefault(span.pid, set()).add(span.tid)
+            if all(span.thread_cpu or len(threads[span.pid]) == 1 for span in spans):
+                cpu = f"{sum(span.cpu for span in spans) / 1e9:>10.3f}"
+            else:
+                cpu = f"{'-':>10}"
+            print(
+                f"{category:<40} {len(spans):>6} {sum(span.wall for span in spans) / 1e9:>10.3f} {cpu} {format_memory(peak):>14}  {slowest.name} ({slowest.wall / 1e9:.3f}s)"
+            )
+
+    def write_trace(self, path: str):
+        """Writes the spans in Chrome's trace event format, which chrome://tracing and Perfetto can open."""
+        events = []
+        for span in self.spans:
+            args = dict(span.args)
+            args.update({"cpu_ms": span.cpu / 1e6, "cpu_scope": "thread" if span.thread_cpu else "process"})
+            if span.peak_memory is not None:
+                args.update({"peak_memory_bytes": span.peak_memory})
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": span.start / 1000,
+                    "dur": span.wall / 1000,
+                    "pid": span.pid,
+                    "tid": span.tid,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as f:
+            dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def format_memory(peak_memory: int | None) -> str:
+    return "-" if peak_memory is None else f"{peak_memory / 0x100000:.1f}"
+
+
+profiler = Profiler()
+span = profiler.span
+
+
+def run_profiled(enabled: bool, function, *args):
+    """Runs function(*args) in a worker process, recording spans there if enabled. Returns (result, spans) so the caller can add them to its own profiler."""
+    if enabled:
+        profiler.start()
+    else:
+        profiler.stop()
+        profiler.take_spans()  # Forked workers start with a copy of the parent's spans
+    try:
+        result = function(*args)
+    finally:
+        spans = profiler.take_spans()
+        profiler.stop()
+    return result, spans
@@ -0,0 +1,138 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from ndspy.rom import NintendoDSRom
+from ndspy.fnt import save as save_fnt, load as load_fnt
+
+# ROM attributes holding code that patches may replace. Overlays themselves are regular files.
+CODE_ATTRIBUTES = ["arm9", "arm7", "arm9OverlayTable", "arm7OverlayTable", "arm9PostData"]
+
+
+class RomChanges:
+    """Everything that changed in a ROM between a RomSnapshot and a later state. Small and picklable, so it can be sent between processes or cached instead of the whole ROM."""
+
+    def __init__(self):
+        self.files = {}  # file ID: new data
+        self.file_count = None  # Only set if files were added or removed
+        self.filenames = None  # Saved FNT, only set if it changed
+        self.code = {}  # attribute from CODE_ATTRIBUTES: new data
+
+    def __len__(self) -> int:
+        return len(self.files) + len(self.code) + (self.filenames is not None)
+
+    def __str__(self) -> str:
+        changed = [f"{len(self.files)} file(s)"]
+        changed += self.code.keys()
+        if self.filenames is not None:
+            changed.append("filenames")
+        return ", ".join(changed)
+
+    def apply_to(self, rom: NintendoDSRom):
+        """Makes the same changes to another copy of the ROM the snapshot was taken from."""
+        if self.file_count is not None:
+            del rom.files[self.file_count :]
+            rom.files += [b""] * (self.file_count - len(rom.files))
+        for file_id, data in self.files.items():
+            rom.files[file_id] = data
+        for attribute, data in self.code.items():
+            setattr(rom, attribute, data)
+        if self.filenames is not None:
+            rom.filenames = load_fnt(self.filenames)
+
+
+class RomSnapshot:
+    """The state of a ROM at one point in time. File contents aren't copied: ndspy stores them as immutable bytes, so keeping references is enough to spot replaced files later."""
+
+    def __init__(self, rom: NintendoDSRom):
+        self.files = list(rom.files)
+        self.code = {attribute: getattr(rom, attribute) for attribute in CODE_ATTRIBUTES}
+        self.filenames = save_fnt(rom.filenames)
+
+    def changes(self, rom: NintendoDSRom) -> RomChanges:
+        """Returns the changes made to the ROM since this snapshot was taken."""
+        changes = RomChanges()
+        if len(rom.files) != len(self.files):
+            changes.file_count = len(rom.files)
+        for file_id, data in enumerate(rom.files):
+            if file_id >= len(self.files) or (data is not self.files[file_id] and data != self.files[file_id]):
+                changes.files[file_id] = data
+        for attribute in CODE_ATTRIBUTES:
+            data = getattr(rom, attribute)
+            if data is not self.code[attribute] and data != self.code[attribute]:
+                changes.code[attribute] = data
+        filenames = save_fnt(rom.filenames)
+        if filenames != self.filenames:
+            changes.filenames = filenames
+        return changes
+
+
+class RomDelta:
+    """RomChanges reduced to the byte ranges that actually changed, for files and binaries that kept their size. Replaying it is a handful of memory copies."""
+
+    def __init__(self, changes: RomChanges, snapshot: RomSnapshot):
+        self.file_count = changes.file_count
+        self.filenames = changes.filenames
+        # file ID or attribute: either the new data, or a list of (offset, new bytes) if the size didn't change
+        self.files = {}
+        self.code = {}
+        for file_id, data in changes.files.items():
+            old_data = snapshot.files[file_id] if file_id < len(snapshot.files) else None
+            self.files[file_id] = delta_of(old_data, data)
+        for attribute, data in changes.code.items():
+            self.code[attribute] = delta_of(snapshot.code[attribute], data)
+
+    def __len__(self) -> int:
+        return len(self.files) + len(self.code) + (self.filenames is not None)
+
+    def apply_to(self, rom: NintendoDSRom):
+        """Replays the delta on a ROM in the same state as the snapshot it was made from."""
+        if self.file_count is not None:
+            del rom.files[self.file_count :]
+            rom.files += [b""] * (self.file_count - len(rom.files))
+        for file_id, delta in self.files.items():
+            rom.files[file_id] = apply_delta(rom.files[file_id], delta)
+        for attribute, delta in self.code.items():
+            setattr(rom, attribute, apply_delta(getattr(rom, attribute), delta))
+        if self.filenames is not None:
+            rom.filenames = load_fnt(self.filenames)
+
+
+DELTA_BLOCK_SIZE = 0x1000
+
+
+def delta_of(old_data: bytes | None, new_data: bytes) -> bytes | list[tuple[int, bytes]]:
+    if old_data is None or len(old_data) != len(new_data):
+        return new_data
+    return changed_ranges(old_data, new_data)
+
+
+def changed_ranges(old_data: bytes, new_data: bytes) -> list[tuple[int, bytes]]:
+    """Finds where two equally long binaries differ. Blocks are compared first (which is done in C), then each run of changed blocks is trimmed down to the bytes that changed."""
+    ranges = []
+    start = None
+    for block in range(0, len(new_data) + DELTA_BLOCK_SIZE, DELTA_BLOCK_SIZE):
+        block_end = block + DELTA_BLOCK_SIZE
+        if block < len(new_data) and old_data[block:block_end] != new_data[block:block_end]:
+            if start is None:
+                start = block
+        elif start is not None:
+            end = min(block, len(new_data))
+            while old_data[start] == new_data[start]:
+                start += 1
+            while old_data[end - 1] == new_data[end - 1]:
+                end -= 1
+            ranges.append((start, new_data[start:end]))
+            start = None
+    return ranges
+
+
+def apply_delta(old_data: bytes, delta: bytes | list[tuple[int, bytes]]) -> bytes:
+    if type(delta) is not list:
+        return delta
+    data = bytearray(old_data)
+    for offset, new_bytes in delta:
+        data[offset : offset + len(new_bytes)] = new_bytes
+    return bytes(data)
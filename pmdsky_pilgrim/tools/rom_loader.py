@@ -0,0 +1,117 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from os import path
+from copy import copy
+from hashlib import sha256
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from ndspy.rom import NintendoDSRom
+from ndspy.fnt import save as save_fnt, load as load_fnt
+from .hash_validation import file_identity, load_hash_cache, save_hash_cache, get_cached_sha256, set_cached_sha256
+
+INGESTED_ROMS = ["Vanilla EU", "Vanilla NA", "Mod EU"]
+
+
+def get_rom_path(config, key: str) -> str:
+    if key not in config["Roms"]:
+        print(f"{key} not present in config!")
+        exit(1)
+    return path.join(config["Root"], config["Roms"][key])
+
+
+class LoadedRom:
+    def __init__(self, key: str, rom_path: str):
+        self.key = key  # The key of this ROM in config, e.g. "Vanilla EU".
+        self.path = rom_path
+        self.rom = None
+        self.sha256 = None
+        self.identity = None  # [size, mtime, inode] of the file when it was read.
+        self.hash_cached = False  # Was the digest taken from the hash cache instead of being computed?
+        self.read_time = 0.0
+        self.hash_time = 0.0
+        self.parse_time = 0.0
+        self.shared = False  # Was this copied from a ROM that was already loaded, e.g. by pilgrim batch or --watch?
+
+    def __str__(self) -> str:
+        if self.shared:
+            return f"{self.key}: already loaded"
+        hash_info = "cached" if self.hash_cached else f"{self.hash_time:.2f}s"
+        return f"{self.key}: read {self.read_time:.2f}s, hash {hash_info}, parse {self.parse_time:.2f}s"
+
+    def copy_as(self, key: str) -> "LoadedRom":
+        """Returns a LoadedRom for the same file under another key, whose ROM can be modified without affecting this one."""
+        loaded = copy(self)
+        loaded.key = key
+        loaded.rom = copy_rom(self.rom)
+        loaded.shared = True
+        loaded.read_time = loaded.hash_time = loaded.parse_time = 0.0
+        return loaded
+
+
+def ingest_rom(loaded: LoadedRom, hash_cache: dict, rehash: bool) -> LoadedRom:
+    """Reads a ROM file once, hashes the bytes in memory (unless the hash cache already knows them), and parses it."""
+    start = perf_counter()
+    loaded.identity = file_identity(loaded.path)
+    with open(loaded.path, "rb") as f:
+        data = f.read()
+    loaded.read_time = perf_counter() - start
+    if not rehash:
+        loaded.sha256 = get_cached_sha256(hash_cache, loaded.path, loaded.identity)
+    if loaded.sha256 is None:
+        start = perf_counter()
+        loaded.sha256 = sha256(data).hexdigest()  # hashlib releases the GIL, so this overlaps with the other ROMs
+        loaded.hash_time = perf_counter() - start
+    else:
+        loaded.hash_cached = True
+    start = perf_counter()
+    loaded.rom = NintendoDSRom(data)
+    loaded.parse_time = perf_counter() - start
+    return loaded
+
+
+def copy_rom(rom: NintendoDSRom) -> NintendoDSRom:
+    """Copies a ROM cheaply. Files and code are immutable bytes, so only the containers holding them need to be copied."""
+    rom_copy = copy(rom)
+    rom_copy.files = list(rom.files)
+    rom_copy.filenames = load_fnt(save_fnt(rom.filenames))
+    rom_copy.arm9PostData = bytes(rom.arm9PostData)  # ndspy loads this as a bytearray
+    return rom_copy
+
+
+def ingest_roms(config, rehash: bool = False, shared: dict[str, LoadedRom] | None = None) -> dict[str, LoadedRom]:
+    """Loads and hashes all of the project's input ROMs in parallel. Returns a dict of config key: LoadedRom.
+    shared maps absolute paths to ROMs that are already loaded. ROMs at those paths are copied instead of being read again, as long as the files haven't changed since.
+    """
+    if shared is None:
+        shared = {}
+    loaded_roms = {}
+    to_load = []
+    for key in INGESTED_ROMS:
+        rom_path = get_rom_path(config, key)
+        shared_rom = shared.get(path.abspath(rom_path))
+        if shared_rom is not None and path.exists(rom_path) and file_identity(rom_path) == shared_rom.identity:
+            loaded_roms[key] = shared_rom.copy_as(key)
+        else:
+            to_load.append(LoadedRom(key, rom_path))
+    hash_cache = load_hash_cache(config)
+    with ThreadPoolExecutor(max_workers=max(len(to_load), 1)) as executor:
+        futures = [executor.submit(ingest_rom, loaded, hash_cache, rehash) for loaded in to_load]
+    missing = False
+    for loaded, future in zip(to_load, futures):
+        try:
+            future.result()
+        except FileNotFoundError:
+            print(f"ROM for {loaded.key} could not be found at {loaded.path}. Make sure it exists.")
+            missing = True
+    if missing:
+        exit(1)
+    for loaded in to_load:
+        if not loaded.hash_cached:
+            set_cached_sha256(hash_cache, loaded.path, loaded.identity, loaded.sha256)
+    save_hash_cache(config, hash_cache)
+    loaded_roms.update({loaded.key: loaded for loaded in to_load})
+    return {key: loaded_roms[key] for key in INGESTED_ROMS}
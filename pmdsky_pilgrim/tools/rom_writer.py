@@ -0,0 +1,185 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import struct
+from os.path import getsize
+from shutil import copyfile
+from ndspy.rom import NintendoDSRom
+from .rom_changes import RomChanges, RomSnapshot
+
+# Writes a modified ROM by copying the ROM it was loaded from and overwriting only what changed, instead of serializing
+# the whole image again like NintendoDSRom.save() does. Files that still fit in their old space are written in place,
+# anything that grew is moved to the end of the ROM. arm9 is the exception: it has to stay at its offset (right after
+# the secure area, where loaders expect it), so if it grows, the ROM is saved with NintendoDSRom.save() instead.
+
+HEADER_SIZE = 0x200
+FILE_ALIGNMENT = 0x200
+RSA_SIGNATURE_ALIGNMENT = 0x20
+RSA_SIGNATURE_POINTER = 0x1000  # Where ndspy stores the offset of the RSA signature
+FAT_ENTRY_SIZE = 8
+# Header fields: (offset field, size field)
+ARM9_FIELDS = (0x20, 0x2C)
+ARM7_FIELDS = (0x30, 0x3C)
+FNT_FIELDS = (0x40, 0x44)
+FAT_FIELDS = (0x48, 0x4C)
+ARM9_OVERLAY_TABLE_FIELDS = (0x50, 0x54)
+ARM7_OVERLAY_TABLE_FIELDS = (0x58, 0x5C)
+DEVICE_CAPACITY_OFFSET = 0x14
+ROM_SIZE_OFFSET = 0x80  # Total used ROM size, which is also where the RSA signature starts
+HEADER_CHECKSUM_OFFSET = 0x15E
+
+
+class RomWriter:
+    """Writes changes to a copy of a ROM file on disk, keeping track of where free space at the end of the ROM starts."""
+
+    def __init__(self, f, snapshot: RomSnapshot, changes: RomChanges):
+        self.f = f
+        self.snapshot = snapshot
+        self.changes = changes
+        self.written_ranges = []  # (offset, size) of everything written, so patches only need to look there
+        self.old_ranges = []  # (offset, size) of data that was replaced or moved, which patches can copy from
+        self.header = bytearray(self.read(0, HEADER_SIZE))
+        self.rom_size = self.header_field(ROM_SIZE_OFFSET)
+        self.rsa_signature_offset = self.find_rsa_signature()
+        self.rsa_signature = self.read(self.rsa_signature_offset, 0x88)
+        # New data goes after the signature until the end is known, then the signature is moved after it.
+        self.end = align(self.rom_size + len(self.rsa_signature), FILE_ALIGNMENT)
+        self.grew = False
+
+    def read(self, offset: int, size: int) -> bytes:
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def write(self, offset: int, data: bytes):
+        self.f.seek(offset)
+        self.f.write(data)
+        self.written_ranges.append((offset, len(data)))
+
+    def header_field(self, offset: int) -> int:
+        return struct.unpack_from("<I", self.header, offset)[0]
+
+    def set_header_field(self, offset: int, value: int):
+        struct.pack_into("<I", self.header, offset, value)
+
+    def find_rsa_signature(self) -> int:
+        # Same lookup as NintendoDSRom
+        signature_offset = struct.unpack("<I", self.read(RSA_SIGNATURE_POINTER, 4))[0]
+        if not signature_offset:
+            signature_offset = self.rom_size
+        return signature_offset
+
+    def place(self, data: bytes, old_offset: int, old_size: int) -> int:
+        """Writes data where old data of old_size was if it fits, or at the end of the ROM otherwise. Returns where it was written."""
+        self.old_ranges.append((old_offset, old_size))
+        if len(data) <= old_size:
+            # Padding the rest of the old space keeps stale data from being read back, e.g. as arm9 post data.
+            self.write(old_offset, data.ljust(old_size, b"\xff"))
+            return old_offset
+        offset = self.end
+        self.write(offset, data)
+        self.end = align(offset + len(data), FILE_ALIGNMENT)
+        self.grew = True
+        return offset
+
+    def place_section(self, data: bytes, fields: tuple[int, int], old_size: int | None = None):
+        """Writes a section that the header points to, and updates the header to match."""
+        offset_field, size_field = fields
+        if old_size is None:
+            old_size = self.header_field(size_field)
+        offset = self.place(data, self.header_field(offset_field), old_size)
+        self.set_header_field(offset_field, offset)
+        self.set_header_field(size_field, len(data))
+
+    def write_files(self, rom: NintendoDSRom, changes: RomChanges):
+        fat_offset, fat_size = self.header_field(FAT_FIELDS[0]), self.header_field(FAT_FIELDS[1])
+        fat = bytearray(self.read(fat_offset, fat_size))
+        if changes.file_count is not None:
+            fat = fat[: changes.file_count * FAT_ENTRY_SIZE].ljust(changes.file_count * FAT_ENTRY_SIZE, b"\0")
+        for file_id in sorted(changes.files):
+            data = rom.files[file_id]
+            start, end = struct.unpack_from("<II", fat, file_id * FAT_ENTRY_SIZE)
+            # Added files don't have any space yet
+            old_size = end - start if file_id < len(self.snapshot.files) else 0
+            start = self.place(data, start, old_size)
+            struct.pack_into("<II", fat, file_id * FAT_ENTRY_SIZE, start, start + len(data))
+        self.place_section(bytes(fat), FAT_FIELDS, fat_size)
+
+    def write_code(self, rom: NintendoDSRom, changes: RomChanges):
+        if "arm9" in changes.code or "arm9PostData" in changes.code:
+            # The post data follows arm9 directly, so they're written together. write_rom made sure they still fit.
+            old_size = len(self.snapshot.code["arm9"]) + len(self.snapshot.code["arm9PostData"])
+            self.place(rom.arm9 + rom.arm9PostData, self.header_field(ARM9_FIELDS[0]), old_size)
+            self.set_header_field(ARM9_FIELDS[1], len(rom.arm9))
+        if "arm7" in changes.code:
+            self.place_section(rom.arm7, ARM7_FIELDS)
+        if "arm9OverlayTable" in changes.code:
+            self.place_section(rom.arm9OverlayTable, ARM9_OVERLAY_TABLE_FIELDS)
+        if "arm7OverlayTable" in changes.code:
+            self.place_section(rom.arm7OverlayTable, ARM7_OVERLAY_TABLE_FIELDS)
+
+    def finish(self):
+        """Moves the RSA signature after anything added to the end, then writes the header."""
+        if self.grew:
+            self.old_ranges.append((self.rsa_signature_offset, len(self.rsa_signature)))
+            self.rom_size = align(self.end, RSA_SIGNATURE_ALIGNMENT)
+            self.write(self.rom_size, self.rsa_signature)
+            self.write(RSA_SIGNATURE_POINTER, struct.pack("<I", self.rom_size))
+            self.set_header_field(ROM_SIZE_OFFSET, self.rom_size)
+            # Same capacity calculation as NintendoDSRom.save()
+            while (0x20000 << self.header[DEVICE_CAPACITY_OFFSET]) < self.rom_size:
+                self.header[DEVICE_CAPACITY_OFFSET] += 1
+        struct.pack_into("<H", self.header, HEADER_CHECKSUM_OFFSET, crc16(self.header[:HEADER_CHECKSUM_OFFSET]))
+        self.write(0, self.header)
+
+
+def write_rom(rom: NintendoDSRom, snapshot: RomSnapshot, base_path: str, output_path: str) -> RomWriter:
+    """Saves rom to output_path. base_path must be the file rom was loaded from, and snapshot must have been taken right after loading it.
+    Everything unchanged since the snapshot is copied from base_path as is. Returns the writer, which knows what was changed and where it was written.
+    """
+    changes = snapshot.changes(rom)
+    if arm9_grew(rom, snapshot, changes):
+        # Making room after arm9 would mean moving everything that follows it, which is what save() does anyway.
+        rom.saveToFile(output_path)
+        with open(output_path, "rb") as f:
+            writer = RomWriter(f, snapshot, changes)
+        # Anything may have moved, so the whole ROM counts as changed.
+        writer.written_ranges.append((0, getsize(output_path)))
+        writer.old_ranges.append((0, getsize(base_path)))
+        return writer
+    copyfile(base_path, output_path)
+    with open(output_path, "r+b") as f:
+        writer = RomWriter(f, snapshot, changes)
+        if len(changes) == 0 and changes.file_count is None:
+            return writer
+        writer.write_code(rom, changes)
+        if changes.filenames is not None:
+            writer.place_section(changes.filenames, FNT_FIELDS)
+        if len(changes.files) > 0 or changes.file_count is not None:
+            writer.write_files(rom, changes)
+        writer.finish()
+    return writer
+
+
+def arm9_grew(rom: NintendoDSRom, snapshot: RomSnapshot, changes: RomChanges) -> bool:
+    """Whether arm9 and its post data no longer fit in the space they had."""
+    if "arm9" not in changes.code and "arm9PostData" not in changes.code:
+        return False
+    old_size = len(snapshot.code["arm9"]) + len(snapshot.code["arm9PostData"])
+    return len(rom.arm9) + len(rom.arm9PostData) > old_size
+
+
+def align(offset: int, alignment: int) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def crc16(data: bytes) -> int:
+    """The CRC-16 used by the DS header (CRC-16/MODBUS)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
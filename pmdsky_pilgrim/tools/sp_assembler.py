@@ -0,0 +1,94 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+import re
+import subprocess
+import sys
+from os import getenv
+from os.path import join, exists
+from shutil import copytree
+from tempfile import TemporaryDirectory
+from skytemple_files.common.util import get_resources_dir, set_rw_permission_folder
+from .profiler import span
+
+# Assembles every SP in one armips run, instead of one run (and one temporary folder) per SP like DataCD.import_armips_effect_code does.
+# Each SP gets its own source file, included from a main file, and .creates its own output file.
+
+BATCH_ENTRYPOINT = "__main.asm"
+SP_SOURCE_FILE = "sp_{}.asm"
+SP_OUTPUT_FILE = "sp_{}.bin"
+# armips reports errors as "file(line) error: message"
+SP_SOURCE_PATTERN = re.compile(r"sp_(\d+)\.asm")
+
+
+class SPAssemblyError(Exception):
+    def __init__(self, message, output: str, failed_ids: list[int]):
+        super().__init__(message)
+        self.message = message
+        self.output = output  # Everything armips printed
+        self.failed_ids = failed_ids  # SPs that armips reported errors in
+
+    def __str__(self):
+        return self.message
+
+    def output_for(self, id: int) -> str:
+        """Returns the lines of armips' output about a specific SP."""
+        return "\n".join(line for line in self.output.splitlines() if SP_SOURCE_FILE.format(id) in line)
+
+
+def sp_output_file(id: int) -> str:
+    """Where an SP's source should .create its output in a batch, relative to the batch folder."""
+    return f"./{SP_OUTPUT_FILE.format(id)}"
+
+
+def armips_executable() -> str:
+    """Finds armips the same way SkyTemple does."""
+    prefix = ""
+    # Under Windows, SkyTemple bundles armips in its resources folder.
+    if sys.platform.startswith("win") and exists(join(get_resources_dir(), "armips.exe")):
+        prefix = join(get_resources_dir(), "")
+    return getenv("SKYTEMPLE_ARMIPS_EXEC", f"{prefix}armips")
+
+
+def assemble_sps(sources: dict[int, str]) -> dict[int, bytes]:
+    """Assembles the sources of many SPs with a single armips run. Each source must .create sp_output_file(id). Returns {id: assembled code}.
+    Raises SPAssemblyError if armips fails, naming the SPs the errors came from."""
+    with TemporaryDirectory() as tmp:
+        # Same environment ArmipsImporter gives a single SP
+        copytree(
+            join(get_resources_dir(), "patches", "asm_patches", "eos_move_effects"),
+            tmp,
+            dirs_exist_ok=True,
+            symlinks=True,
+        )
+        # The resources may be read-only (e.g. a system-wide install), and copytree copies that onto tmp.
+        set_rw_permission_folder(tmp)
+        main_source = []
+        for id, source in sources.items():
+            with open(join(tmp, SP_SOURCE_FILE.format(id)), "w", encoding="utf-8") as f:
+                f.write(source)
+            main_source.append(f'.include "{SP_SOURCE_FILE.format(id)}"\n')
+        with open(join(tmp, BATCH_ENTRYPOINT), "w", encoding="utf-8") as f:
+            f.write("".join(main_source))
+        try:
+            with span(f"armips ({len(sources)} SPs)", "armips"):
+                result = subprocess.run(
+                    [armips_executable(), BATCH_ENTRYPOINT], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=tmp
+                )
+        except FileNotFoundError:
+            raise FileNotFoundError("armips could not be found. Make sure that 'armips' is inside your system's PATH.")
+        output = str(result.stdout, "utf-8", errors="replace")
+        if result.returncode != 0:
+            failed_ids = sorted(set(int(id) for id in SP_SOURCE_PATTERN.findall(output) if int(id) in sources))
+            raise SPAssemblyError("armips reported an error while assembling SPs.", output, failed_ids)
+        assembled = {}
+        for id in sources:
+            output_path = join(tmp, SP_OUTPUT_FILE.format(id))
+            if not exists(output_path):
+                raise SPAssemblyError(f"The source of SP {id} did not create an output file.", output, [id])
+            with open(output_path, "rb") as f:
+                assembled[id] = f.read()
+        return assembled
@@ -0,0 +1,73 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from hashlib import blake2b, sha256
+from json import dumps
+from os import replace, getpid
+from os.path import join
+from .cache import project_cache_dir, read_json, write_json
+from .vanilla_cache import dependency_version
+
+SP_CACHE_FOLDER = "sps"
+SP_OFFSETS_FILE = "offsets.json"
+SP_BINARY_FOLDER = "binaries"
+# Bump this whenever a change to SPConverter changes what an SP disassembles or assembles to.
+SP_CONVERTER_VERSION = 2
+
+
+def sp_code_hash(code: bytes) -> str:
+    return blake2b(code, digest_size=16).hexdigest()
+
+
+class SPCache:
+    """Remembers converted SPs by their contents, in two levels:
+    - The hash of an SP's EU code gives the offsets it references, so unchanged SPs don't need to be disassembled to build the offset map.
+    - That hash plus what those offsets map to gives the assembled NA code, so unchanged SPs don't need to be assembled again either."""
+
+    def __init__(self, config):
+        self.cache_dir = project_cache_dir(config, SP_CACHE_FOLDER)
+        self.binary_dir = project_cache_dir(config, SP_CACHE_FOLDER, SP_BINARY_FOLDER)
+        self.offsets_path = join(self.cache_dir, SP_OFFSETS_FILE)
+        # Disassembly only depends on the code and on Capstone.
+        self.offsets_version = f"{SP_CONVERTER_VERSION}:{dependency_version('capstone')}"
+        self.offsets = read_json(self.offsets_path)
+        if self.offsets.get("version") != self.offsets_version:
+            self.offsets = {"version": self.offsets_version, "sps": {}}
+        self.offsets_changed = False
+
+    def get_offsets(self, code_hash: str) -> dict[str, str] | None:
+        """Returns {offset: overlay name} for every convertible offset in an SP, or None if it isn't cached."""
+        return self.offsets["sps"].get(code_hash)
+
+    def set_offsets(self, code_hash: str, offsets: dict[str, str]):
+        self.offsets["sps"].update({code_hash: offsets})
+        self.offsets_changed = True
+
+    def save_offsets(self):
+        if self.offsets_changed:
+            write_json(self.offsets_path, self.offsets)
+            self.offsets_changed = False
+
+    def binary_key(self, code_hash: str, offset_maps: dict[str, str]) -> str:
+        """Identifies the converted code of an SP. offset_maps must only contain the offsets the SP references, so changes to unrelated offsets don't invalidate it."""
+        key_source = dumps(
+            [self.offsets_version, dependency_version("skytemple-files"), code_hash, offset_maps], sort_keys=True
+        )
+        return sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get_binary(self, key: str) -> bytes | None:
+        try:
+            with open(join(self.binary_dir, f"{key}.bin"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set_binary(self, key: str, code: bytes):
+        path = join(self.binary_dir, f"{key}.bin")
+        tmp_path = f"{path}.{getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(code)
+        replace(tmp_path, path)
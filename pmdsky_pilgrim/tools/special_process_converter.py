@@ -4,11 +4,17 @@
 #  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
 #  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
 
-from .find_offset import OffsetMapper, UnmappableOffsetException, AddressOverlay, overlay_of_offset
+from .find_offset import OffsetMapper, AddressOverlay, overlay_of_offset
 from capstone import Cs, CS_ARCH_ARM, CS_MODE_ARM
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
 from skytemple_files.data.data_cd.model import DataCD
+from skytemple_files.data.data_cd.handler import DataCDHandler
 from ndspy.rom import NintendoDSRom
 from .colors import CLEAR_TEXT, BLUE_TEXT, RED_TEXT
+from .sp_assembler import assemble_sps, sp_output_file, SPAssemblyError
+from .sp_cache import SPCache, sp_code_hash
+from .profiler import span
 # from offsets.asm_reader import FindTargetAddressStatus, Region, XmapReader, print_addresses
 
 # TODO: All of this code is atrocious, rewrite it eventually. Surely there are better ways to keep track of information relevant to an SP than five billion different dictionaries. Probably use a dataclass...?
@@ -16,83 +22,245 @@ from .colors import CLEAR_TEXT, BLUE_TEXT, RED_TEXT
 PROC_START_ADDRESS_EU = 0x22E7B88
 PROC_START_ADDRESS_EU_STR = hex(PROC_START_ADDRESS_EU)
 PROCESS_BIN_PATH = "BALANCE/process.bin"
+SP_OUTPUT_FILE = "./code_out.bin"  # What DataCD.import_armips_effect_code expects
 
 FIRST_CUSTOM_SP_ID = 61
+# Below this many SPs to disassemble, starting worker processes takes longer than the disassembly itself.
+PARALLEL_DISASSEMBLY_MIN_SPS = 16
+PARALLEL_DISASSEMBLY_CHUNK_SIZE = 8
+
+worker_capstone = None  # Capstone handle of a disassembly worker process
+
+
+class SPInstruction:
+    """One line of a disassembled SP: either an instruction, or a data word from a literal pool."""
+
+    __slots__ = ("address", "mnemonic", "op_str", "offset")
+
+    def __init__(self, address: int, mnemonic: str, op_str: str, offset: str | None = None):
+        self.address = address
+        self.mnemonic = mnemonic
+        self.op_str = op_str
+        self.offset = offset  # Convertible offset referenced by this line, as written in op_str, if any
+
+    def render(self, offset_maps: dict[str, str] | None = None) -> str:
+        op_str = self.op_str
+        if offset_maps is not None and self.offset is not None:
+            op_str = op_str.replace(self.offset, offset_maps[self.offset])
+        return f"        {self.mnemonic} {op_str}\n"
 
 
 class SP:
-    def __init__(self, raw_bytes: bytes, id: int, capstone: Cs):
-        """Disassembles an SP from bytes using Capstone, and finds potential convertible offsets."""
-        print(f"{BLUE_TEXT}Disassembling SP {id}...{CLEAR_TEXT}")
+    def __init__(
+        self, raw_bytes: bytes, id: int, capstone: Cs, cached_offsets: dict[str, str] | None = None, log: bool = True
+    ):
+        """Disassembles an SP from bytes using Capstone, and finds potential convertible offsets.
+        If the SP's convertible offsets are already known (see SPCache), pass them as {offset: overlay name} and disassembly is put off until the source is needed.
+        Pass log=False to disassemble without printing anything, e.g. in a worker process."""
         self.id = id
-        disassembled = capstone.disasm_lite(raw_bytes, PROC_START_ADDRESS_EU)
-        # Entry in convertible_offsets: { address: (overlay, [line_nums])}
-        self.source = f'.relativeinclude on\n.nds\n.arm\n\n; File creation\n.create "./code_out.bin", {PROC_START_ADDRESS_EU_STR}\n    .org {PROC_START_ADDRESS_EU_STR}\n'
-        self.convertible_offsets = {PROC_START_ADDRESS_EU_STR[2:]: (AddressOverlay.OVERLAY_11, [5, 6])}
-        load_addresses = []
-        for instruction in disassembled:
+        self.raw_bytes = bytes(raw_bytes)
+        self.code_hash = sp_code_hash(self.raw_bytes)
+        self.capstone = capstone
+        self.instructions = None
+        if cached_offsets is None:
+            self.disassemble(log)
+        else:
+            self.convertible_offsets = {
+                offset: (AddressOverlay[overlay_name], []) for offset, overlay_name in cached_offsets.items()
+            }
+
+    def __getstate__(self):
+        # Capstone handles can't be pickled. SPs disassembled in another process get the receiving side's handle (see SPConverter.prepare_all).
+        state = dict(self.__dict__)
+        state.update({"capstone": None})
+        if self.instructions is not None:
+            # Plain tuples pickle much faster than objects
+            state.update(
+                {
+                    "instructions": [
+                        (instruction.address, instruction.mnemonic, instruction.op_str, instruction.offset)
+                        for instruction in self.instructions
+                    ]
+                }
+            )
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.instructions is not None:
+            self.instructions = [SPInstruction(*instruction) for instruction in self.instructions]
+
+    def disassemble(self, log: bool = True):
+        if log:
+            print(f"{BLUE_TEXT}Disassembling SP {self.id}...{CLEAR_TEXT}")
+        raw_bytes = self.raw_bytes
+        self.instructions = []
+        # Entry in convertible_offsets: { address: (overlay, [instruction indexes])}
+        # The start address is used by the header rather than an instruction (see render).
+        self.convertible_offsets = {PROC_START_ADDRESS_EU_STR[2:]: (AddressOverlay.OVERLAY_11, [])}
+        disassembled = disassemble(raw_bytes, self.capstone)
+        # First pass: find every literal pool word, so loads from a pool that comes before the load are caught too.
+        pool_addresses = set()
+        for address, mnemonic, op_str in disassembled:
+            if mnemonic.startswith("ldr") and "[pc" in op_str:
+                pool_addresses.add(address + pool_load_offset(op_str) + 8)
+        # Second pass: build the instruction list, turning pool words into .words.
+        for address, mnemonic, op_str in disassembled:
+            if address in pool_addresses or mnemonic == ".word":
+                # This is a pool address! Convert it to a .word!
+                offset = address - PROC_START_ADDRESS_EU
+                raw_hex = raw_bytes[offset : offset + 4][::-1].hex()
+                self.add_instruction(".word", f"0x{raw_hex}", address, raw_hex)
+            elif mnemonic == ".byte":
+                self.add_instruction(mnemonic, op_str, address)
+            elif mnemonic.startswith("ldr") and "[pc" in op_str:
+                # this is a pool load
+                self.add_instruction(mnemonic, op_str, address)
+            # Check for BL/B functions. Currently we do this by filtering to starting with 'b', and then making sure no letters from "non-bl/b" instructions are present. Jank but if it works it works?
+            elif (
+                mnemonic.startswith("b")
+                and "f" not in mnemonic
+                and "i" not in mnemonic
+                and "k" not in mnemonic
+                and "x" not in mnemonic
+            ):
+                self.add_instruction(mnemonic, op_str, address, op_str[3:])
+            else:
+                self.add_instruction(mnemonic, op_str, address)
+
+    def add_instruction(self, mnemonic: str, op_str: str, address: int, potential_offset: str | None = None):
+        instruction = SPInstruction(address, mnemonic, op_str)
+        if potential_offset is not None and self.try_add_new_offset(potential_offset, len(self.instructions)):
+            instruction.offset = potential_offset
+        self.instructions.append(instruction)
+
+    def try_add_new_offset(self, offset: str, index: int) -> bool:
+        """Checks if an offset is convertible. If it is, it'll either add the instruction to an existing entry for the offset, or make a new entry if one doesn't already exist for this offset. Returns whether the offset is convertible."""
+        if offset in self.convertible_offsets:
+            self.convertible_offsets[offset][1].append(index)
+            return True
+        overlay = overlay_of_offset(int(offset, 16))
+        if overlay != AddressOverlay.UNKNOWN:
+            self.convertible_offsets.update({offset: (overlay, [index])})
+            return True
+        return False
+
+    def offsets_to_cache(self) -> dict[str, str]:
+        return {offset: overlay.name for offset, (overlay, _) in self.convertible_offsets.items()}
+
+    @property
+    def source(self) -> str:
+        """The SP's armips source, with its original offsets."""
+        return self.render()
+
+    def render(self, offset_maps: dict[str, str] | None = None, output_file: str = SP_OUTPUT_FILE) -> str:
+        """Generates armips source for the SP, which assembles to output_file. If offset maps are given, every convertible offset is replaced with the offset it maps to."""
+        if self.instructions is None:
+            self.disassemble()
+        start_address = PROC_START_ADDRESS_EU_STR
+        if offset_maps is not None:
+            start_address = "0x" + offset_maps[PROC_START_ADDRESS_EU_STR[2:]]
+        lines = [
+            f'.relativeinclude on\n.nds\n.arm\n\n; File creation\n.create "{output_file}", {start_address}\n    .org {start_address}\n'
+        ]
+        lines += [instruction.render(offset_maps) for instruction in self.instructions]
+        lines.append(".close")
+        return "".join(lines)
+
+    def apply_offsets(self, offset_maps: dict[str, str], output_file: str = SP_OUTPUT_FILE) -> str:
+        """Given a map of old offsets to new offsets, generates a new source with the converted offsets from the original source."""
+        return self.render(offset_maps, output_file)
+
+    def relocate(self, offset_maps: dict[str, str]) -> bytes | None:
+        """Converts the SP by patching its code directly, without going through armips: pool words get the value they map to, and branches are re-encoded for the SP's new address.
+        Everything else is position independent and kept as is. Returns None if the SP contains something this can't handle, in which case it has to be assembled instead."""
+        if self.instructions is None:
+            self.disassemble()
+        new_start = int(offset_maps[PROC_START_ADDRESS_EU_STR[2:]], 16)
+        code = bytearray(self.raw_bytes)
+        for instruction in self.instructions:
+            position = instruction.address - PROC_START_ADDRESS_EU
+            if instruction.mnemonic == ".byte":
+                continue
+            word = int.from_bytes(code[position : position + 4], "little")
+            if instruction.mnemonic == ".word":
+                if instruction.offset is None:
+                    continue
+                word = int(offset_maps[instruction.offset], 16)
+            elif (word >> 25) & 0b111 == 0b101:
+                # B, BL or BLX with an immediate
+                word = relocate_branch(word, instruction.address, new_start + position, instruction.offset, offset_maps)
+            else:
+                continue
+            if word is None or word > 0xFFFFFFFF:
+                return None
+            code[position : position + 4] = word.to_bytes(4, "little")
+        return bytes(code)
+
+
+def relocate_branch(
+    word: int, old_address: int, new_address: int, target_offset: str | None, offset_maps: dict[str, str]
+) -> int | None:
+    """Re-encodes a B, BL or BLX (immediate) instruction that moves from old_address to new_address. Its target moves to the offset it maps to if it's a convertible offset, and stays where it is otherwise.
+    Returns None if the new target can't be encoded."""
+    is_blx = word >> 28 == 0xF
+    relative = (((word & 0xFFFFFF) ^ 0x800000) - 0x800000) << 2  # Sign extend
+    if is_blx:
+        relative += ((word >> 24) & 1) << 1
+    target = old_address + 8 + relative
+    if target_offset is not None:
+        target = int(offset_maps[target_offset], 16)
+    relative = target - (new_address + 8)
+    if relative & (1 if is_blx else 3) != 0 or not -(1 << 25) <= relative < (1 << 25):
+        return None
+    immediate = (relative >> 2) & 0xFFFFFF
+    if is_blx:
+        return 0xFA000000 | (((relative >> 1) & 1) << 24) | immediate
+    return (word & 0xFF000000) | immediate
+
+
+def init_disassembly_worker():
+    global worker_capstone
+    worker_capstone = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+
+
+def disassemble_sp(job: tuple[int, bytes]) -> SP:
+    """Runs in a worker process of SPConverter.prepare_all."""
+    id, effect_code = job
+    return SP(effect_code, id, worker_capstone, log=False)
+
+
+def disassemble(raw_bytes: bytes, capstone: Cs) -> list[tuple[int, str, str]]:
+    """Disassembles an SP into (address, mnemonic, op_str) tuples. Capstone stops at the first word it can't decode, which is data (usually in a literal pool), so those words are kept as .words and disassembly carries on after them."""
+    disassembled = []
+    offset = 0
+    while offset < len(raw_bytes):
+        for instruction in capstone.disasm_lite(raw_bytes[offset:], PROC_START_ADDRESS_EU + offset):
             # instruction[0]: address
             # instruction[1]: size
             # instruction[2]: mnemonic
             # instruction[3]: op_str
-            address = instruction[0]
             if instruction[1] != 4:
                 raise ValueError(
                     "A disassembled SP instruction wasn't length 4! Pilgrim does not know how to handle this!"
                 )
-            mnemonic = instruction[2]
-            mnemonic = mnemonic.replace("ldm", "ldmia")
-            op_str = instruction[3]
-            # NOTE: this idea of detecting pool loads probably breaks if the load falls AFTER the address its loading from. might be worth reworking this to just do a second pass over everything.
-            if address in load_addresses:
-                # This is a pool address! Convert it to a .word!
-                offset = address - PROC_START_ADDRESS_EU
-                # Next two lines might be optimizable
-                raw_val = raw_bytes[offset : offset + 4]
-                raw_hex = raw_val[::-1].hex()
-                self.try_add_new_offset(raw_hex, self.source.count("\n"))
-                self.source += f"        .word 0x{raw_hex}\n"
-            else:
-                if mnemonic.startswith("ldr") and "[pc" in op_str:
-                    # this is a pool load
-                    offset = int(op_str.split("#")[-1][:-1], 16) + 8
-                    load_addresses.append(address + offset)
-                # Check for BL/B functions. Currently we do this by filtering to starting with 'b', and then making sure no letters from "non-bl/b" instructions are present. Jank but if it works it works?
-                elif (
-                    mnemonic.startswith("b")
-                    and "f" not in mnemonic
-                    and "i" not in mnemonic
-                    and "k" not in mnemonic
-                    and "x" not in mnemonic
-                ):
-                    potential_offset = op_str[3:]
-                    self.try_add_new_offset(potential_offset, self.source.count("\n"))
-                # TODO: Determine how Capstone decompiles words that aren't valid instructions. Is it just .word like armips? Please tell me it is.
-                self.source += f"        {mnemonic} {op_str}\n"
-        self.source += ".close"
-        # print(self.source)
-        # print(self.convertible_offsets)
-
-    def try_add_new_offset(self, offset: str, line: int):
-        """Checks if an offset is convertible. If it is, it'll either add the line to an existing entry for the offset, or make a new entry if one doesn't already exist for this offset."""
-        if offset in self.convertible_offsets.keys():
-            self.convertible_offsets[offset][1].append(line)
-        else:
-            overlay = overlay_of_offset(int(offset, 16))
-            if overlay != AddressOverlay.UNKNOWN:
-                self.convertible_offsets.update({offset: (overlay, [line])})
+            disassembled.append((instruction[0], instruction[2].replace("ldm", "ldmia"), instruction[3]))
+            offset += 4
+        if len(raw_bytes) - offset >= 4:
+            disassembled.append((PROC_START_ADDRESS_EU + offset, ".word", ""))
+            offset += 4
+        elif offset < len(raw_bytes):
+            trailing_bytes = ", ".join(hex(byte) for byte in raw_bytes[offset:])
+            disassembled.append((PROC_START_ADDRESS_EU + offset, ".byte", trailing_bytes))
+            offset = len(raw_bytes)
+    return disassembled
 
-    def apply_offsets(self, offset_maps: dict[str, str]) -> str:
-        """Given a map of old offsets to new offsets, generates a new source with the converted offsets from the original source."""
-        lines = self.source.splitlines(True)
-        for convertible_offset in self.convertible_offsets:
-            lines_to_edit = self.convertible_offsets[convertible_offset][1]
-            for line_num in lines_to_edit:
-                lines[line_num] = lines[line_num].replace(convertible_offset, offset_maps[convertible_offset])
-        converted_source = ""
-        for line in lines:
-            converted_source += line
-        return converted_source
+
+def pool_load_offset(op_str: str) -> int:
+    """Returns the offset from pc of a pc-relative load like "r0, [pc, #0x10]"."""
+    if "#" not in op_str:
+        return 0  # [pc]
+    return int(op_str.split("#")[-1][:-1], 16)
 
 
 class SPConverter:
@@ -110,24 +278,51 @@ class SPConverter:
         self.offset_mapper = OffsetMapper()
         self.config = config
         self.offset_maps = None
+        self.cache = SPCache(config)
+        self.direct_relocation = True  # Set to False to always convert SPs by reassembling them with armips
 
-    def prepare_all(self):
-        for i in range(FIRST_CUSTOM_SP_ID, len(self.data_cd.effects_code)):
-            self.prepare_sp(i)
+    def prepare_all(self, workers: int | None = None):
+        """Disassembles every custom SP and collects their convertible offsets. If there are enough SPs to disassemble, they're spread across a process pool (of workers processes, by default one per CPU).
+        Results are merged in SP order either way, so the outcome is the same as disassembling them one by one."""
+        sp_ids = range(FIRST_CUSTOM_SP_ID, len(self.data_cd.effects_code))
+        effect_codes = {id: bytes(self.data_cd.get_effect_code(id)) for id in sp_ids}
+        to_disassemble = [id for id in sp_ids if self.cache.get_offsets(sp_code_hash(effect_codes[id])) is None]
+        disassembled = {}
+        if workers is None:
+            workers = cpu_count()
+        if len(to_disassemble) >= PARALLEL_DISASSEMBLY_MIN_SPS and workers is not None and workers > 1:
+            print(f"{BLUE_TEXT}Disassembling {len(to_disassemble)} SPs in parallel...{CLEAR_TEXT}")
+            with (
+                span(f"Disassemble {len(to_disassemble)} SPs in parallel", "sp_disassemble"),
+                ProcessPoolExecutor(max_workers=workers, initializer=init_disassembly_worker) as executor,
+            ):
+                sps = executor.map(
+                    disassemble_sp,
+                    [(id, effect_codes[id]) for id in to_disassemble],
+                    chunksize=PARALLEL_DISASSEMBLY_CHUNK_SIZE,
+                )
+                disassembled = dict(zip(to_disassemble, sps))
+        for id in sp_ids:
+            self.prepare_sp(id, effect_codes[id], disassembled.get(id))
+        self.cache.save_offsets()
 
-    def prepare_sp(self, id: int):
-        """Disassemble an SP and find any new convertible offsets."""
-        effect_code = bytearray(self.data_cd.get_effect_code(id))
-        sp = SP(effect_code, id, self.cs)
+    def prepare_sp(self, id: int, effect_code: bytes | None = None, sp: SP | None = None):
+        """Disassemble an SP and find any new convertible offsets. SPs whose offsets are cached aren't disassembled. Pass sp if it was already disassembled elsewhere."""
+        if effect_code is None:
+            effect_code = bytes(self.data_cd.get_effect_code(id))
+        code_hash = sp_code_hash(effect_code)
+        cached_offsets = self.cache.get_offsets(code_hash)
+        if sp is not None:
+            sp.capstone = self.cs
+        else:
+            with span(f"SP {id}", "sp_disassemble", cached=cached_offsets is not None):
+                sp = SP(effect_code, id, self.cs, cached_offsets)
+        if cached_offsets is None:
+            self.cache.set_offsets(code_hash, sp.offsets_to_cache())
         self.sps.append(sp)
-        new_convertible_offsets = [
-            offset for offset in sp.convertible_offsets.keys() if offset not in self.all_convertible_offsets.keys()
-        ]
-        for new_convertible_offset in new_convertible_offsets:
-            # add {offset: overlay}
-            self.all_convertible_offsets.update(
-                {new_convertible_offset: sp.convertible_offsets[new_convertible_offset][0]}
-            )
+        for offset, (overlay, _) in sp.convertible_offsets.items():
+            # add {offset: overlay}, keeping the first SP's entry for offsets that were already found
+            self.all_convertible_offsets.setdefault(offset, overlay)
 
     def log_convertible_offsets(self):
         for convertible_offset in self.all_convertible_offsets:
@@ -158,17 +353,14 @@ class SPConverter:
             if offset_maps is None:
                 offset_maps = {}
             missing_offsets = []
-            for eu_offset in self.all_convertible_offsets:
-                if eu_offset not in offset_maps:
-                    try:
-                        na_offset = self.offset_mapper.find_na_offset(
-                            int(eu_offset, 16)
-                        )[
-                            2:
-                        ]  # This [2:] is just to remove the 0x at the start, because otherwise we have 2 0xs and everything explodes.
-                        offset_maps.update({eu_offset: na_offset})
-                    except UnmappableOffsetException:
-                        missing_offsets.append(eu_offset)
+            unmapped_offsets = [eu_offset for eu_offset in self.all_convertible_offsets if eu_offset not in offset_maps]
+            na_offsets = self.offset_mapper.find_na_offsets(int(eu_offset, 16) for eu_offset in unmapped_offsets)
+            for eu_offset, na_offset in zip(unmapped_offsets, na_offsets):
+                if na_offset is None:
+                    missing_offsets.append(eu_offset)
+                else:
+                    # This [2:] is just to remove the 0x at the start, because otherwise we have 2 0xs and everything explodes.
+                    offset_maps.update({eu_offset: na_offset[2:]})
             if len(missing_offsets) != 0:  # Abort because some offsets couldn't be found
                 print(
                     f"{len(missing_offsets)} offsets could not be automatically converted! Please find them manually and provide them through config. Missing offsets:"
@@ -190,15 +382,49 @@ class SPConverter:
                 "BALANCE/process.bin couldn't be found in the output ROM. Is ExtractSPCode applied?"
             )
         out_data_cd = DataCD(process_bin)
+        # SPs that were converted with the same offsets before are taken from the cache.
+        assembled = {}
+        binary_keys = {}
         for sp in self.sps:
-            print(f"{BLUE_TEXT}Converting and importing SP {sp.id}...{CLEAR_TEXT}")
-            while sp.id >= len(out_data_cd.effects_code):
-                out_data_cd.add_effect_code(bytes("TEMP", "ascii"))
-            applied_offsets = sp.apply_offsets(self.offset_maps)
+            sp_offset_maps = {offset: self.offset_maps[offset] for offset in sp.convertible_offsets}
+            binary_keys[sp.id] = self.cache.binary_key(sp.code_hash, sp_offset_maps)
+            cached_binary = self.cache.get_binary(binary_keys[sp.id])
+            if cached_binary is not None:
+                assembled[sp.id] = cached_binary
+        to_convert = [sp for sp in self.sps if sp.id not in assembled]
+        print(
+            f"{BLUE_TEXT}Converting {len(to_convert)} SPs...{CLEAR_TEXT} ({len(assembled)} unchanged since they were last converted)"
+        )
+        # Most SPs can be converted by patching their code directly. Only the rest need armips.
+        newly_converted = {}
+        to_assemble = []
+        for sp in to_convert:
+            with span(f"SP {sp.id}", "sp_relocate"):
+                relocated = sp.relocate(self.offset_maps) if self.direct_relocation else None
+            if relocated is None:
+                to_assemble.append(sp)
+            else:
+                newly_converted[sp.id] = relocated
+        if len(to_assemble) > 0:
+            print(f"{BLUE_TEXT}Assembling {len(to_assemble)} SPs that couldn't be relocated directly...{CLEAR_TEXT}")
+            sources = {sp.id: sp.apply_offsets(self.offset_maps, sp_output_file(sp.id)) for sp in to_assemble}
+            # Assemble everything with one armips run, rather than one per SP.
             try:
-                out_data_cd.import_armips_effect_code(sp.id, applied_offsets)
-            except Exception as e:
-                print(
-                    f"{RED_TEXT}Error encountered! SP source is as follows:\n{applied_offsets}\nOriginal error:\n{e}{CLEAR_TEXT}"
-                )
+                newly_converted.update(assemble_sps(sources))
+            except SPAssemblyError as e:
+                if len(e.failed_ids) == 0:
+                    print(f"{RED_TEXT}Error encountered! Original error:\n{e}\n{e.output}{CLEAR_TEXT}")
+                for id in e.failed_ids:
+                    print(
+                        f"{RED_TEXT}Error encountered in SP {id}! SP source is as follows:\n{sources[id]}\nOriginal error:\n{e.output_for(id)}{CLEAR_TEXT}"
+                    )
                 exit(1)
+        for id, code in newly_converted.items():
+            self.cache.set_binary(binary_keys[id], code)
+        assembled.update(newly_converted)
+        for sp in self.sps:
+            print(f"{BLUE_TEXT}Importing SP {sp.id}...{CLEAR_TEXT}")
+            while sp.id >= len(out_data_cd.effects_code):
+                out_data_cd.add_effect_code(bytes("TEMP", "ascii"))
+            out_data_cd.set_effect_code(sp.id, assembled[sp.id])
+        output_rom.setFileByName(PROCESS_BIN_PATH, DataCDHandler.serialize(out_data_cd))
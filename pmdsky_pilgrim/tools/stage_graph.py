@@ -0,0 +1,102 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from hashlib import sha256, blake2b
+from json import dumps
+from os import listdir, stat
+from os.path import join, dirname, abspath
+from ndspy.rom import NintendoDSRom
+from .cache import project_cache_dir, read_pickle, write_pickle
+from .colors import GREEN_TEXT, CLEAR_TEXT
+from .profiler import span
+from .rom_changes import RomSnapshot
+from .vanilla_cache import dependency_version
+
+STAGE_CACHE_FOLDER = "stages"
+# Bump this if the format of saved stage results changes.
+STAGE_GRAPH_VERSION = 1
+
+
+class StageGraph:
+    """Runs the porting pipeline as a chain of stages. A stage declares its inputs, the stages it builds on, and the ROMs it modifies.
+    The result of every stage is saved in the project's cache along with the changes it made to those ROMs, so if none of its inputs changed since the last run, it's skipped and its changes are replayed instead.
+    """
+
+    def __init__(self, config, roms: dict):
+        self.cache_dir = project_cache_dir(config, STAGE_CACHE_FOLDER)
+        self.roms = roms  # ROM key: LoadedRom
+        self.keys = {}  # stage name: key it ran (or was restored) with this run
+        self.skipped = []
+        self.common_inputs = [STAGE_GRAPH_VERSION, dependency_version("skytemple-files"), pilgrim_fingerprint()]
+
+    def run(
+        self, name: str, inputs: list, build, depends_on: list[str] | None = None, modifies: list[str] | None = None
+    ):
+        """Runs one stage. inputs must be JSON serializable (anything else is hashed by its string form). build() does the stage's work and returns its result, which must be picklable.
+        depends_on lists the stages whose results or ROM changes this stage relies on, and modifies lists the keys of the ROMs the stage changes. Returns the stage's result."""
+        if depends_on is None:
+            depends_on = []
+        if modifies is None:
+            modifies = []
+        key = self.stage_key(name, inputs, depends_on)
+        saved_path = join(self.cache_dir, f"{name}.pickle")
+        saved = read_pickle(saved_path)
+        if saved is not None and saved["key"] == key:
+            print(f"{GREEN_TEXT}{name} is unchanged since the last run! Skipping...{CLEAR_TEXT}")
+            with span(f"{name} (replayed)"):
+                for rom_key, changes in saved["changes"].items():
+                    changes.apply_to(self.roms[rom_key].rom)
+            self.skipped.append(name)
+            result = saved["result"]
+        else:
+            with span(name):
+                snapshots = {rom_key: RomSnapshot(self.roms[rom_key].rom) for rom_key in modifies}
+                result = build()
+                changes = {rom_key: snapshot.changes(self.roms[rom_key].rom) for rom_key, snapshot in snapshots.items()}
+                write_pickle(saved_path, {"key": key, "result": result, "changes": changes})
+        self.keys[name] = key
+        return result
+
+    def stage_key(self, name: str, inputs: list, depends_on: list[str]) -> str:
+        # A stage's key covers the keys of the stages before it, so a change anywhere upstream reruns everything downstream of it.
+        key_source = dumps(
+            [name, self.common_inputs, [self.keys[stage] for stage in depends_on], inputs], sort_keys=True, default=str
+        )
+        return sha256(key_source.encode("utf-8")).hexdigest()
+
+
+def rom_file_digest(rom: NintendoDSRom, path: str) -> str | None:
+    """Hashes a single file of a ROM, so a stage that only reads that file doesn't rerun when the rest of the ROM changes. Returns None if the file doesn't exist."""
+    try:
+        return blake2b(rom.getFileByName(path), digest_size=16).hexdigest()
+    except ValueError:
+        return None
+
+
+def rom_folder_digest(rom: NintendoDSRom, folder_path: str) -> str | None:
+    """Hashes the names and contents of every file in a folder of a ROM (not including subfolders). Returns None if the folder doesn't exist."""
+    try:
+        folder = rom.filenames[folder_path]
+    except KeyError:
+        return None
+    digest = blake2b(digest_size=16)
+    for i, file_name in enumerate(folder.files):
+        data = rom.files[folder.firstID + i]
+        digest.update(f"{file_name}:{len(data)}:".encode("utf-8"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def pilgrim_fingerprint() -> str:
+    """Identifies the version of Pilgrim's own code by the size and modification time of its modules, so editing Pilgrim invalidates saved stages."""
+    tools_dir = dirname(abspath(__file__))
+    fingerprint = []
+    for folder in (tools_dir, dirname(tools_dir)):
+        for file_name in sorted(listdir(folder)):
+            if file_name.endswith(".py"):
+                file_stat = stat(join(folder, file_name))
+                fingerprint.append(f"{file_name}:{file_stat.st_size:x}:{file_stat.st_mtime_ns:x}")
+    return ";".join(fingerprint)
@@ -0,0 +1,174 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+# Compiles the symbol tables of pmdsky-debug-py into one binary file, so OffsetMapper doesn't need to import the (huge) pmdsky_debug_py modules on every run.
+# Layout, all integers in native byte order:
+#   Header (see SYMBOL_TABLE_HEADER)
+#   Section bounds: 2 u32s per section, the slice of the address arrays that belongs to that section
+#   Segment starts: 1 u32 per segment
+#   Segment sections: 1 i32 per segment, the section that owns the segment (-1 for none)
+#   EU addresses: 1 u32 per symbol, sorted within each section
+#   NA addresses: 1 u32 per symbol
+#   String offsets: 1 u32 per section name, then 1 u32 per symbol name, plus one for the end of the string table
+#   String table: every name in UTF-8, back to back
+# Run this file directly to (re)build the table ahead of time.
+
+import sys
+from array import array
+from mmap import mmap, ACCESS_READ
+from importlib.util import find_spec
+from os import replace, getpid, stat
+from os.path import join, dirname
+from struct import Struct
+from .cache import user_cache_dir
+
+SYMBOL_TABLE_MAGIC = b"PLGRSYMS"
+SYMBOL_TABLE_FORMAT_VERSION = 1
+SYMBOL_SOURCE_FILES = ["eu.py", "na.py"]
+SYMBOL_TABLE_FILE = "symbol_table.bin"
+BYTE_ORDER_MARK = 0x01020304
+# magic, format version, byte order mark, fingerprint of the pmdsky-debug-py install, section count, segment count, symbol count, string table size
+SYMBOL_TABLE_HEADER = Struct("=8sII64sIIII")
+
+
+class StringTable:
+    """A read-only list of names, decoded from the string table only when accessed."""
+
+    def __init__(self, offsets: memoryview, strings: memoryview, first: int, count: int):
+        self.offsets = offsets
+        self.strings = strings
+        self.first = first
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0 or i >= self.count:
+            raise IndexError("String table index out of range")
+        i += self.first
+        return str(self.strings[self.offsets[i] : self.offsets[i + 1]], "utf-8")
+
+
+def symbol_source_fingerprint() -> bytes:
+    """Identifies the installed pmdsky_debug_py symbol files by size and modification time, without importing them (which is the slow part we're trying to skip)."""
+    spec = find_spec("pmdsky_debug_py")
+    if spec is None or spec.origin is None:
+        return b""
+    fingerprint = []
+    for source_file in SYMBOL_SOURCE_FILES:
+        source_stat = stat(join(dirname(spec.origin), source_file))
+        fingerprint.append(f"{source_stat.st_size:x}:{source_stat.st_mtime_ns:x}")
+    return ";".join(fingerprint).encode("ascii")
+
+
+def symbol_table_path() -> str:
+    return join(user_cache_dir("symbols"), SYMBOL_TABLE_FILE)
+
+
+def write_symbol_table(index: dict, path: str):
+    """Writes the data of a SymbolIndex (see find_offset.build_symbol_index) to a binary symbol table file."""
+    names = list(index["section_names"]) + list(index["symbol_names"])
+    string_offsets = array("I", [0])
+    strings = bytearray()
+    for name in names:
+        strings += name.encode("utf-8")
+        string_offsets.append(len(strings))
+    section_bounds = array("I")
+    for section_start, section_end in index["section_bounds"]:
+        section_bounds.append(section_start)
+        section_bounds.append(section_end)
+    header = SYMBOL_TABLE_HEADER.pack(
+        SYMBOL_TABLE_MAGIC,
+        SYMBOL_TABLE_FORMAT_VERSION,
+        BYTE_ORDER_MARK,
+        symbol_source_fingerprint(),
+        len(index["section_names"]),
+        len(index["segment_starts"]),
+        len(index["eu_addresses"]),
+        len(strings),
+    )
+    tmp_path = f"{path}.{getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for table in (
+            section_bounds,
+            array("I", index["segment_starts"]),
+            array("i", index["segment_sections"]),
+            array("I", index["eu_addresses"]),
+            array("I", index["na_addresses"]),
+            string_offsets,
+        ):
+            f.write(table.tobytes())
+        f.write(strings)
+    replace(tmp_path, path)
+
+
+def load_symbol_table(path: str) -> dict | None:
+    """Memory-maps a symbol table file and returns the data for a SymbolIndex. Returns None if the file is missing, broken, or was built from a different install of pmdsky-debug-py."""
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap(f.fileno(), 0, access=ACCESS_READ)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+    if len(mapped) < SYMBOL_TABLE_HEADER.size:
+        return None
+    magic, format_version, byte_order_mark, built_for, n_sections, n_segments, n_symbols, strings_size = (
+        SYMBOL_TABLE_HEADER.unpack_from(mapped)
+    )
+    if (
+        magic != SYMBOL_TABLE_MAGIC
+        or format_version != SYMBOL_TABLE_FORMAT_VERSION
+        or byte_order_mark != BYTE_ORDER_MARK
+        or built_for.rstrip(b"\0") != symbol_source_fingerprint()
+    ):
+        return None
+    expected_size = SYMBOL_TABLE_HEADER.size + 4 * (3 * n_sections + 2 * n_segments + 3 * n_symbols + 1) + strings_size
+    if len(mapped) != expected_size:
+        return None
+    view = memoryview(mapped)
+    position = SYMBOL_TABLE_HEADER.size
+
+    def take(count: int, format: str) -> memoryview:
+        nonlocal position
+        table = view[position : position + count * 4].cast(format)
+        position += count * 4
+        return table
+
+    section_bounds = take(n_sections * 2, "I")
+    segment_starts = take(n_segments, "I")
+    segment_sections = take(n_segments, "i")
+    eu_addresses = take(n_symbols, "I")
+    na_addresses = take(n_symbols, "I")
+    string_offsets = take(n_sections + n_symbols + 1, "I")
+    strings = view[position : position + strings_size]
+    section_names = StringTable(string_offsets, strings, 0, n_sections)
+    return {
+        "section_names": [section_names[i] for i in range(n_sections)],
+        "section_bounds": [(section_bounds[i * 2], section_bounds[i * 2 + 1]) for i in range(n_sections)],
+        "segment_starts": segment_starts,
+        "segment_sections": segment_sections,
+        "eu_addresses": eu_addresses,
+        "na_addresses": na_addresses,
+        "symbol_names": StringTable(string_offsets, strings, n_sections, n_symbols),
+    }
+
+
+def compile_symbol_table(path: str | None = None) -> dict:
+    """Builds the symbol index from pmdsky_debug_py and saves it as a symbol table file. Returns the index data."""
+    from .find_offset import build_symbol_index
+
+    if path is None:
+        path = symbol_table_path()
+    index = build_symbol_index()
+    write_symbol_table(index, path)
+    return index
+
+
+if __name__ == "__main__":
+    output_path = sys.argv[1] if len(sys.argv) > 1 else symbol_table_path()
+    compile_symbol_table(output_path)
+    print(f"Symbol table written to {output_path}")
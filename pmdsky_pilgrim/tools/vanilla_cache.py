@@ -0,0 +1,43 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from importlib.metadata import version, PackageNotFoundError
+from os.path import join
+from .cache import user_cache_dir, read_pickle, write_pickle
+from .hash_validation import VANILLA_EU_SHA256, VANILLA_NA_SHA256
+
+# Bump this if the format of any cached artifact changes.
+VANILLA_CACHE_VERSION = 1
+
+
+def dependency_version(package: str) -> str:
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class VanillaCache:
+    """Artifacts derived from one of the two known vanilla ROMs. Since Pilgrim only accepts those exact ROMs, these are stored per-user and shared by every project on the machine."""
+
+    def __init__(self, sha256: str | None):
+        # Anything that isn't a known vanilla ROM (e.g. when hashes are ignored) isn't cached at all.
+        self.enabled = sha256 in (VANILLA_EU_SHA256, VANILLA_NA_SHA256)
+        self.sha256 = sha256
+
+    def get(self, name: str, build, dependency: str = "skytemple-files"):
+        """Returns the cached artifact with the given name, or builds and caches it with build() if it doesn't exist yet. Artifacts are invalidated when the version of the dependency that produced them changes."""
+        if not self.enabled:
+            return build()
+        artifact_path = join(
+            user_cache_dir(self.sha256),
+            f"{name}-{dependency}-{dependency_version(dependency)}-v{VANILLA_CACHE_VERSION}.pickle",
+        )
+        artifact = read_pickle(artifact_path)
+        if artifact is None:
+            artifact = build()
+            write_pickle(artifact_path, artifact)
+        return artifact
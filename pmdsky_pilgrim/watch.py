@@ -0,0 +1,136 @@
+#  Copyright 2025 Chesyon
+#
+#  This source code is licensed under the MIT license: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_MIT
+#  However, the distribution is licensed under GPLv3: https://github.com/Chesyon/Pilgrim/blob/main/LICENSE_GPLv3
+#  For a non-legalese version of what this means, see https://chesyon.me/eos-licenses.html.
+
+from os import listdir, stat
+from os.path import join, abspath, isdir
+from time import sleep, perf_counter
+from traceback import print_exc
+from pilgrim import port_and_profile
+from tools.colors import RED_TEXT, GREEN_TEXT, YELLOW_TEXT, BLUE_TEXT, CLEAR_TEXT, BOLD_TEXT
+
+# --watch ports the project again whenever its inputs change. The input ROMs stay loaded between runs (and are only
+# read again if their files change), and the stage graph skips every stage whose inputs didn't change.
+# Files are polled rather than watched with OS notifications, so this works the same everywhere without extra dependencies.
+
+POLL_INTERVAL = 0.5  # Seconds between checks for changes
+DEBOUNCE_TIME = 1.0  # Seconds without further changes before rerunning, so saving many files (or a ROM being written) only reruns once
+WATCHED_FILES = ["config.yml"]
+WATCHED_FOLDERS = ["skypatches"]
+WATCHED_ROMS = ["Vanilla EU", "Vanilla NA", "Mod EU"]  # Never Mod NA, which Pilgrim writes itself
+
+
+def watch(args):
+    """Ports the project at args.project_dir, then again every time its config, skypatches or input ROMs change, until interrupted."""
+    shared_roms = {}  # Absolute path: LoadedRom, kept unmodified for the next run
+    try:
+        while True:
+            state = watched_state(args.project_dir)
+            run_once(args, shared_roms)
+            print(f"{BLUE_TEXT}Watching {args.project_dir} for changes... (Ctrl+C to stop){CLEAR_TEXT}")
+            changed = wait_for_changes(args.project_dir, state)
+            print(f"{YELLOW_TEXT}{BOLD_TEXT}Changed: {', '.join(changed)}{CLEAR_TEXT}")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def run_once(args, shared_roms: dict):
+    """Ports the project once. Errors are printed instead of ending the watch, since the next change may fix them."""
+    start = perf_counter()
+    try:
+        refresh_shared_roms(args.project_dir, shared_roms, args.rehash)
+        port_and_profile(args, shared_roms)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            print(f"{RED_TEXT}Port failed. Fix the issue and save to try again.{CLEAR_TEXT}")
+        return
+    except Exception:
+        print_exc()
+        print(f"{RED_TEXT}Port failed. Fix the issue and save to try again.{CLEAR_TEXT}")
+        return
+    print(f"{GREEN_TEXT}Port finished in {perf_counter() - start:.2f}s!{CLEAR_TEXT}")
+
+
+def refresh_shared_roms(project_dir: str, shared_roms: dict, rehash: bool):
+    """Loads any input ROM that isn't loaded yet or whose file changed, so port() can copy the rest from memory."""
+    from tools.hash_validation import file_identity, load_hash_cache, save_hash_cache, set_cached_sha256
+    from tools.project_loader import load_project
+    from tools.rom_loader import LoadedRom, get_rom_path, ingest_rom
+
+    config = load_project(project_dir)
+    if "Roms" not in config:
+        return  # port() reports this
+    hash_cache = load_hash_cache(config)
+    for key in WATCHED_ROMS:
+        rom_path = abspath(get_rom_path(config, key))
+        try:
+            identity = file_identity(rom_path)
+        except FileNotFoundError:
+            continue  # port() reports this
+        loaded = shared_roms.get(rom_path)
+        if loaded is None or loaded.identity != identity:
+            loaded = ingest_rom(LoadedRom(key, rom_path), hash_cache, rehash)
+            set_cached_sha256(hash_cache, rom_path, loaded.identity, loaded.sha256)
+            shared_roms[rom_path] = loaded
+    save_hash_cache(config, hash_cache)
+
+
+def watched_paths(project_dir: str) -> list[str]:
+    """Returns every file whose changes should cause a rerun."""
+    paths = [join(project_dir, file_name) for file_name in WATCHED_FILES]
+    for folder in WATCHED_FOLDERS:
+        folder_path = join(project_dir, folder)
+        if isdir(folder_path):
+            paths += [join(folder_path, file_name) for file_name in sorted(listdir(folder_path))]
+    paths += [join(project_dir, rom_path) for rom_path in watched_rom_paths(project_dir)]
+    return paths
+
+
+def watched_rom_paths(project_dir: str) -> list[str]:
+    """Reads the input ROM paths from config.yml. While the config can't be read (e.g. mid-edit), only the config itself is watched."""
+    from yaml import safe_load, YAMLError
+
+    try:
+        with open(join(project_dir, "config.yml")) as f:
+            config = safe_load(f)
+        return [config["Roms"][key] for key in WATCHED_ROMS if type(config["Roms"].get(key)) is str]
+    except (OSError, YAMLError, TypeError, KeyError, AttributeError):
+        return []
+
+
+def watched_state(project_dir: str) -> dict[str, tuple | None]:
+    """Returns {path: (size, mtime) or None if missing} for every watched file."""
+    state = {}
+    for file_path in watched_paths(project_dir):
+        try:
+            file_stat = stat(file_path)
+            state[file_path] = (file_stat.st_size, file_stat.st_mtime_ns)
+        except OSError:
+            state[file_path] = None
+    return state
+
+
+def changed_paths(old_state: dict, new_state: dict) -> list[str]:
+    return sorted(path for path in old_state.keys() | new_state.keys() if old_state.get(path) != new_state.get(path))
+
+
+def wait_for_changes(project_dir: str, state: dict) -> list[str]:
+    """Blocks until a watched file changes and then stays unchanged for DEBOUNCE_TIME. Returns the files that changed."""
+    settled_state = state
+    while settled_state == state:  # Changes that were undone before settling don't count
+        new_state = state
+        while new_state == state:
+            sleep(POLL_INTERVAL)
+            new_state = watched_state(project_dir)
+        # Wait for things to settle
+        settled_state = new_state
+        settled_since = perf_counter()
+        while perf_counter() - settled_since < DEBOUNCE_TIME:
+            sleep(POLL_INTERVAL)
+            new_state = watched_state(project_dir)
+            if new_state != settled_state:
+                settled_state = new_state
+                settled_since = perf_counter()
+    return changed_paths(state, settled_state)